@@ -7,10 +7,60 @@ For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
 
+import asyncio
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'constr_store.settings')
 
-application = get_asgi_application()
+
+class DisconnectMiddleware:
+    """Прерывает обработку HTTP-запроса, когда клиент отключился
+
+    Django 4.2 не слушает http.disconnect во время потокового ответа: поток
+    SSE или выгрузка фида продолжались бы до конца для закрытой вкладки.
+    Здесь receive читается параллельно с приложением, и по http.disconnect
+    задача приложения отменяется - блоки finally генераторов закрывают
+    подписки и временные файлы.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        messages = asyncio.Queue()
+        response_sent = False
+
+        async def listen():
+            while True:
+                message = await receive()
+                await messages.put(message)
+                if message['type'] == 'http.disconnect':
+                    return
+
+        async def send_wrapper(message):
+            nonlocal response_sent
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                response_sent = True
+
+        listener = asyncio.ensure_future(listen())
+        handler = asyncio.ensure_future(self.app(scope, messages.get, send_wrapper))
+        try:
+            await asyncio.wait({listener, handler}, return_when=asyncio.FIRST_COMPLETED)
+            # После полного ответа сервер тоже сообщает http.disconnect: даем Django закрыть ответ
+            if not handler.done() and not response_sent:
+                handler.cancel()
+            await asyncio.wait({handler})
+        finally:
+            listener.cancel()
+            handler.cancel()
+        if not handler.cancelled():
+            return handler.result()
+
+
+application = DisconnectMiddleware(get_asgi_application())
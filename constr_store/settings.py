@@ -72,6 +72,27 @@ except ImportError:
 except Exception:
     pass
 
+# ==================== CACHE ====================
+# По умолчанию локальный кэш процесса; в production задайте REDIS_URL,
+# чтобы все воркеры видели одни и те же версии каталога и счетчики
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+REDIS_URL = config('REDIS_URL', default='')
+
+if REDIS_URL:
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    }
+
+# События статуса заказов (SSE) между процессами идут через Redis Pub/Sub,
+# без REDIS_URL - только внутри процесса
+SHOP_EVENTS_TRANSPORT = 'shop.events.RedisTransport' if REDIS_URL else 'shop.events.LocalTransport'
+
 # ==================== APPLICATION DEFINITION ====================
 INSTALLED_APPS = [
     'django.contrib.admin',
@@ -108,6 +129,7 @@ MIDDLEWARE = [
     'allauth.account.middleware.AccountMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.middleware.CartCookieMiddleware',
 ]
 
 ROOT_URLCONF = 'constr_store.urls'
@@ -125,12 +147,14 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'shop.context_processors.shop_settings',
                 'shop.context_processors.tool_categories',
+                'shop.context_processors.cart_badge',
             ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'constr_store.wsgi.application'
+ASGI_APPLICATION = 'constr_store.asgi.application'
 
 # ==================== PASSWORD VALIDATION ====================
 AUTH_PASSWORD_VALIDATORS = [
@@ -165,6 +189,9 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Дисковый кэш sitemap и товарных фидов
+FEED_CACHE_DIR = BASE_DIR / 'cache' / 'feeds'
+
 # WhiteNoise configuration
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
@@ -190,8 +217,28 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 # ==================== TELEGRAM BOT SETTINGS ====================
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN', default='')
 TELEGRAM_ADMIN_CHAT_ID = config('TELEGRAM_ADMIN_CHAT_ID', default='')
+# Адрес Bot API (к нему дописывается токен); в тестах - локальный FakeBotAPIServer
+TELEGRAM_API_BASE_URL = config('TELEGRAM_API_BASE_URL', default='https://api.telegram.org/bot')
+# Секрет, переданный в setWebhook(secret_token=...): webhook отклоняет запросы без него
+TELEGRAM_WEBHOOK_SECRET = config('TELEGRAM_WEBHOOK_SECRET', default='')
+# Потоки и размер очереди для обработки обновлений webhook
+TELEGRAM_WEBHOOK_WORKERS = config('TELEGRAM_WEBHOOK_WORKERS', default=4, cast=int)
+TELEGRAM_WEBHOOK_QUEUE_SIZE = config('TELEGRAM_WEBHOOK_QUEUE_SIZE', default=1000, cast=int)
 TELEGRAM_MANAGER_USERNAME = config('TELEGRAM_MANAGER_USERNAME', default='Talant_bey')
 
+# ==================== CART ====================
+# Корзина анонимных посетителей: подписанная cookie без записей в БД.
+# 'shop.cart.SessionDatabaseCart' - прежняя корзина в БД для каждой сессии
+SHOP_ANONYMOUS_CART_BACKEND = 'shop.cart.CookieCart'
+# Сколько минут товар в корзине зарезервирован за покупателем.
+# Просроченные резервы снимает: python manage.py release_reservations
+SHOP_RESERVATION_MINUTES = 15
+
+# ==================== ORDER CODES ====================
+# Каждый процесс резервирует в БД блок номеров для кодов заказов CHP-XXXXXX.
+# Неиспользованный остаток блока при перезапуске теряется - это лишь пропуски
+ORDER_CODE_BLOCK_SIZE = 50
+
 # ==================== SHOP CONTACTS ====================
 SHOP_NAME = "Poweractiontools"
 SHOP_PHONE_1 = "831595711"
@@ -0,0 +1,155 @@
+import logging
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from shop.models import Order
+
+logger = logging.getLogger(__name__)
+
+# Снимок живет в общем кэше: без REDIS_URL (LocMemCache) процесс бота не видит
+# обновлений, сделанных веб-воркерами, и /stats, /pending отстают до SNAPSHOT_TTL
+SNAPSHOT_CACHE_KEY = 'dashboard:metrics:snapshot'
+# Счетчик изменений заказов и блокировка точечного обновления снимка
+GENERATION_CACHE_KEY = 'dashboard:metrics:generation'
+REFRESH_LOCK_KEY = 'dashboard:metrics:refresh-lock'
+REFRESH_LOCK_TTL = 30
+# Полный пересчет не реже раза в час, даже если точечные обновления что-то пропустили
+SNAPSHOT_TTL = 60 * 60
+SNAPSHOT_DAYS = 30
+PENDING_LIMIT = 10
+
+# Периоды как в dashboard_home: created_at__date >= сегодня - N дней
+PERIODS = {
+    'today': 0,
+    'week': 7,
+    'month': 30,
+}
+
+
+def day_start(day):
+    """Начало дня в текущей временной зоне: условие по диапазону использует индекс created_at"""
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def daily_sales(since, until=None):
+    """Заказы и выручка по дням {date: {'orders': n, 'revenue': Decimal}} одним запросом"""
+    orders = Order.objects.filter(created_at__gte=day_start(since))
+    if until is not None:
+        orders = orders.filter(created_at__lt=day_start(until + timedelta(days=1)))
+    rows = orders.annotate(day=TruncDate('created_at')).values('day').annotate(
+        orders=Count('id'), revenue=Sum('total_price')
+    ).order_by()
+    return {row['day']: {'orders': row['orders'], 'revenue': row['revenue'] or Decimal('0')} for row in rows}
+
+
+def period_totals(days, period, today=None):
+    """Сумма дневных показателей за период из PERIODS"""
+    today = today or timezone.localdate()
+    since = today - timedelta(days=PERIODS[period])
+    orders = sum(day['orders'] for date, day in days.items() if date >= since)
+    revenue = sum((day['revenue'] for date, day in days.items() if date >= since), Decimal('0'))
+    return {
+        'orders': orders,
+        'revenue': revenue,
+        'avg': (revenue / orders).quantize(Decimal('0.01')) if orders else Decimal('0'),
+    }
+
+
+def pending_count():
+    return Order.objects.filter(status='pending').count()
+
+
+def pending_orders(limit=PENDING_LIMIT):
+    return list(
+        Order.objects.filter(status='pending').order_by('-created_at').values(
+            'id', 'first_name', 'last_name', 'phone', 'total_price', 'created_at', 'paid'
+        )[:limit]
+    )
+
+
+def generation():
+    return cache.get(GENERATION_CACHE_KEY, 0)
+
+
+def bump_generation():
+    """Атомарно отмечает изменение заказа (cache.incr)"""
+    cache.add(GENERATION_CACHE_KEY, 0, None)
+    try:
+        return cache.incr(GENERATION_CACHE_KEY)
+    except ValueError:
+        # Ключ вытеснен между add и incr
+        cache.set(GENERATION_CACHE_KEY, 1, None)
+        return 1
+
+
+def build_snapshot(today=None):
+    """Полный снимок: дневные показатели за SNAPSHOT_DAYS и ожидающие заказы"""
+    today = today or timezone.localdate()
+    started = generation()
+    snapshot = {
+        'today': today,
+        'days': daily_sales(today - timedelta(days=SNAPSHOT_DAYS)),
+        'pending_count': pending_count(),
+        'pending': pending_orders(),
+        'updated_at': timezone.now(),
+    }
+    cache.set(SNAPSHOT_CACHE_KEY, snapshot, SNAPSHOT_TTL)
+    if generation() != started:
+        # Заказ изменился во время пересчета и мог в него не попасть
+        cache.delete(SNAPSHOT_CACHE_KEY)
+    return snapshot
+
+
+def get_snapshot():
+    """Снимок из кэша; пересчитывается только при пустом кэше или смене дня"""
+    snapshot = cache.get(SNAPSHOT_CACHE_KEY)
+    if snapshot is None or snapshot['today'] != timezone.localdate():
+        snapshot = build_snapshot()
+    return snapshot
+
+
+def refresh_for_order(order):
+    """Точечно обновляет снимок после изменения заказа
+
+    Пересчитываются только день создания заказа и ожидающие заказы - запросы
+    по индексам без агрегатов за весь период. Чтение и запись снимка идут под
+    блокировкой cache.add; изменение, пришедшее, пока блокировку держит другой
+    процесс, отмечается в счетчике поколений, и тогда снимок сбрасывается
+    целиком - его пересоберет первый читатель.
+    """
+    changed = bump_generation()
+    if not cache.add(REFRESH_LOCK_KEY, changed, REFRESH_LOCK_TTL):
+        return
+    try:
+        _apply_order(order)
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+    if generation() != changed:
+        cache.delete(SNAPSHOT_CACHE_KEY)
+
+
+def _apply_order(order):
+    snapshot = cache.get(SNAPSHOT_CACHE_KEY)
+    if snapshot is None:
+        return
+    today = timezone.localdate()
+    if snapshot['today'] != today:
+        cache.delete(SNAPSHOT_CACHE_KEY)
+        return
+    if order.created_at is not None:
+        day = timezone.localdate(order.created_at)
+        if day >= today - timedelta(days=SNAPSHOT_DAYS):
+            totals = daily_sales(day, day).get(day)
+            if totals:
+                snapshot['days'][day] = totals
+            else:
+                snapshot['days'].pop(day, None)
+    snapshot['pending_count'] = pending_count()
+    snapshot['pending'] = pending_orders()
+    snapshot['updated_at'] = timezone.now()
+    cache.set(SNAPSHOT_CACHE_KEY, snapshot, SNAPSHOT_TTL)
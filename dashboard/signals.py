@@ -0,0 +1,24 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from shop.models import Order
+from .metrics import refresh_for_order
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def order_metrics_changed(sender, instance, **kwargs):
+    """Обновляет снимок метрик для бота после фиксации транзакции"""
+
+    def refresh():
+        try:
+            refresh_for_order(instance)
+        except Exception as e:
+            logger.error(f"Не удалось обновить метрики после изменения заказа #{instance.pk}: {e}")
+
+    transaction.on_commit(refresh)
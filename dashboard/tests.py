@@ -1,3 +1,69 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from shop.models import Order
+from . import metrics
+from .metrics import SNAPSHOT_CACHE_KEY, get_snapshot, period_totals, refresh_for_order
+
+
+class MetricsSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('buyer', 'buyer@example.com')
+
+    def create_order(self, total):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Order.objects.create(
+                user=self.user, total_price=Decimal(total), first_name='Иван', last_name='Петров',
+                email='buyer@example.com', phone='+996555000000', address='ул. Ленина, 1', city='Бишкек',
+            )
+
+    def test_snapshot_read_from_cache(self):
+        self.create_order('100.00')
+        get_snapshot()
+        with self.assertNumQueries(0):
+            snapshot = get_snapshot()
+        self.assertEqual(period_totals(snapshot['days'], 'today', snapshot['today'])['orders'], 1)
+
+    def test_order_changes_applied_incrementally(self):
+        get_snapshot()
+        first = self.create_order('100.00')
+        self.create_order('50.00')
+        snapshot = get_snapshot()
+        self.assertEqual(period_totals(snapshot['days'], 'week', snapshot['today']), {
+            'orders': 2, 'revenue': Decimal('150.00'), 'avg': Decimal('75.00'),
+        })
+        self.assertEqual(snapshot['pending_count'], 2)
+
+        first.status = 'confirmed'
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        snapshot = get_snapshot()
+        self.assertEqual(snapshot['pending_count'], 1)
+        self.assertEqual([order['id'] for order in snapshot['pending']], [first.id + 1])
+        # День заказа, число и список ожидающих - без группировки по всей таблице
+        with self.assertNumQueries(3):
+            refresh_for_order(first)
+
+    def test_change_during_refresh_drops_snapshot(self):
+        get_snapshot()
+        apply_order = metrics._apply_order
+        concurrent = []
+
+        def apply_with_concurrent_change(order):
+            apply_order(order)
+            if not concurrent:
+                concurrent.append(order)
+                # Обновление другого процесса упирается в блокировку и только отмечает изменение
+                self.create_order('50.00')
+
+        with mock.patch.object(metrics, '_apply_order', apply_with_concurrent_change):
+            self.create_order('100.00')
+        self.assertIsNone(cache.get(SNAPSHOT_CACHE_KEY))
+        snapshot = get_snapshot()
+        self.assertEqual(period_totals(snapshot['days'], 'today', snapshot['today'])['orders'], 2)
+        self.assertEqual(snapshot['pending_count'], 2)
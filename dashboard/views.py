@@ -5,6 +5,7 @@ from django.db.models.functions import TruncDay, TruncMonth, TruncYear
 from django.utils import timezone
 from datetime import timedelta, datetime
 from shop.models import Order, OrderItem, Product
+from .metrics import daily_sales, period_totals
 from django.http import JsonResponse, HttpResponse
 import json
 import pandas as pd
@@ -21,7 +22,6 @@ def dashboard_home(request):
     
     # Базовая статистика
     today = timezone.now().date()
-    last_7_days = today - timedelta(days=7)
     last_30_days = today - timedelta(days=30)
     
     # Общие показатели
@@ -33,17 +33,14 @@ def dashboard_home(request):
     # Средний чек
     avg_order_value = Order.objects.aggregate(avg=Avg('total_price'))['avg'] or 0
     
-    # Показатели за сегодня
-    today_orders = Order.objects.filter(created_at__date=today).count()
-    today_revenue = Order.objects.filter(created_at__date=today).aggregate(total=Sum('total_price'))['total'] or 0
-    
-    # Показатели за последние 7 дней
-    week_orders = Order.objects.filter(created_at__date__gte=last_7_days).count()
-    week_revenue = Order.objects.filter(created_at__date__gte=last_7_days).aggregate(total=Sum('total_price'))['total'] or 0
-    
-    # Показатели за последние 30 дней
-    month_orders = Order.objects.filter(created_at__date__gte=last_30_days).count()
-    month_revenue = Order.objects.filter(created_at__date__gte=last_30_days).aggregate(total=Sum('total_price'))['total'] or 0
+    # Показатели за сегодня, 7 и 30 дней - из одного запроса по дням
+    days = daily_sales(last_30_days)
+    today_stats = period_totals(days, 'today', today)
+    week_stats = period_totals(days, 'week', today)
+    month_stats = period_totals(days, 'month', today)
+    today_orders, today_revenue = today_stats['orders'], today_stats['revenue']
+    week_orders, week_revenue = week_stats['orders'], week_stats['revenue']
+    month_orders, month_revenue = month_stats['orders'], month_stats['revenue']
     
     # Топ товары
     top_products = OrderItem.objects.values(
@@ -60,12 +57,11 @@ def dashboard_home(request):
     sales_chart_data = []
     for i in range(30):
         date = today - timedelta(days=i)
-        daily_orders = Order.objects.filter(created_at__date=date).count()
-        daily_revenue = Order.objects.filter(created_at__date=date).aggregate(total=Sum('total_price'))['total'] or 0
+        daily = days.get(date, {'orders': 0, 'revenue': 0})
         sales_chart_data.append({
             'date': date.strftime('%d.%m'),
-            'orders': daily_orders,
-            'revenue': float(daily_revenue)
+            'orders': daily['orders'],
+            'revenue': float(daily['revenue'])
         })
     sales_chart_data.reverse()
     
@@ -31,8 +31,12 @@ def setup_webhook():
     set_url = f"https://api.telegram.org/bot{token}/setWebhook"
     data = {
         'url': webhook_url,
-        'allowed_updates': ['callback_query']  # Только callback_query для кнопок
+        'allowed_updates': ['callback_query', 'message']  # Кнопки и команды администратора
     }
+    # Telegram будет присылать секрет в заголовке X-Telegram-Bot-Api-Secret-Token
+    secret = getattr(settings, 'TELEGRAM_WEBHOOK_SECRET', '')
+    if secret:
+        data['secret_token'] = secret
     
     response = requests.post(set_url, json=data)
     result = response.json()
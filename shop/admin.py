@@ -1,6 +1,16 @@
-from django.contrib import admin
+import threading
+
+from django.contrib import admin, messages
+from django.db import close_old_connections
 from django.db.models import Count
-from .models import Category, Product, Cart, CartItem, Order, OrderItem, Review, BankAccount
+from django.shortcuts import redirect, render
+from django.urls import path
+from django.utils import timezone
+from .models import (
+    Category, Product, Cart, CartItem, Order, OrderItem, Review, BankAccount, StockReservation, OutboxMessage,
+)
+from .forms import CatalogImportForm
+from .catalog_import import CatalogImporter, CatalogImportError, iter_catalog_rows, ingest_images
 
 
 @admin.register(Category)
@@ -32,6 +42,27 @@ class CartAdmin(admin.ModelAdmin):
     inlines = [CartItemInline]
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('product', 'holder', 'quantity', 'expires_at', 'created_at')
+    list_select_related = ('product',)
+    search_fields = ('product__name', 'holder')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'attempts', 'next_attempt_at', 'created_at', 'sent_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = ('created_at', 'sent_at', 'claimed_by')
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(status='pending', attempts=0, next_attempt_at=timezone.now())
+        messages.success(request, f"Возвращено в очередь: {updated}")
+    requeue.short_description = "Отправить повторно"
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
@@ -65,13 +96,58 @@ class OrderAdmin(admin.ModelAdmin):
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'brand', 'price', 'stock', 'available', 'created_at')
+    list_display = ('name', 'sku', 'category', 'brand', 'price', 'stock', 'reserved', 'available', 'created_at')
     list_filter = ('category', 'available', 'created_at')
-    search_fields = ('name', 'description', 'category__name', 'brand')
+    search_fields = ('name', 'sku', 'description', 'category__name', 'brand')
     list_editable = ('price', 'stock', 'available')
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('reserved', 'created_at', 'updated_at')
     ordering = ('-created_at',)
+    change_list_template = 'admin/shop/product/change_list.html'
+    
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_catalog_view), name='shop_product_import'),
+        ]
+        return urls + super().get_urls()
+    
+    def import_catalog_view(self, request):
+        """Загрузка прайс-листа CSV/XLSX из админки"""
+        if not self.has_add_permission(request) or not self.has_change_permission(request):
+            return redirect('admin:shop_product_changelist')
+        
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            importer = CatalogImporter(default_category=form.cleaned_data['category'] or None)
+            try:
+                result = importer.run(iter_catalog_rows(upload.file, upload.name))
+            except CatalogImportError as e:
+                messages.error(request, str(e))
+            else:
+                for error in result.errors[:10]:
+                    messages.warning(request, error)
+                messages.success(request, f"Импорт завершен. {result}")
+                if result.images:
+                    # Изображения загружаются отдельно, чтобы не задерживать ответ
+                    threading.Thread(target=self._ingest_images, args=(result.images,), daemon=True).start()
+                    messages.info(request, f"Изображения ({len(result.images)}) загружаются в фоне")
+                return redirect('admin:shop_product_changelist')
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'form': form,
+            'title': 'Импорт каталога',
+        }
+        return render(request, 'admin/shop/product/import_catalog.html', context)
+    
+    @staticmethod
+    def _ingest_images(images):
+        try:
+            ingest_images(images)
+        finally:
+            close_old_connections()
     
     def changelist_view(self, request, extra_context=None):
         response = super().changelist_view(request, extra_context)
@@ -86,10 +162,10 @@ class ProductAdmin(admin.ModelAdmin):
     
     fieldsets = (
         ('Основная информация', {
-            'fields': ('name', 'slug', 'category', 'brand', 'description')
+            'fields': ('name', 'slug', 'sku', 'category', 'brand', 'description')
         }),
         ('Цена и наличие', {
-            'fields': ('price', 'stock', 'available')
+            'fields': ('price', 'stock', 'reserved', 'available')
         }),
         ('Изображение', {
             'fields': ('image',)
@@ -0,0 +1,431 @@
+import secrets
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from django.core import signing
+from django.db import transaction
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Cart, CartItem, Product
+from . import reservations
+
+# Поля товара, нужные корзине и оформлению заказа
+CART_PRODUCT_FIELDS = (
+    'product__id', 'product__name', 'product__slug', 'product__price', 'product__stock',
+    'product__reserved', 'product__available', 'product__image', 'product__image_data',
+    'product__category__id', 'product__category__name',
+)
+
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'shop.cart'
+CART_COOKIE_MAX_AGE = 60 * 60 * 24 * 30
+# Подписанная cookie должна укладываться в 4 КБ
+CART_COOKIE_MAX_ITEMS = 100
+
+# Ключ сессии с id корзины в БД, созданной для анонимного посетителя
+CART_SESSION_ID = 'cart_id'
+
+# Ключ сессии с числом товаров для значка корзины в шапке
+CART_COUNT_SESSION_KEY = 'cart_items'
+
+# Анонимные корзины без изменений дольше этого срока удаляет purge_carts
+ABANDONED_CART_DAYS = 30
+
+CART_OPERATIONS = ('add', 'remove', 'set')
+CART_BATCH_MAX_OPERATIONS = 100
+
+
+class CartOperationError(ValueError):
+    """Некорректный список операций с корзиной"""
+
+
+class CartSummary:
+    """Позиции корзины с суммами, полученные одним запросом"""
+
+    def __init__(self, items):
+        self.items = items
+        self.total_price = sum((item.line_total for item in items), 0)
+        self.total_items = sum(item.quantity for item in items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def cart_items_queryset(cart):
+    """Позиции корзины с товаром и категорией в одном запросе и суммой строки"""
+    return CartItem.objects.filter(cart=cart).select_related('product__category').only(
+        'id', 'cart_id', 'quantity', 'created_at', *CART_PRODUCT_FIELDS
+    ).annotate(
+        line_total=ExpressionWrapper(
+            F('quantity') * F('product__price'),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+    ).order_by('created_at', 'id')
+
+
+def get_cart_summary(cart):
+    """Возвращает позиции, суммы строк и итоги корзины"""
+    items = list(cart_items_queryset(cart))
+    for item in items:
+        # SQLite отбрасывает нули в дробной части: 20 вместо 20.00, как у корзины в cookie
+        item.line_total = item.line_total.quantize(Decimal('0.01'))
+    return CartSummary(items)
+
+
+def merge_cart_items(cart, quantities):
+    """Добавляет {product_id: количество} в корзину одним upsert по (cart, product)"""
+    quantities = {product_id: quantity for product_id, quantity in quantities.items() if quantity > 0}
+    if not quantities:
+        return 0
+    existing = dict(CartItem.objects.filter(cart=cart, product_id__in=list(quantities)).values_list('product_id', 'quantity'))
+    valid = set(existing) | set(
+        Product.objects.filter(id__in=[product_id for product_id in quantities if product_id not in existing]).values_list('id', flat=True)
+    )
+    items = [
+        CartItem(cart=cart, product_id=product_id, quantity=existing.get(product_id, 0) + quantity)
+        for product_id, quantity in quantities.items()
+        if product_id in valid
+    ]
+    CartItem.objects.bulk_create(
+        items, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+    )
+    Cart.objects.filter(id=cart.id).update(updated_at=timezone.now())
+    return len(items)
+
+
+def parse_cart_operations(operations):
+    """Проверяет [{op, product_id, quantity}] и возвращает список кортежей"""
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError('Ожидается непустой список operations')
+    if len(operations) > CART_BATCH_MAX_OPERATIONS:
+        raise CartOperationError(f'Не более {CART_BATCH_MAX_OPERATIONS} операций за запрос')
+    parsed = []
+    for operation in operations:
+        if not isinstance(operation, dict) or operation.get('op') not in CART_OPERATIONS:
+            raise CartOperationError(f'Неизвестная операция: {operation!r}')
+        try:
+            product_id = int(operation['product_id'])
+            quantity = int(operation.get('quantity', 0 if operation['op'] == 'remove' else 1))
+        except (KeyError, TypeError, ValueError):
+            raise CartOperationError(f'Некорректная операция: {operation!r}')
+        if quantity < 0 or (operation['op'] == 'add' and quantity == 0):
+            raise CartOperationError(f'Некорректное количество: {operation!r}')
+        parsed.append((operation['op'], product_id, quantity))
+    return parsed
+
+
+def apply_cart_operations(cart, operations):
+    """Применяет операции add/remove/set одной транзакцией; возвращает id ненайденных товаров"""
+    operations = parse_cart_operations(operations)
+    products = Product.objects.only('id', 'name', 'price', 'stock', 'reserved', 'available').in_bulk(
+        {product_id for op, product_id, quantity in operations}
+    )
+    missing = sorted({product_id for op, product_id, quantity in operations if product_id not in products})
+
+    with transaction.atomic():
+        current = cart.quantities(list(products))
+        targets = dict(current)
+        for op, product_id, quantity in operations:
+            if product_id not in products:
+                continue
+            if op == 'add':
+                targets[product_id] = targets.get(product_id, 0) + quantity
+            elif op == 'set':
+                targets[product_id] = quantity
+            else:
+                targets[product_id] = 0
+        changed = {product_id: quantity for product_id, quantity in targets.items() if current.get(product_id, 0) != quantity}
+        if changed:
+            cart.set_quantities(changed, products)
+    return missing
+
+
+def merge_carts_on_login(request, user):
+    """Переносит анонимную корзину (cookie или сессионную из БД) в корзину пользователя"""
+    quantities = {}
+    session_cart_id = request.session.pop(CART_SESSION_ID, None)
+    # Ключ сессии при входе уже сменен, поэтому корзину ищем по сохраненному id
+    if session_cart_id:
+        for product_id, quantity in CartItem.objects.filter(
+            cart_id=session_cart_id, cart__user__isnull=True
+        ).values_list('product_id', 'quantity'):
+            quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    cookie_cart = CookieCart(request)
+    for product_id, quantity in cookie_cart.items.items():
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+
+    if quantities:
+        with transaction.atomic():
+            cart, created = Cart.objects.get_or_create(user=user)
+            merge_cart_items(cart, quantities)
+            reservations.transfer(
+                [DatabaseCart.holder_for(session_cart_id) if session_cart_id else None, cookie_cart.reservation_key],
+                DatabaseCart.holder_for(cart.id),
+            )
+            if session_cart_id:
+                Cart.objects.filter(id=session_cart_id, user__isnull=True).delete()
+    if cookie_cart.items:
+        cookie_cart.clear()
+    return cookie_cart
+
+
+def purge_abandoned_carts(before, batch_size=1000, pause=0):
+    """Удаляет анонимные корзины, не менявшиеся с before, пачками по id"""
+    carts_deleted = items_deleted = 0
+    last_id = 0
+    while True:
+        ids = list(
+            Cart.objects.filter(user__isnull=True, updated_at__lt=before, id__gt=last_id)
+            .order_by('id').values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        last_id = ids[-1]
+        # Каждая пачка - отдельная короткая транзакция, таблица не блокируется надолго
+        with transaction.atomic():
+            items_deleted += CartItem.objects.filter(cart_id__in=ids).delete()[0]
+            carts_deleted += Cart.objects.filter(id__in=ids, user__isnull=True).delete()[0]
+        if pause:
+            time.sleep(pause)
+    return carts_deleted, items_deleted
+
+
+class DatabaseCart:
+    """Корзина, хранящаяся в таблицах Cart/CartItem"""
+
+    def __init__(self, cart):
+        self.cart = cart
+        self.modified = False
+        self._summary = None
+
+    def summary(self):
+        if self._summary is None:
+            self._summary = get_cart_summary(self.cart)
+        return self._summary
+
+    @staticmethod
+    def holder_for(cart_id):
+        return f'cart:{cart_id}'
+
+    @property
+    def reservation_key(self):
+        return self.holder_for(self.cart.id)
+
+    def add(self, product, quantity, override=False):
+        with transaction.atomic():
+            cart_item = CartItem.objects.filter(cart=self.cart, product=product).first()
+            if cart_item is None:
+                cart_item = CartItem(cart=self.cart, product=product, quantity=0)
+            cart_item.quantity = quantity if override else cart_item.quantity + quantity
+            reservations.reserve(product, self.reservation_key, cart_item.quantity)
+            cart_item.save()
+        self._changed()
+
+    def remove(self, product):
+        CartItem.objects.filter(cart=self.cart, product=product).delete()
+        reservations.release(self.reservation_key, product)
+        self._changed()
+
+    def clear(self):
+        self.cart.items.all().delete()
+        reservations.release(self.reservation_key)
+        self._changed()
+
+    def count(self):
+        if self._summary is not None:
+            return self._summary.total_items
+        return CartItem.objects.filter(cart=self.cart).aggregate(total=Sum('quantity'))['total'] or 0
+
+    def quantities(self, product_ids):
+        return dict(CartItem.objects.filter(cart=self.cart, product_id__in=product_ids).values_list('product_id', 'quantity'))
+
+    def set_quantities(self, quantities, products):
+        """Записывает {product_id: количество} одним upsert и одним DELETE (0 - удалить)"""
+        reservations.reserve_many(self.reservation_key, quantities, products)
+        CartItem.objects.bulk_create(
+            [CartItem(cart=self.cart, product_id=product_id, quantity=quantity)
+             for product_id, quantity in quantities.items() if quantity],
+            update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+        )
+        removed = [product_id for product_id, quantity in quantities.items() if not quantity]
+        if removed:
+            CartItem.objects.filter(cart=self.cart, product_id__in=removed).delete()
+        self._changed()
+
+    def _changed(self):
+        self.modified = True
+        self._summary = None
+        # Время последнего изменения нужно для очистки брошенных корзин
+        Cart.objects.filter(id=self.cart.id).update(updated_at=timezone.now())
+
+
+class SessionDatabaseCart(DatabaseCart):
+    """Прежнее поведение: корзина в БД для каждой сессии анонимного посетителя"""
+
+    def __init__(self, request):
+        session_key = request.session.session_key
+        if not session_key:
+            request.session.create()
+            session_key = request.session.session_key
+        cart, created = Cart.objects.get_or_create(session_key=session_key)
+        request.session[CART_SESSION_ID] = cart.id
+        super().__init__(cart)
+
+
+class CookieCart:
+    """Корзина анонимного посетителя в подписанной cookie, без записей в БД до заказа или входа"""
+
+    def __init__(self, request):
+        self.request = request
+        self.key, self.items = self._load(request.COOKIES.get(CART_COOKIE_NAME))
+        self.modified = False
+        self._summary = None
+
+    @staticmethod
+    def _load(value):
+        if not value:
+            return None, {}
+        try:
+            data = signing.loads(value, salt=CART_COOKIE_SALT, max_age=CART_COOKIE_MAX_AGE)
+            items = {int(product_id): int(quantity) for product_id, quantity in data['items'].items() if int(quantity) > 0}
+            return str(data['key']), items
+        except (signing.BadSignature, KeyError, ValueError, TypeError, AttributeError):
+            return None, {}
+
+    @property
+    def reservation_key(self):
+        return f'cookie:{self.key}' if self.key else None
+
+    def summary(self):
+        if self._summary is None:
+            products = Product.objects.select_related('category').only(
+                *[field.replace('product__', '', 1) for field in CART_PRODUCT_FIELDS]
+            ).in_bulk(list(self.items))
+            items = []
+            for product_id, quantity in self.items.items():
+                product = products.get(product_id)
+                if product is None:
+                    continue
+                item = CartItem(product=product, quantity=quantity)
+                item.line_total = product.price * quantity
+                items.append(item)
+            self._summary = CartSummary(items)
+        return self._summary
+
+    def add(self, product, quantity, override=False):
+        if product.id not in self.items and len(self.items) >= CART_COOKIE_MAX_ITEMS:
+            return
+        if not self.key:
+            # Ключ связывает cookie с резервами товаров в БД
+            self.key = secrets.token_urlsafe(16)
+        if not override:
+            quantity += self.items.get(product.id, 0)
+        reservations.reserve(product, self.reservation_key, quantity)
+        self.items[product.id] = quantity
+        self._changed()
+
+    def remove(self, product):
+        if self.items.pop(product.id, None) is not None:
+            reservations.release(self.reservation_key, product)
+            self._changed()
+
+    def count(self):
+        return sum(self.items.values())
+
+    def quantities(self, product_ids):
+        return {product_id: self.items[product_id] for product_id in product_ids if product_id in self.items}
+
+    def set_quantities(self, quantities, products):
+        if not self.key:
+            self.key = secrets.token_urlsafe(16)
+        free_slots = CART_COOKIE_MAX_ITEMS - len(self.items)
+        accepted = {}
+        for product_id, quantity in quantities.items():
+            if quantity and product_id not in self.items:
+                if free_slots <= 0:
+                    continue
+                free_slots -= 1
+            accepted[product_id] = quantity
+        reservations.reserve_many(self.reservation_key, accepted, products)
+        for product_id, quantity in accepted.items():
+            if quantity:
+                self.items[product_id] = quantity
+            else:
+                self.items.pop(product_id, None)
+        self._changed()
+
+    def clear(self):
+        if self.key:
+            reservations.release(self.reservation_key)
+        self.items = {}
+        self._changed()
+
+    def save(self, response):
+        if not self.items:
+            response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+            return
+        data = {'key': self.key, 'items': {str(k): v for k, v in self.items.items()}}
+        value = signing.dumps(data, salt=CART_COOKIE_SALT, compress=True)
+        response.set_cookie(
+            CART_COOKIE_NAME, value,
+            max_age=CART_COOKIE_MAX_AGE,
+            httponly=True,
+            samesite='Lax',
+            secure=getattr(settings, 'SESSION_COOKIE_SECURE', False),
+        )
+
+    def _changed(self):
+        self.modified = True
+        self._summary = None
+
+
+def anonymous_cart_backend():
+    return import_string(getattr(settings, 'SHOP_ANONYMOUS_CART_BACKEND', 'shop.cart.CookieCart'))
+
+
+def get_or_create_cart(request):
+    """Возвращает корзину текущего посетителя с единым интерфейсом для всех хранилищ"""
+    cart = getattr(request, '_cart', None)
+    if cart is None:
+        if request.user.is_authenticated:
+            cart = DatabaseCart(Cart.objects.get_or_create(user=request.user)[0])
+        else:
+            cart = anonymous_cart_backend()(request)
+        request._cart = cart
+    return cart
+
+
+def get_cart_count(request):
+    """Число товаров для значка корзины без запросов к таблицам корзины"""
+    cart = getattr(request, '_cart', None)
+    if cart is not None and cart.modified:
+        return cart.count()
+    if not request.user.is_authenticated and issubclass(anonymous_cart_backend(), CookieCart):
+        # Анонимная корзина целиком лежит в подписанной cookie
+        return (cart if isinstance(cart, CookieCart) else CookieCart(request)).count()
+    count = request.session.get(CART_COUNT_SESSION_KEY)
+    if count is None:
+        if cart is None and not request.user.is_authenticated:
+            # Счетчик сохраняется при каждом изменении корзины; без него корзина пуста,
+            # и ради значка не создаем сессию и корзину в БД для каждого посетителя и бота
+            return 0
+        # Первый показ после входа или обновления: считаем один раз и запоминаем
+        count = get_or_create_cart(request).count()
+        request.session[CART_COUNT_SESSION_KEY] = count
+    return count
+
+
+def remember_cart_count(request, cart):
+    """Сохраняет в сессии число товаров измененной корзины из БД"""
+    if not isinstance(cart, CookieCart):
+        request.session[CART_COUNT_SESSION_KEY] = cart.count()
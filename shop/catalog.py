@@ -0,0 +1,31 @@
+from django.core.cache import cache
+from django.db.models import Count, Max
+
+from .models import Product, Category
+
+CATALOG_VERSION_CACHE_KEY = 'shop:catalog_version'
+CATALOG_VERSION_TTL = 60
+
+
+def _stamp(value):
+    return int(value.timestamp() * 1000000) if value else 0
+
+
+def get_catalog_version():
+    """Возвращает токен версии каталога, меняющийся при любом изменении товаров и категорий"""
+    version = cache.get(CATALOG_VERSION_CACHE_KEY)
+    if version is None:
+        products = Product.objects.aggregate(count=Count('id'), last_updated=Max('updated_at'))
+        # Переименование категории или смена slug меняет ее updated_at, а не число категорий
+        categories = Category.objects.aggregate(count=Count('id'), last_updated=Max('updated_at'))
+        version = (
+            f"{products['count']}.{categories['count']}."
+            f"{_stamp(products['last_updated']):x}.{_stamp(categories['last_updated']):x}"
+        )
+        cache.set(CATALOG_VERSION_CACHE_KEY, version, CATALOG_VERSION_TTL)
+    return version
+
+
+def invalidate_catalog_version():
+    """Сбрасывает закэшированную версию каталога"""
+    cache.delete(CATALOG_VERSION_CACHE_KEY)
@@ -0,0 +1,396 @@
+import base64
+import csv
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+import time
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .catalog import invalidate_catalog_version
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+# Поля товара, которые импорт может менять у существующих записей
+PRODUCT_IMPORT_FIELDS = ['name', 'description', 'price', 'stock', 'available', 'category', 'brand']
+
+# Допустимые названия колонок (в том числе русские заголовки прайс-листов)
+COLUMN_ALIASES = {
+    'name': 'name', 'название': 'name', 'наименование': 'name',
+    'slug': 'slug', 'url': 'slug',
+    'sku': 'sku', 'артикул': 'sku',
+    'category': 'category', 'категория': 'category',
+    'price': 'price', 'цена': 'price',
+    'stock': 'stock', 'остаток': 'stock', 'количество': 'stock',
+    'available': 'available', 'доступен': 'available',
+    'brand': 'brand', 'бренд': 'brand',
+    'description': 'description', 'описание': 'description',
+    'image': 'image', 'image_url': 'image', 'изображение': 'image',
+}
+
+TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'i', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya', 'ң': 'n', 'ө': 'o', 'ү': 'u',
+}
+
+TRUE_VALUES = {'1', 'true', 'yes', 'да', '+', 'y'}
+
+# Изображения из файла импорта: только http(s) или файлы внутри MEDIA_ROOT, не больше 5 МБ
+MAX_IMAGE_BYTES = 5 * 1024 * 1024
+
+
+class CatalogImportError(Exception):
+    """Ошибка чтения файла каталога"""
+
+
+def make_slug(value):
+    """Строит латинский slug, транслитерируя кириллицу"""
+    value = ''.join(TRANSLIT.get(char, char) for char in str(value).lower())
+    return slugify(value)[:200]
+
+
+def parse_price(value):
+    """'1 500,50' -> Decimal('1500.50')"""
+    try:
+        return Decimal(value.replace(' ', '').replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f"некорректная цена '{value}'")
+
+
+def parse_stock(value):
+    """Остаток: целое неотрицательное, '12,0' тоже допустимо"""
+    try:
+        return max(int(float(value.replace(',', '.') or 0)), 0)
+    except ValueError:
+        raise ValueError(f"некорректный остаток '{value}'")
+
+
+def parse_bool(value):
+    return value.lower() in TRUE_VALUES
+
+
+def category_slug(name):
+    """Slug категории; для названий без латиницы и кириллицы - по хэшу названия"""
+    slug = make_slug(name)[:100]
+    if not slug:
+        slug = 'category-' + hashlib.md5(name.lower().encode('utf-8')).hexdigest()[:8]
+    return slug
+
+
+def iter_catalog_rows(fileobj, filename):
+    """Построчно читает CSV или XLSX, не загружая файл в память целиком"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.xlsx':
+        rows = _iter_xlsx(fileobj)
+    elif extension == '.csv':
+        rows = _iter_csv(fileobj)
+    else:
+        raise CatalogImportError(f"Неподдерживаемый формат файла: {extension or filename}")
+
+    header = None
+    for values in rows:
+        if header is None:
+            header = [COLUMN_ALIASES.get(str(value or '').strip().lower()) for value in values]
+            if 'name' not in header and 'sku' not in header and 'slug' not in header:
+                raise CatalogImportError("В файле нет колонок name, sku или slug")
+            continue
+        row = {}
+        for column, value in zip(header, values):
+            if column and value is not None:
+                row[column] = str(value).strip()
+        if row:
+            yield row
+
+
+def _iter_csv(fileobj):
+    if isinstance(fileobj, (str, os.PathLike)):
+        fileobj = open(fileobj, 'rb')
+    text = io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+    sample = text.readline()
+    delimiter = ';' if sample.count(';') > sample.count(',') else ','
+    yield from csv.reader([sample], delimiter=delimiter)
+    yield from csv.reader(text, delimiter=delimiter)
+
+
+def _iter_xlsx(fileobj):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+class ImportResult:
+    """Статистика импорта каталога"""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.categories_created = 0
+        self.errors = []
+        self.images = []
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (
+            f"Строк: {self.rows}, создано: {self.created}, обновлено: {self.updated}, "
+            f"без изменений: {self.unchanged}, пропущено: {self.skipped}, "
+            f"новых категорий: {self.categories_created}, "
+            f"{self.elapsed:.1f} с ({self.rows_per_second:.0f} строк/с)"
+        )
+
+
+class CatalogImporter:
+    """Потоковый upsert категорий и товаров пачками через bulk_create/bulk_update"""
+
+    def __init__(self, batch_size=1000, default_category=None):
+        self.batch_size = batch_size
+        self.default_category = default_category
+        self.categories = {}
+
+    def run(self, rows):
+        result = ImportResult()
+        self.categories = {category.name.lower(): category for category in Category.objects.only('id', 'name', 'slug')}
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch, result)
+                batch = []
+        if batch:
+            self._import_batch(batch, result)
+
+        result.elapsed = time.monotonic() - result.started
+        if result.created or result.updated:
+            invalidate_catalog_version()
+        logger.info(f"Импорт каталога завершен. {result}")
+        return result
+
+    def _import_batch(self, batch, result):
+        parsed = {}
+        for row in batch:
+            result.rows += 1
+            try:
+                item = self._parse_row(row)
+            except ValueError as e:
+                result.skipped += 1
+                result.errors.append(f"Строка {result.rows}: {e}")
+                continue
+            # При повторе ключа в файле побеждает последняя строка
+            parsed[item['key']] = item
+
+        if not parsed:
+            return
+
+        self._ensure_categories(parsed.values(), result)
+
+        skus = [item['sku'] for item in parsed.values() if item['sku']]
+        slugs = [item['slug'] for item in parsed.values()]
+        existing = {}
+        queryset = Product.objects.filter(Q(sku__in=skus) | Q(slug__in=slugs)).only(
+            'id', 'sku', 'slug', 'category_id', *[f for f in PRODUCT_IMPORT_FIELDS if f != 'category']
+        )
+        for product in queryset:
+            if product.sku:
+                existing[('sku', product.sku)] = product
+            existing[('slug', product.slug)] = product
+
+        now = timezone.now()
+        to_create, to_update = [], []
+        new_slugs = set()
+        for item in parsed.values():
+            product = existing.get(('sku', item['sku'])) if item['sku'] else None
+            product = product or existing.get(('slug', item['slug']))
+            values = item['values']
+            if product is None:
+                missing = [field for field in ('name', 'price', 'category_id') if field not in values]
+                if missing or item['slug'] in new_slugs:
+                    result.skipped += 1
+                    reason = f"нет полей {', '.join(missing)}" if missing else f"повтор slug {item['slug']}"
+                    result.errors.append(f"{item['sku'] or item['slug']}: {reason}")
+                    continue
+                new_slugs.add(item['slug'])
+                to_create.append(Product(slug=item['slug'], sku=item['sku'], **values))
+            else:
+                changed = False
+                for field, value in values.items():
+                    if getattr(product, field) != value:
+                        setattr(product, field, value)
+                        changed = True
+                if changed:
+                    # bulk_update не обновляет auto_now поля сам
+                    product.updated_at = now
+                    to_update.append(product)
+                else:
+                    result.unchanged += 1
+            if item['image']:
+                result.images.append((item['slug'], item['image']))
+
+        with transaction.atomic():
+            Product.objects.bulk_create(to_create, batch_size=self.batch_size)
+            if to_update:
+                Product.objects.bulk_update(to_update, PRODUCT_IMPORT_FIELDS + ['updated_at'], batch_size=self.batch_size)
+        result.created += len(to_create)
+        result.updated += len(to_update)
+
+    def _parse_row(self, row):
+        name = row.get('name', '')
+        sku = row.get('sku') or None
+        # Артикул в slug делает его уникальным для одноименных товаров
+        slug = row.get('slug') or make_slug(f"{name}-{sku}" if sku else name)
+        if not slug:
+            raise ValueError("не указаны название, артикул или slug")
+
+        values = {}
+        if name:
+            values['name'] = name[:200]
+        if 'price' in row:
+            values['price'] = parse_price(row['price'])
+        if 'stock' in row:
+            values['stock'] = parse_stock(row['stock'])
+        if 'available' in row:
+            values['available'] = parse_bool(row['available'])
+        for field in ('brand', 'description'):
+            if field in row:
+                values[field] = row[field]
+        category_name = row.get('category') or self.default_category
+        if category_name:
+            values['category'] = category_name
+
+        return {
+            'key': ('sku', sku) if sku else ('slug', slug),
+            'sku': sku,
+            'slug': slug,
+            'values': values,
+            'image': row.get('image'),
+        }
+
+    def _ensure_categories(self, items, result):
+        missing = {}
+        for item in items:
+            name = item['values'].get('category')
+            if name and name.lower() not in self.categories:
+                category = Category(name=name[:100], slug=category_slug(name))
+                # Разные названия с одинаковым slug дают одну категорию
+                missing.setdefault(category.slug, category)
+        if missing:
+            existing = set(Category.objects.filter(slug__in=missing).values_list('slug', flat=True))
+            Category.objects.bulk_create(
+                [category for slug, category in missing.items() if slug not in existing], ignore_conflicts=True
+            )
+            for category in Category.objects.filter(slug__in=missing).only('id', 'name', 'slug'):
+                self.categories[category.name.lower()] = category
+            # ignore_conflicts молча пропускает уже существующие slug - считаем только новые
+            result.categories_created += len(missing) - len(existing)
+
+        for item in items:
+            name = item['values'].pop('category', None)
+            if name:
+                category = self.categories.get(name.lower())
+                if category is None:
+                    # Категория с таким slug уже была под другим названием
+                    category = Category.objects.get(slug=category_slug(name))
+                    self.categories[name.lower()] = category
+                item['values']['category_id'] = category.id
+
+
+def _public_host(hostname):
+    """True, если все адреса хоста публичные (не localhost и не внутренняя сеть)"""
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(hostname, None)}
+    except (socket.gaierror, UnicodeError):
+        return False
+    return bool(addresses) and all(ipaddress.ip_address(address.split('%')[0]).is_global for address in addresses)
+
+
+def _download_image(url):
+    parsed = urlparse(url)
+    if not parsed.hostname or not _public_host(parsed.hostname):
+        raise ValueError("адрес во внутренней сети или не найден")
+    import requests
+
+    # Перенаправления не выполняются: иначе через них можно обойти проверку хоста
+    with requests.get(url, timeout=15, stream=True, allow_redirects=False) as response:
+        response.raise_for_status()
+        if response.is_redirect:
+            raise ValueError("перенаправления не поддерживаются")
+        content = bytearray()
+        for chunk in response.iter_content(64 * 1024):
+            content.extend(chunk)
+            if len(content) > MAX_IMAGE_BYTES:
+                raise ValueError(f"файл больше {MAX_IMAGE_BYTES // (1024 * 1024)} МБ")
+    return bytes(content)
+
+
+def _read_media_file(source):
+    media_root = os.path.realpath(settings.MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(media_root, source))
+    # Относительный путь от MEDIA_ROOT; '..' и абсолютные пути за его пределы не пускаем
+    if os.path.commonpath([media_root, path]) != media_root:
+        raise ValueError("файл вне MEDIA_ROOT")
+    if os.path.getsize(path) > MAX_IMAGE_BYTES:
+        raise ValueError(f"файл больше {MAX_IMAGE_BYTES // (1024 * 1024)} МБ")
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def load_image(source):
+    """Байты изображения из http(s) URL или файла внутри MEDIA_ROOT; ValueError, если нельзя"""
+    from PIL import Image
+
+    scheme = urlparse(source).scheme.lower()
+    if scheme in ('http', 'https'):
+        content = _download_image(source)
+    elif scheme:
+        raise ValueError(f"схема {scheme} не поддерживается")
+    else:
+        content = _read_media_file(source)
+    try:
+        Image.open(io.BytesIO(content)).verify()
+    except Exception:
+        raise ValueError("файл не является изображением")
+    return content
+
+
+def ingest_images(images):
+    """Загружает изображения товаров после импорта данных (вне транзакций пачек)"""
+    loaded = 0
+    for slug, source in images:
+        try:
+            content = load_image(source)
+        except Exception as e:
+            logger.error(f"Ошибка загрузки изображения {source} для товара {slug}: {e}")
+            continue
+        # updated_at меняет версию каталога и отпечатки страниц статической выгрузки
+        Product.objects.filter(slug=slug).update(
+            image_data=base64.b64encode(content).decode('utf-8'), updated_at=timezone.now()
+        )
+        loaded += 1
+    if loaded:
+        invalidate_catalog_version()
+    logger.info(f"Загружено изображений: {loaded} из {len(images)}")
+    return loaded
@@ -1,5 +1,6 @@
 from django.conf import settings
 from .models import Category
+from .cart import get_cart_count
 
 def shop_settings(request):
     """Добавляет настройки магазина в контекст всех шаблонов"""
@@ -20,5 +21,11 @@ def shop_settings(request):
 def tool_categories(request):
     """Context processor для добавления категорий инструментов во все шаблоны"""
     return {
-        'tool_categories': Category.objects.all().order_by('name')
+        # Для меню нужны только название и slug, без Base64 изображения
+        'tool_categories': Category.objects.only('id', 'name', 'slug').order_by('name')
     }
+
+
+def cart_badge(request):
+    """Число товаров в корзине для шапки сайта из сессии или cookie"""
+    return {'cart_items_count': get_cart_count(request)}
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+ORDER_EVENTS_CHANNEL = 'shop:order-events'
+
+
+class Subscription:
+    """Очередь событий одного клиента, привязанная к его event loop"""
+
+    def __init__(self, broker, key, loop, queue):
+        self.broker = broker
+        self.key = key
+        self.loop = loop
+        self.queue = queue
+
+    def deliver(self, event):
+        # publish вызывается из синхронных потоков, очередь живет в event loop клиента
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    """Внутрипроцессная pub/sub шина: ключ -> подписчики"""
+
+    def __init__(self):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, key):
+        subscription = Subscription(self, key, asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[key].add(subscription)
+        get_transport().ensure_listening()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.key)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.key]
+
+    def dispatch(self, key, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+        for subscription in subscribers:
+            try:
+                subscription.deliver(event)
+            except RuntimeError:
+                # Event loop клиента уже закрыт
+                self.unsubscribe(subscription)
+
+
+class LocalTransport:
+    """События видят только подписчики этого процесса"""
+
+    def __init__(self, broker):
+        self.broker = broker
+
+    def publish(self, key, event):
+        self.broker.dispatch(key, event)
+
+    def ensure_listening(self):
+        pass
+
+
+class RedisTransport:
+    """Рассылка событий между процессами через Redis Pub/Sub"""
+
+    def __init__(self, broker):
+        import redis
+
+        self.broker = broker
+        self.client = redis.Redis.from_url(settings.REDIS_URL)
+        self._listener = None
+        self._lock = threading.Lock()
+
+    def publish(self, key, event):
+        self.client.publish(ORDER_EVENTS_CHANNEL, json.dumps({'key': key, 'event': event}))
+
+    def ensure_listening(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='order-events', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(ORDER_EVENTS_CHANNEL)
+        try:
+            for message in pubsub.listen():
+                try:
+                    data = json.loads(message['data'])
+                    self.broker.dispatch(data['key'], data['event'])
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning(f"Некорректное событие заказа из Redis: {e}")
+        except Exception as e:
+            logger.error(f"Слушатель событий заказов остановлен: {e}")
+        finally:
+            pubsub.close()
+
+
+broker = EventBroker()
+_transport = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    global _transport
+    if _transport is None:
+        with _transport_lock:
+            if _transport is None:
+                transport_class = import_string(getattr(settings, 'SHOP_EVENTS_TRANSPORT', 'shop.events.LocalTransport'))
+                _transport = transport_class(broker)
+    return _transport
+
+
+def order_event(order):
+    return {'order_id': order.id, 'status': order.status, 'paid': order.paid}
+
+
+def publish_order_event(order):
+    """Сообщает подписчикам о новом статусе заказа"""
+    try:
+        get_transport().publish(f'order:{order.id}', order_event(order))
+    except Exception as e:
+        logger.error(f"Не удалось опубликовать событие заказа #{order.id}: {e}")
+
+
+def subscribe_order(order_id):
+    return broker.subscribe(f'order:{order_id}')
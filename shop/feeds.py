@@ -0,0 +1,221 @@
+import csv
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.text import slugify
+
+from .catalog import get_catalog_version
+from .models import Category, Product
+
+logger = logging.getLogger(__name__)
+
+# Ограничение протокола sitemaps.org на число URL в одном файле
+SITEMAP_URLS_PER_FILE = 50000
+FEED_CHUNK_SIZE = 2000
+FEED_CACHE_STALE_SECONDS = 600
+# Под ASGI каждый шаг синхронного генератора выполняется в потоке: шаг набирает порцию не меньше этой
+ASYNC_PORTION_BYTES = 64 * 1024
+
+# Только нужные для выгрузки колонки: image_data с Base64 не читаем
+FEED_COLUMNS = ('id', 'sku', 'slug', 'name', 'price', 'stock', 'available', 'brand', 'category__name', 'image')
+FEED_CSV_HEADER = ['id', 'sku', 'title', 'link', 'price', 'stock', 'availability', 'brand', 'category', 'image_link']
+
+
+def get_cache_dir():
+    return os.path.join(settings.FEED_CACHE_DIR, get_catalog_version())
+
+
+def cached_response(request, name, content_type, generate):
+    """Отдает файл из дискового кэша текущей версии каталога или генерирует его потоково"""
+    base_url = request.build_absolute_uri('/').rstrip('/')
+    cache_dir = get_cache_dir()
+    path = os.path.join(cache_dir, slugify(base_url), name)
+    if os.path.exists(path):
+        f = open(path, 'rb')
+        if not isinstance(request, ASGIRequest):
+            return FileResponse(f, content_type=content_type)
+        response = StreamingHttpResponse(_iterate_in_thread(_read_file(f)), content_type=content_type)
+        response['Content-Length'] = os.fstat(f.fileno()).st_size
+        return response
+    chunks = _stream_to_cache(path, generate(base_url))
+    if isinstance(request, ASGIRequest):
+        chunks = _iterate_in_thread(chunks)
+    return StreamingHttpResponse(chunks, content_type=content_type)
+
+
+def _read_file(f):
+    with f:
+        while True:
+            data = f.read(ASYNC_PORTION_BYTES)
+            if not data:
+                return
+            yield data
+
+
+def _read_portion(iterator):
+    portion, size = [], 0
+    for chunk in iterator:
+        portion.append(chunk)
+        size += len(chunk)
+        if size >= ASYNC_PORTION_BYTES:
+            break
+    return b''.join(portion)
+
+
+async def _iterate_in_thread(chunks):
+    """Асинхронный итератор поверх синхронного генератора байтов
+
+    Django 4.2 под ASGI собирает синхронный итератор ответа в память целиком
+    (sync_to_async(list)); так фид уходит клиенту порциями по мере генерации.
+    Генератор продвигается в общем потоке синхронного кода, где живет его
+    соединение с БД.
+    """
+    read = sync_to_async(_read_portion, thread_sensitive=True)
+    try:
+        while True:
+            portion = await read(chunks)
+            if not portion:
+                break
+            yield portion
+    finally:
+        # Обрыв соединения: генератор удаляет недописанный файл кэша и закрывает курсор
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+def _stream_to_cache(path, chunks):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    _remove_stale_versions()
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    completed = False
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in chunks:
+                data = chunk.encode('utf-8')
+                f.write(data)
+                yield data
+        os.replace(tmp_path, path)
+        completed = True
+    finally:
+        # Обрыв соединения не должен оставлять в кэше недописанный файл
+        if not completed and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _remove_stale_versions():
+    current = get_cache_dir()
+    root = settings.FEED_CACHE_DIR
+    expired = time.time() - FEED_CACHE_STALE_SECONDS
+    for entry in os.listdir(root):
+        entry_path = os.path.join(root, entry)
+        # Свежие каталоги не трогаем: их может дописывать другой воркер
+        if entry_path != current and os.path.isdir(entry_path) and os.path.getmtime(entry_path) < expired:
+            shutil.rmtree(entry_path, ignore_errors=True)
+
+
+def _product_url_template(base_url):
+    # reverse() на каждую строку заметно дороже подстановки slug в готовый шаблон
+    return base_url + reverse('shop:product_detail', kwargs={'slug': 'slug-placeholder'}).replace('slug-placeholder', '{}')
+
+
+def product_queryset():
+    return Product.objects.filter(available=True).order_by('id')
+
+
+def sitemap_pages_count():
+    return max(1, -(-product_queryset().count() // SITEMAP_URLS_PER_FILE))
+
+
+def generate_sitemap_index(base_url):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    yield f'<sitemap><loc>{escape(base_url + reverse("shop:sitemap_section", args=["pages", 1]))}</loc></sitemap>\n'
+    for page in range(1, sitemap_pages_count() + 1):
+        loc = base_url + reverse('shop:sitemap_section', args=['products', page])
+        yield f'<sitemap><loc>{escape(loc)}</loc></sitemap>\n'
+    yield '</sitemapindex>\n'
+
+
+def generate_sitemap_pages(base_url):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for url_name in ('shop:home', 'shop:product_list'):
+        yield f'<url><loc>{escape(base_url + reverse(url_name))}</loc></url>\n'
+    for slug in Category.objects.values_list('slug', flat=True).iterator(chunk_size=FEED_CHUNK_SIZE):
+        loc = base_url + reverse('shop:category_detail', kwargs={'slug': slug})
+        yield f'<url><loc>{escape(loc)}</loc></url>\n'
+    yield '</urlset>\n'
+
+
+def generate_sitemap_products(base_url, page):
+    start = (page - 1) * SITEMAP_URLS_PER_FILE
+    rows = product_queryset().values_list('slug', 'updated_at')[start:start + SITEMAP_URLS_PER_FILE]
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    product_url = _product_url_template(base_url)
+    for slug, updated_at in rows.iterator(chunk_size=FEED_CHUNK_SIZE):
+        loc = product_url.format(slug)
+        yield f'<url><loc>{escape(loc)}</loc><lastmod>{updated_at.date().isoformat()}</lastmod></url>\n'
+    yield '</urlset>\n'
+
+
+def _feed_rows(base_url):
+    media_url = base_url + settings.MEDIA_URL
+    product_url = _product_url_template(base_url)
+    rows = product_queryset().values_list(*FEED_COLUMNS)
+    for product_id, sku, slug, name, price, stock, available, brand, category, image in rows.iterator(chunk_size=FEED_CHUNK_SIZE):
+        yield {
+            'id': product_id,
+            'sku': sku or '',
+            'title': name,
+            'link': product_url.format(slug),
+            'price': f'{price} KGS',
+            'stock': stock,
+            'availability': 'in stock' if available and stock > 0 else 'out of stock',
+            'brand': brand,
+            'category': category,
+            'image_link': media_url + image if image else '',
+        }
+
+
+def generate_feed_csv(base_url):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=FEED_CSV_HEADER)
+    writer.writeheader()
+    for i, row in enumerate(_feed_rows(base_url), 1):
+        writer.writerow(row)
+        if i % FEED_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def generate_feed_xml(base_url):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0"><channel>\n'
+    yield f'<title>{escape(getattr(settings, "SHOP_NAME", ""))}</title><link>{escape(base_url)}/</link>\n'
+    for row in _feed_rows(base_url):
+        yield (
+            '<item>'
+            f'<g:id>{row["id"]}</g:id>'
+            f'<g:mpn>{escape(row["sku"])}</g:mpn>'
+            f'<title>{escape(row["title"])}</title>'
+            f'<link>{escape(row["link"])}</link>'
+            f'<g:price>{row["price"]}</g:price>'
+            f'<g:availability>{row["availability"]}</g:availability>'
+            f'<g:brand>{escape(row["brand"])}</g:brand>'
+            f'<g:product_type>{escape(row["category"])}</g:product_type>'
+            f'<g:image_link>{escape(row["image_link"])}</g:image_link>'
+            '</item>\n'
+        )
+    yield '</channel></rss>\n'
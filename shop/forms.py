@@ -65,3 +65,14 @@ class CartAddProductForm(forms.Form):
         initial=False,
         widget=forms.HiddenInput
     )
+
+
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(
+        label="Файл каталога",
+        help_text="CSV или XLSX с колонками name, sku, category, price, stock, brand, description, image"
+    )
+    category = forms.CharField(
+        required=False,
+        label="Категория по умолчанию"
+    )
@@ -0,0 +1,145 @@
+import hashlib
+import logging
+import random
+import uuid
+from datetime import timedelta
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.http import HttpResponse, JsonResponse
+from django.utils import timezone
+
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_FIELD = 'idempotency_key'
+IDEMPOTENCY_TTL = timedelta(hours=24)
+MAX_KEY_LENGTH = 255
+
+# Просроченные ключи удаляются попутно примерно раз в CLEANUP_EVERY новых запросов
+CLEANUP_EVERY = 100
+CLEANUP_BATCH = 1000
+
+
+def new_idempotency_key():
+    """Ключ для скрытого поля формы"""
+    return uuid.uuid4().hex
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _owner(request):
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return 'anonymous'
+
+
+def _request_hash(request):
+    try:
+        body = request.body
+    except RawPostDataException:
+        # multipart уже прочитан потоком - хэшируем разобранные поля
+        body = urlencode(sorted(request.POST.lists()), doseq=True).encode('utf-8')
+    return _digest(request.get_full_path(), hashlib.sha256(body).hexdigest())
+
+
+def cleanup_expired(limit=CLEANUP_BATCH):
+    """Удаляет ограниченную пачку просроченных ключей"""
+    ids = list(IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).values_list('id', flat=True)[:limit])
+    if ids:
+        IdempotencyKey.objects.filter(id__in=ids).delete()
+    return len(ids)
+
+
+def _replay(record):
+    response = HttpResponse(bytes(record.body), status=record.status_code, content_type=record.content_type or None)
+    if record.location:
+        response['Location'] = record.location
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _create(key, request_hash, expires_at):
+    # Savepoint: конфликт уникального ключа не должен ломать внешнюю транзакцию
+    with transaction.atomic():
+        return IdempotencyKey.objects.create(key=key, request_hash=request_hash, expires_at=expires_at)
+
+
+def _claim(key, request_hash, ttl):
+    """Занимает ключ; возвращает (запись, True) или (существующая запись, False)"""
+    expires_at = timezone.now() + ttl
+    try:
+        return _create(key, request_hash, expires_at), True
+    except IntegrityError:
+        record = IdempotencyKey.objects.filter(key=key).first()
+        if record is None or record.expires_at <= timezone.now():
+            # Ключ истек (или только что удален) - повторяем попытку один раз
+            IdempotencyKey.objects.filter(key=key, expires_at__lte=timezone.now()).delete()
+            try:
+                return _create(key, request_hash, expires_at), True
+            except IntegrityError:
+                record = IdempotencyKey.objects.get(key=key)
+        return record, False
+
+
+def idempotent(view=None, ttl=IDEMPOTENCY_TTL):
+    """Повторный POST с тем же ключом возвращает сохраненный ответ без повторного выполнения view
+
+    Ключ берется из заголовка Idempotency-Key или поля формы idempotency_key;
+    запросы без ключа обрабатываются как обычно.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            raw_key = request.headers.get(IDEMPOTENCY_HEADER) or request.POST.get(IDEMPOTENCY_FIELD)
+            if request.method != 'POST' or not raw_key:
+                return view_func(request, *args, **kwargs)
+            if len(raw_key) > MAX_KEY_LENGTH:
+                return JsonResponse({'success': False, 'error': 'Слишком длинный ключ идемпотентности'}, status=400)
+
+            key = _digest(view_func.__module__, view_func.__qualname__, _owner(request), raw_key)
+            request_hash = _request_hash(request)
+            record, claimed = _claim(key, request_hash, ttl)
+
+            if not claimed:
+                if record.request_hash != request_hash:
+                    return JsonResponse({
+                        'success': False,
+                        'error': 'Ключ идемпотентности уже использован для другого запроса'
+                    }, status=422)
+                if record.status_code is None:
+                    return JsonResponse({'success': False, 'error': 'Запрос уже обрабатывается'}, status=409)
+                logger.info(f"Повтор запроса {request.path} по ключу идемпотентности")
+                return _replay(record)
+
+            if random.randrange(CLEANUP_EVERY) == 0:
+                cleanup_expired()
+
+            try:
+                response = view_func(request, *args, **kwargs)
+            except Exception:
+                record.delete()
+                raise
+
+            if response.streaming or response.status_code >= 500:
+                # Ошибку сервера клиент должен иметь возможность повторить
+                record.delete()
+                return response
+
+            record.status_code = response.status_code
+            record.content_type = response.get('Content-Type', '')
+            record.location = response.get('Location', '')
+            record.body = response.content
+            record.save(update_fields=['status_code', 'content_type', 'location', 'body'])
+            return response
+        return wrapper
+
+    if view is not None:
+        return decorator(view)
+    return decorator
@@ -0,0 +1,62 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from shop.models import CodeSequence
+from shop.order_codes import BlockAllocator, format_code
+
+BENCHMARK_SEQUENCE = 'order_code_benchmark'
+
+
+class Command(BaseCommand):
+    help = 'Измеряет скорость выдачи кодов заказов параллельными воркерами и проверяет отсутствие коллизий'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Число параллельных воркеров (потоков)')
+        parser.add_argument('--count', type=int, default=5000, help='Кодов на одного воркера')
+        parser.add_argument('--block-sizes', default='1,10,50,200', help='Размеры блоков через запятую')
+
+    def handle(self, *args, **options):
+        try:
+            block_sizes = [int(size) for size in options['block_sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--block-sizes: ожидаются целые числа через запятую')
+
+        try:
+            for block_size in block_sizes:
+                self.run_round(options['workers'], options['count'], block_size)
+        finally:
+            CodeSequence.objects.filter(name=BENCHMARK_SEQUENCE).delete()
+
+    def run_round(self, workers, count, block_size):
+        results = [None] * workers
+        barrier = threading.Barrier(workers)
+
+        def worker(index):
+            # Отдельный аллокатор на поток имитирует отдельный процесс gunicorn
+            allocator = BlockAllocator(BENCHMARK_SEQUENCE, block_size=block_size)
+            try:
+                barrier.wait()
+                results[index] = [format_code(allocator.allocate()) for _ in range(count)]
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if any(codes is None for codes in results):
+            raise CommandError(f'Блок {block_size}: часть воркеров завершилась с ошибкой')
+        codes = [code for worker_codes in results for code in worker_codes]
+        duplicates = len(codes) - len(set(codes))
+        style = self.style.SUCCESS if not duplicates else self.style.ERROR
+        self.stdout.write(style(
+            f"Блок {block_size:>4}: {len(codes)} кодов за {elapsed:.2f} с "
+            f"({len(codes) / elapsed:,.0f} в секунду), дубликатов: {duplicates}"
+        ))
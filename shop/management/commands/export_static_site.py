@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.static_export import StaticSiteExporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Выгружает главную, категории и карточки товаров в статический HTML для CDN/nginx. '
+        'Перерисовываются только страницы, чьи товары изменились с прошлой выгрузки. '
+        'Страницы пагинации ?page=N лежат в <url>/page/N/index.html.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=str(settings.BASE_DIR / 'static_site'), help='Каталог выгрузки')
+        parser.add_argument('--workers', type=int, default=None, help='Число процессов рендеринга')
+        parser.add_argument(
+            '--host', default=None, help='Хост, с которым рендерятся страницы (по умолчанию первый из ALLOWED_HOSTS)'
+        )
+        parser.add_argument('--full', action='store_true', help='Перерисовать все страницы')
+
+    def handle(self, *args, **options):
+        exporter = StaticSiteExporter(
+            options['output'],
+            workers=options['workers'],
+            host=options['host'],
+            full=options['full'],
+        )
+        stats = exporter.run()
+
+        for url, status in stats['failed']:
+            self.stdout.write(self.style.ERROR(f"{url}: HTTP {status}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Страниц: {stats['pages']}, перерисовано: {stats['rendered']}, без изменений: {stats['skipped']}, "
+            f"удалено: {stats['removed']}, файлов скопировано: {stats['assets']}"
+        ))
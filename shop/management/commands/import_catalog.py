@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_import import CatalogImporter, CatalogImportError, iter_catalog_rows, ingest_images
+
+
+class Command(BaseCommand):
+    help = 'Импортирует категории и товары из CSV/XLSX прайс-листа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу .csv или .xlsx')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Размер пачки bulk_create/bulk_update')
+        parser.add_argument('--category', help='Категория для строк без колонки category')
+        parser.add_argument('--skip-images', action='store_true', help='Не загружать изображения после импорта')
+
+    def handle(self, *args, **options):
+        importer = CatalogImporter(batch_size=options['batch_size'], default_category=options['category'])
+
+        try:
+            with open(options['path'], 'rb') as f:
+                result = importer.run(iter_catalog_rows(f, options['path']))
+        except (OSError, CatalogImportError) as e:
+            raise CommandError(str(e))
+
+        for error in result.errors[:20]:
+            self.stdout.write(self.style.WARNING(error))
+        if len(result.errors) > 20:
+            self.stdout.write(self.style.WARNING(f"... и еще {len(result.errors) - 20} ошибок"))
+        self.stdout.write(self.style.SUCCESS(str(result)))
+
+        if result.images and not options['skip_images']:
+            self.stdout.write(f"Загрузка изображений: {len(result.images)}")
+            loaded = ingest_images(result.images)
+            self.stdout.write(self.style.SUCCESS(f"Изображений загружено: {loaded}"))
@@ -0,0 +1,32 @@
+import signal
+import threading
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.cart import ABANDONED_CART_DAYS, purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные анонимные корзины небольшими пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=ABANDONED_CART_DAYS,
+                            help='Удалять корзины, не менявшиеся дольше указанного числа дней')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Число корзин в одной транзакции')
+        parser.add_argument('--pause', type=float, default=0, help='Пауза между пачками в секундах')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд до SIGTERM; 0 - один проход (для cron)')
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopping.set())
+
+        while True:
+            before = timezone.now() - timedelta(days=options['days'])
+            carts, items = purge_abandoned_carts(before, batch_size=options['batch_size'], pause=options['pause'])
+            self.stdout.write(self.style.SUCCESS(f"Удалено корзин: {carts}, позиций: {items}"))
+            if not options['interval'] or stopping.wait(options['interval']):
+                break
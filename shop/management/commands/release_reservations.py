@@ -0,0 +1,28 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from shop.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Снимает просроченные резервы товаров в корзинах (с --interval работает постоянно)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Число резервов в одной транзакции')
+        parser.add_argument('--pause', type=float, default=0, help='Пауза между пачками в секундах')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд до SIGTERM; 0 - один проход (для cron)')
+
+    def handle(self, *args, **options):
+        stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopping.set())
+
+        while True:
+            released = release_expired(batch_size=options['batch_size'], pause=options['pause'])
+            if released or not options['interval']:
+                self.stdout.write(self.style.SUCCESS(f"Снято резервов: {released}"))
+            if not options['interval'] or stopping.wait(options['interval']):
+                break
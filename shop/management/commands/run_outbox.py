@@ -0,0 +1,52 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from shop.outbox import OUTBOX_MAX_ATTEMPTS, OutboxWorker, outbox_stats
+
+
+class Command(BaseCommand):
+    help = 'Отправляет уведомления из outbox (Telegram, email) с повторами и dead-letter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Число одновременных отправок')
+        parser.add_argument('--batch-size', type=int, default=50, help='Сколько сообщений захватывать за раз')
+        parser.add_argument('--max-attempts', type=int, default=OUTBOX_MAX_ATTEMPTS,
+                            help='После стольких неудачных попыток сообщение помечается как dead')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Пауза при пустой очереди в секундах')
+        parser.add_argument('--stats-interval', type=float, default=60, help='Как часто печатать метрики, секунд')
+        parser.add_argument('--once', action='store_true', help='Разобрать очередь и завершиться')
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker(
+            concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            max_attempts=options['max_attempts'],
+            poll_interval=options['poll_interval'],
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: worker.stop())
+
+        last_report = [time.monotonic()]
+
+        def report():
+            if time.monotonic() - last_report[0] >= options['stats_interval']:
+                self.print_stats()
+                last_report[0] = time.monotonic()
+
+        worker.run(once=options['once'], on_idle=report)
+        self.print_stats()
+
+    def print_stats(self):
+        counts, counters = outbox_stats()
+        queue = ', '.join(f"{status}={count}" for status, count in counts.items())
+        sent = counters['outbox.send.count']
+        avg_send = counters['outbox.send.ms'] / sent if sent else 0
+        lagged = counters['outbox.lag.count']
+        avg_lag = counters['outbox.lag.ms'] / lagged if lagged else 0
+        self.stdout.write(
+            f"Очередь: {queue}. Отправлено: {counters['outbox.sent']}, повторов: {counters['outbox.retried']}, "
+            f"dead: {counters['outbox.dead']}, среднее время отправки: {avg_send:.0f} мс, "
+            f"средняя задержка: {avg_lag:.0f} мс"
+        )
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_import import CatalogImportError, iter_catalog_rows
+from shop.supplier_sync import SupplierFeedSync
+
+
+class Command(BaseCommand):
+    help = 'Синхронизирует цены и остатки с полной выгрузкой поставщика, записывая только изменения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к фиду поставщика (.csv или .xlsx)')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать изменения')
+        parser.add_argument('--zero-missing', action='store_true',
+                            help='Обнулить остаток товаров, которых нет в выгрузке')
+        parser.add_argument('--summary-json', help='Сохранить сводку изменений в JSON файл')
+
+    def handle(self, *args, **options):
+        engine = SupplierFeedSync(zero_missing=options['zero_missing'])
+        try:
+            with open(options['path'], 'rb') as f:
+                summary = engine.sync(iter_catalog_rows(f, options['path']), dry_run=options['dry_run'])
+        except (OSError, CatalogImportError) as e:
+            raise CommandError(str(e))
+
+        for change in summary.changes[:50]:
+            fields = ', '.join(f"{field}: {old} → {new}" for field, (old, new) in change['fields'].items())
+            self.stdout.write(f"{change['key']}: {fields}")
+        if len(summary.changes) > 50:
+            self.stdout.write(f"... и еще {len(summary.changes) - 50} изменений")
+        if summary.unknown:
+            self.stdout.write(self.style.WARNING(f"Нет в каталоге: {', '.join(map(str, summary.unknown[:20]))}"))
+        for error in summary.invalid[:20]:
+            self.stdout.write(self.style.WARNING(error))
+
+        if options['summary_json']:
+            data = summary.as_dict()
+            data['changes'] = [
+                {'key': change['key'], 'fields': {field: [str(old), str(new)] for field, (old, new) in change['fields'].items()}}
+                for change in summary.changes
+            ]
+            with open(options['summary_json'], 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+
+        prefix = 'Проверка (без записи). ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(prefix + str(summary)))
@@ -0,0 +1,33 @@
+from django.core.cache import cache
+
+METRICS_CACHE_PREFIX = 'shop:metrics:'
+
+
+def _key(name):
+    return METRICS_CACHE_PREFIX + name
+
+
+def incr(name, value=1):
+    """Увеличивает счетчик; с Redis счетчики общие для всех процессов"""
+    try:
+        return cache.incr(_key(name), value)
+    except ValueError:
+        # Счетчика еще нет: add не затрет значение, созданное параллельно
+        cache.add(_key(name), 0, None)
+        return cache.incr(_key(name), value)
+
+
+def observe(name, seconds, count=1):
+    """Учитывает длительность: сумма в миллисекундах и число наблюдений"""
+    incr(f'{name}.count', count)
+    incr(f'{name}.ms', int(seconds * 1000))
+
+
+def snapshot(names):
+    """Текущие значения счетчиков {имя: значение}"""
+    values = cache.get_many([_key(name) for name in names])
+    return {name: values.get(_key(name), 0) for name in names}
+
+
+def reset(names):
+    cache.delete_many([_key(name) for name in names])
@@ -0,0 +1,20 @@
+from .cart import remember_cart_count
+
+
+class CartCookieMiddleware:
+    """Сохраняет изменения корзины: анонимной - в подписанную cookie, число товаров - в сессию"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # После входа корзина из cookie уже перенесена в БД и очищена
+        for attr in ('_merged_cart_cookie', '_cart'):
+            cart = getattr(request, attr, None)
+            if cart is not None and cart.modified:
+                if hasattr(cart, 'save'):
+                    cart.save(response)
+                else:
+                    remember_cart_count(request, cart)
+        return response
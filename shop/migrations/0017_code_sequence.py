@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Название')),
+                ('next_value', models.BigIntegerField(default=1, verbose_name='Следующее значение')),
+            ],
+            options={
+                'verbose_name': 'Последовательность',
+                'verbose_name_plural': 'Последовательности',
+            },
+        ),
+    ]
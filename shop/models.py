@@ -1,6 +1,8 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.text import slugify
 
 
@@ -12,6 +14,7 @@ class Category(models.Model):
     image_data = models.TextField(blank=True, null=True, verbose_name="Изображение в Base64")
     # Test deploy - проверка что данные не исчезают
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
 
     class Meta:
         verbose_name = "Категория инструментов"
@@ -63,16 +66,20 @@ class Category(models.Model):
 class Product(models.Model):
     name = models.CharField(max_length=200, verbose_name="Название товара")
     slug = models.SlugField(max_length=200, unique=True, verbose_name="URL")
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True, verbose_name="Артикул")
     description = models.TextField(verbose_name="Описание")
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Цена")
     stock = models.PositiveIntegerField(default=0, verbose_name="Количество на складе")
+    # Сумма активных резервов корзин (StockReservation), обновляется вместе с ними
+    # только условными UPDATE из reservations.py; save() это поле не записывает
+    reserved = models.PositiveIntegerField(default=0, editable=False, verbose_name="Зарезервировано")
     available = models.BooleanField(default=True, verbose_name="Доступен")
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name="Категория")
     brand = models.CharField(max_length=100, blank=True, verbose_name="Бренд")
     image = models.ImageField(upload_to='products/', blank=True, verbose_name="Изображение")
     image_data = models.TextField(blank=True, null=True, verbose_name="Изображение в Base64")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
-    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name="Дата обновления")
 
     class Meta:
         verbose_name = "Товар"
@@ -86,6 +93,17 @@ class Product(models.Model):
         return reverse('shop:product_detail', kwargs={'slug': self.slug})
 
     def save(self, *args, **kwargs):
+        # Значение reserved в памяти (админка, импорт) могло устареть: не затираем им резервы
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                deferred = self.get_deferred_fields()
+                update_fields = [
+                    field.name for field in self._meta.concrete_fields
+                    if not field.primary_key and field.attname not in deferred
+                ]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'reserved']
+
         # Сначала сохраняем объект чтобы получить файл
         super().save(*args, **kwargs)
         
@@ -121,16 +139,21 @@ class Product(models.Model):
             return self.image.url
         return None
 
+    @property
+    def available_quantity(self):
+        """Количество, которое еще можно пообещать покупателям"""
+        return max(self.stock - self.reserved, 0)
+
     @property
     def is_in_stock(self):
-        return self.stock > 0 and self.available
+        return self.stock > self.reserved and self.available
 
 
 class Cart(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
-    session_key = models.CharField(max_length=40, null=True, blank=True)
+    session_key = models.CharField(max_length=40, null=True, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     class Meta:
         verbose_name = "Корзина"
@@ -141,11 +164,14 @@ class Cart(models.Model):
 
     @property
     def total_price(self):
-        return sum(item.total_price for item in self.items.all())
+        total = self.items.aggregate(
+            total=models.Sum(models.F('quantity') * models.F('product__price'), output_field=models.DecimalField())
+        )['total']
+        return total or 0
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
 
 
 class CartItem(models.Model):
@@ -167,6 +193,84 @@ class CartItem(models.Model):
         return self.product.price * self.quantity
 
 
+class StockReservation(models.Model):
+    """Временный резерв товара корзиной до оформления заказа"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    holder = models.CharField(max_length=64, verbose_name="Корзина")
+    quantity = models.PositiveIntegerField(verbose_name="Количество")
+    expires_at = models.DateTimeField(db_index=True, verbose_name="Истекает")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Резерв товара"
+        verbose_name_plural = "Резервы товаров"
+        unique_together = ['holder', 'product']
+
+    def __str__(self):
+        return f"{self.holder}: {self.product_id} x {self.quantity}"
+
+
+class CodeSequence(models.Model):
+    """Счетчик, из которого процессы получают диапазоны номеров блоками"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Название")
+    next_value = models.BigIntegerField(default=1, verbose_name="Следующее значение")
+
+    class Meta:
+        verbose_name = "Последовательность"
+        verbose_name_plural = "Последовательности"
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class IdempotencyKey(models.Model):
+    """Сохраненный ответ на запрос с ключом идемпотентности"""
+    key = models.CharField(max_length=64, unique=True, verbose_name="Хэш ключа")
+    request_hash = models.CharField(max_length=64, verbose_name="Хэш запроса")
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name="Код ответа")
+    content_type = models.CharField(max_length=100, blank=True, default='')
+    location = models.TextField(blank=True, default='')
+    body = models.BinaryField(blank=True, default=b'')
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True, verbose_name="Истекает")
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+
+    def __str__(self):
+        return self.key
+
+
+class OutboxMessage(models.Model):
+    """Исходящее уведомление, записанное в одной транзакции с изменением данных"""
+    STATUS_CHOICES = [
+        ('pending', 'В очереди'),
+        ('processing', 'Отправляется'),
+        ('sent', 'Отправлено'),
+        ('dead', 'Не доставлено'),
+    ]
+
+    kind = models.CharField(max_length=50, verbose_name="Тип")
+    payload = models.JSONField(default=dict, verbose_name="Данные")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name="Статус")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="Попыток")
+    # Для pending - время следующей попытки, для processing - конец аренды воркером
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="Следующая попытка")
+    claimed_by = models.CharField(max_length=32, blank=True, default='')
+    last_error = models.TextField(blank=True, default='', verbose_name="Последняя ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="Отправлено")
+
+    class Meta:
+        verbose_name = "Исходящее уведомление"
+        verbose_name_plural = "Исходящие уведомления"
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.get_status_display()})"
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'В обработке'),
@@ -196,28 +300,48 @@ class Order(models.Model):
     payment_method = models.CharField(max_length=20, choices=PAYMENT_CHOICES, default='telegram', verbose_name="Способ оплаты")
     qr_code = models.CharField(max_length=50, unique=True, blank=True, null=True, verbose_name="QR-код")
     qr_payment_data = models.TextField(blank=True, null=True, verbose_name="Данные для QR-оплаты")
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Версия")
 
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['-created_at']
+        # Метрики дашборда и бота: продажи по дням и ожидающие подтверждения заказы
+        indexes = [models.Index(fields=['created_at']), models.Index(fields=['status', 'created_at'])]
 
     def __str__(self):
         return f"Заказ #{self.id} - {self.user.username}"
 
+    def save(self, *args, **kwargs):
+        # Версия растет в самой БД: одновременные сохранения не получат один и тот же номер
+        bump = not self._state.adding
+        if bump:
+            self.version = F('version') + 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        update_fields = kwargs.get('update_fields')
+        if bump and self.status == 'cancelled' and (update_fields is None or 'status' in update_fields):
+            # Отмена (бот, админка) возвращает списанные place_order остатки
+            from .orders import restock_cancelled_order
+
+            with transaction.atomic():
+                restock_cancelled_order(self)
+                super().save(*args, **kwargs)
+        else:
+            super().save(*args, **kwargs)
+        if bump:
+            self.refresh_from_db(fields=['version'])
+
     def get_absolute_url(self):
         return reverse('shop:order_detail', kwargs={'pk': self.pk})
     
     def generate_qr_code(self):
-        """Генерирует уникальный код для заказа"""
-        import random
-        import string
-        
+        """Назначает заказу уникальный код вида CHP-XXXXXX"""
+        from .order_codes import allocate_order_code
+
         if not self.qr_code:
-            # Генерируем уникальный код формата CHP-XXX
-            random_num = ''.join(random.choices(string.digits, k=3))
-            self.qr_code = f"CHP-{random_num}"
-            self.save()
+            self.qr_code = allocate_order_code()
+            self.save(update_fields=['qr_code'])
         
         return self.qr_code
     
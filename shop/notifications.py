@@ -9,7 +9,7 @@ class NotificationService:
     """Сервис для отправки уведомлений клиентам"""
     
     @staticmethod
-    def send_payment_confirmation_email(order):
+    def send_payment_confirmation_email(order, fail_silently=True):
         """Отправить email о подтверждении оплаты"""
         try:
             subject = f'Ваш заказ #{order.id} оплачен!'
@@ -49,6 +49,8 @@ class NotificationService:
             
         except Exception as e:
             logger.error(f"Ошибка отправки email подтверждения оплаты: {e}")
+            if not fail_silently:
+                raise
     
     @staticmethod
     def send_payment_confirmation_sms(order):
@@ -77,15 +79,20 @@ class NotificationService:
             logger.error(f"Ошибка отправки SMS: {e}")
     
     @staticmethod
-    def send_order_status_notification(order):
-        """Отправить уведомление об изменении статуса заказа"""
+    def send_order_status_notification(order, fail_silently=True):
+        """Отправить уведомление об изменении статуса заказа
+
+        fail_silently=False пробрасывает ошибку отправки email, чтобы outbox повторил попытку.
+        """
         try:
             if order.paid and order.status == 'confirmed':
                 # Отправляем email
-                NotificationService.send_payment_confirmation_email(order)
+                NotificationService.send_payment_confirmation_email(order, fail_silently)
                 
                 # Отправляем SMS
                 NotificationService.send_payment_confirmation_sms(order)
                 
         except Exception as e:
             logger.error(f"Ошибка отправки уведомлений о статусе заказа: {e}")
+            if not fail_silently:
+                raise
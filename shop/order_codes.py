@@ -0,0 +1,103 @@
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from .models import CodeSequence
+
+ORDER_CODE_SEQUENCE = 'order_code'
+ORDER_CODE_PREFIX = 'CHP-'
+
+# Алфавит Крокфорда: без I, L, O, U, которые легко спутать при диктовке
+CODE_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+CODE_LENGTH = 6
+CODE_BITS = 5 * CODE_LENGTH
+HALF_BITS = CODE_BITS // 2
+HALF_MASK = (1 << HALF_BITS) - 1
+
+# Ключи раундов перестановки. Их нельзя менять после выдачи первых кодов:
+# иначе новые коды могут совпасть со старыми
+FEISTEL_KEYS = (0x5BD1E995, 0x27D4EB2F, 0x165667B1, 0x9E3779B1)
+
+DEFAULT_BLOCK_SIZE = 50
+
+
+def reserve_block(name, size):
+    """Атомарно забирает из последовательности диапазон [start, start + size)
+
+    Блок должен быть зафиксирован независимо от транзакции заказа: после отката
+    процесс продолжил бы выдавать номера, которые БД считает свободными.
+    Поэтому durable=True - вызов внутри другой транзакции завершится ошибкой.
+    """
+    with transaction.atomic(durable=True):
+        # UPDATE первым захватывает блокировку строки; значение читаем уже после него
+        sequence = CodeSequence.objects.filter(name=name)
+        if not sequence.update(next_value=F('next_value') + size):
+            CodeSequence.objects.get_or_create(name=name)
+            sequence.update(next_value=F('next_value') + size)
+        end = sequence.values_list('next_value', flat=True).get()
+    return end - size, end
+
+
+def permute(value):
+    """Биективно перемешивает 30-битное число сетью Фейстеля"""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    for key in FEISTEL_KEYS:
+        left, right = right, left ^ (((right * key) >> 7 ^ key) & HALF_MASK)
+    return (left << HALF_BITS) | right
+
+
+def encode(value):
+    chars = []
+    for _ in range(CODE_LENGTH):
+        value, index = divmod(value, len(CODE_ALPHABET))
+        chars.append(CODE_ALPHABET[index])
+    return ''.join(reversed(chars))
+
+
+def format_code(number):
+    """Номер из последовательности -> код вида CHP-7K3QXM"""
+    if not 0 <= number < (1 << CODE_BITS):
+        raise OverflowError(f"Последовательность кодов заказов исчерпана: {number}")
+    return ORDER_CODE_PREFIX + encode(permute(number))
+
+
+class BlockAllocator:
+    """Выдает номера из блока, зарезервированного в БД для текущего процесса"""
+
+    def __init__(self, name, block_size=None):
+        self.name = name
+        self.block_size = block_size or getattr(settings, 'ORDER_CODE_BLOCK_SIZE', DEFAULT_BLOCK_SIZE)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.next = self.end = 0
+
+    def allocate(self):
+        with self.lock:
+            # После fork блок родителя остался бы общим у всех воркеров
+            if self.pid != os.getpid() or self.next >= self.end:
+                self.next, self.end = reserve_block(self.name, self.block_size)
+                self.pid = os.getpid()
+            number = self.next
+            self.next += 1
+            return number
+
+    def reset(self):
+        """Забывает текущий блок: следующий номер придет из нового блока
+
+        Нужен тестам: после очистки БД последовательность начинается заново,
+        а недоизрасходованный блок процесса дал бы уже выданные номера.
+        """
+        with self.lock:
+            self.pid = None
+            self.next = self.end = 0
+
+
+_allocator = BlockAllocator(ORDER_CODE_SEQUENCE)
+
+
+def allocate_order_code():
+    """Уникальный код заказа без проверок и повторов при коллизиях"""
+    return format_code(_allocator.allocate())
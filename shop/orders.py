@@ -0,0 +1,109 @@
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+from django.utils.http import quote_etag
+
+from .catalog import invalidate_catalog_version
+from .models import Order, OrderItem, Product
+from .order_codes import allocate_order_code
+from .reservations import OutOfStockError, release
+
+logger = logging.getLogger(__name__)
+
+ORDER_VERSION_CACHE_KEY = 'shop:order_version:{}'
+# Ограничивает жизнь версии, записанной в кэш устаревшим чтением во время смены статуса
+ORDER_VERSION_TTL = 300
+
+
+class EmptyCartError(Exception):
+    """Корзина пуста"""
+
+
+def place_order(cart, user, customer, payment_method='telegram'):
+    """Создает заказ из корзины в одной транзакции и списывает остатки
+
+    Возвращает (order, order_items); при нехватке товара транзакция
+    откатывается и выбрасывается OutOfStockError.
+    """
+    # Код выдается до транзакции: блоки номеров фиксируются отдельно от заказа
+    code = allocate_order_code()
+    with transaction.atomic():
+        summary = cart.summary()
+        if not summary:
+            raise EmptyCartError()
+
+        # Собственный резерв корзины превращается в списание, чужие резервы не трогаем
+        release(cart.reservation_key)
+
+        now = timezone.now()
+        out_of_stock = []
+        # Одинаковый порядок блокировок строк во всех транзакциях исключает взаимные блокировки
+        for item in sorted(summary.items, key=lambda item: item.product.id):
+            updated = Product.objects.filter(
+                id=item.product.id, available=True, stock__gte=F('reserved') + item.quantity
+            ).update(stock=F('stock') - item.quantity, updated_at=now)
+            if not updated:
+                out_of_stock.append(item.product)
+        if out_of_stock:
+            raise OutOfStockError(out_of_stock)
+
+        order = Order.objects.create(
+            user=user,
+            total_price=summary.total_price,
+            payment_method=payment_method,
+            qr_code=code,
+            **customer
+        )
+        order_items = OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=item.product, quantity=item.quantity, price=item.product.price)
+            for item in summary.items
+        ])
+        cart.clear()
+        transaction.on_commit(invalidate_catalog_version)
+
+    logger.info(f"Заказ #{order.id} создан: {len(order_items)} позиций на {order.total_price}")
+    return order, order_items
+
+
+def restock_cancelled_order(order):
+    """Возвращает на склад товары заказа при его первом переходе в статус cancelled
+
+    Вызывается в транзакции сохранения заказа. Условный UPDATE статуса
+    срабатывает один раз: повторная отмена и одновременные сохранения
+    остатки не удваивают. Возвращает True, если остатки возвращены.
+    """
+    if not Order.objects.filter(pk=order.pk).exclude(status='cancelled').update(status='cancelled'):
+        return False
+    now = timezone.now()
+    # Тот же порядок блокировок строк, что и в place_order
+    items = OrderItem.objects.filter(order_id=order.pk).order_by('product_id').values_list('product_id', 'quantity')
+    for product_id, quantity in items:
+        Product.objects.filter(id=product_id).update(stock=F('stock') + quantity, updated_at=now)
+    transaction.on_commit(invalidate_catalog_version)
+    logger.info(f"Заказ #{order.pk} отменен: товары возвращены на склад")
+    return True
+
+
+def order_etag(order_id, version):
+    """ETag статуса заказа
+
+    Тег подписан SECRET_KEY: его нельзя вычислить по номеру заказа, поэтому
+    совпадение If-None-Match доказывает, что клиент уже получал этот статус.
+    """
+    return quote_etag(salted_hmac('shop.order_status', f'{order_id}:{version}').hexdigest()[:24])
+
+
+def get_cached_order_version(order_id):
+    return cache.get(ORDER_VERSION_CACHE_KEY.format(order_id))
+
+
+def remember_order_version(order):
+    cache.set(ORDER_VERSION_CACHE_KEY.format(order.id), order.version, ORDER_VERSION_TTL)
+
+
+def invalidate_order_version(order_id):
+    cache.delete(ORDER_VERSION_CACHE_KEY.format(order_id))
@@ -0,0 +1,305 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from . import metrics
+from .models import Order, OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MAX_ATTEMPTS = 8
+# Задержка перед n-й повторной попыткой: BASE * 2^(n-1) секунд, но не больше MAX
+OUTBOX_BACKOFF_BASE = 2
+OUTBOX_BACKOFF_MAX = 3600
+# Сколько воркер держит захваченное сообщение; после этого его заберет другой воркер
+OUTBOX_LEASE = timedelta(minutes=5)
+TELEGRAM_SEND_TIMEOUT = 30
+# Сколько поток воркера готов ждать лимита Telegram; дольше - сообщение откладывается
+TELEGRAM_MAX_WAIT = 1
+# Дайджест: две кнопки на сообщение при лимите Telegram в 100 кнопок, текст до 4096 символов
+DIGEST_MAX_ITEMS = 30
+DIGEST_MAX_LENGTH = 3500
+
+OUTBOX_METRICS = (
+    'outbox.enqueued', 'outbox.sent', 'outbox.retried', 'outbox.dead', 'outbox.deferred', 'outbox.coalesced',
+    'outbox.send.count', 'outbox.send.ms', 'outbox.lag.count', 'outbox.lag.ms',
+)
+
+HANDLERS = {}
+
+
+class PermanentError(Exception):
+    """Ошибка, которую повтор не исправит: сообщение сразу уходит в dead"""
+
+
+class RetryLater(Exception):
+    """Получатель попросил повторить не раньше чем через delay секунд"""
+
+    def __init__(self, delay, message=''):
+        self.delay = delay
+        super().__init__(message or f"Повтор через {delay} с")
+
+
+class Deferred(RetryLater):
+    """Отправка отложена из-за лимита получателя; попытка не засчитывается"""
+
+
+def handler(kind):
+    """Регистрирует обработчик сообщений вида kind: handler(payload)"""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload, delay=0):
+    """Записывает сообщение в outbox текущей транзакции
+
+    Сообщение уйдет только если транзакция зафиксируется, и не потеряется,
+    если отправка сейчас невозможна.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Неизвестный тип сообщения: {kind}")
+    message = OutboxMessage.objects.create(
+        kind=kind, payload=payload, next_attempt_at=timezone.now() + timedelta(seconds=delay)
+    )
+    transaction.on_commit(lambda: metrics.incr('outbox.enqueued'))
+    return message
+
+
+def enqueue_telegram(chat_id, text, reply_markup=None, parse_mode=None, digest=None):
+    """digest - {'title', 'line', 'buttons'}: краткая форма сообщения для объединения в дайджест"""
+    payload = {'chat_id': chat_id, 'text': text}
+    if reply_markup:
+        payload['reply_markup'] = reply_markup
+    if parse_mode:
+        payload['parse_mode'] = parse_mode
+    if digest:
+        payload['digest'] = digest
+    return enqueue('telegram.message', payload)
+
+
+def backoff(attempts):
+    """Экспоненциальная задержка со случайным разбросом, чтобы повторы не шли пачкой"""
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(limit, lease=OUTBOX_LEASE):
+    """Захватывает до limit готовых к отправке сообщений одним UPDATE
+
+    Условия повторяются во внешнем UPDATE, поэтому два воркера не получат одно
+    сообщение; просроченная аренда (упавший воркер) снова делает его доступным.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    due = OutboxMessage.objects.filter(status__in=['pending', 'processing'], next_attempt_at__lte=now)
+    claimed = due.filter(id__in=due.order_by('next_attempt_at').values('id')[:limit]).update(
+        status='processing', claimed_by=token, next_attempt_at=now + lease
+    )
+    if not claimed:
+        return []
+    return list(OutboxMessage.objects.filter(claimed_by=token, status='processing').order_by('id'))
+
+
+def _digest_chunks(messages):
+    chunk, length = [], 0
+    for message in messages:
+        line = message.payload['digest']['line']
+        if chunk and (len(chunk) >= DIGEST_MAX_ITEMS or length + len(line) >= DIGEST_MAX_LENGTH):
+            yield chunk
+            chunk, length = [], 0
+        chunk.append(message)
+        length += len(line) + 1
+    if chunk:
+        yield chunk
+
+
+def digest_payload(chat_id, messages):
+    """Одно сообщение Telegram вместо нескольких: краткие строки и кнопки всех сообщений"""
+    digests = [message.payload['digest'] for message in messages]
+    title = digests[0].get('title', 'Уведомления')
+    payload = {'chat_id': chat_id, 'text': f"{title}: {len(messages)}\n──────────────\n" + '\n'.join(
+        digest['line'] for digest in digests
+    )}
+    rows = [digest['buttons'] for digest in digests if digest.get('buttons')]
+    if rows:
+        payload['reply_markup'] = {'inline_keyboard': rows}
+    return payload
+
+
+def coalesce(messages):
+    """Раскладывает захваченные сообщения на задания [(сообщения, payload)]
+
+    Если сообщений с краткой формой (payload['digest']) в чат больше, чем лимит
+    чата позволяет отправить сейчас, они уходят дайджестами, а не ждут по одному.
+    """
+    from telegram_bot.ratelimit import scheduler
+
+    jobs = []
+    groups = defaultdict(list)
+    for message in messages:
+        if message.kind == 'telegram.message' and message.payload.get('digest'):
+            groups[str(message.payload['chat_id'])].append(message)
+        else:
+            jobs.append(([message], None))
+    for chat_id, group in groups.items():
+        if len(group) <= scheduler.available(chat_id):
+            jobs.extend(([message], None) for message in group)
+            continue
+        for chunk in _digest_chunks(group):
+            jobs.append((chunk, digest_payload(chunk[0].payload['chat_id'], chunk) if len(chunk) > 1 else None))
+        metrics.incr('outbox.coalesced', len(group))
+    return jobs
+
+
+def _finish(messages, **fields):
+    # Если аренда истекла и сообщения забрал другой воркер, его результат не затираем
+    return OutboxMessage.objects.filter(
+        id__in=[message.id for message in messages], claimed_by=messages[0].claimed_by, status='processing'
+    ).update(**fields)
+
+
+def deliver(messages, payload=None, max_attempts=OUTBOX_MAX_ATTEMPTS):
+    """Отправляет захваченные сообщения одного вида; возвращает True при успехе
+
+    Несколько сообщений отправляются одним payload (дайджест) и разделяют его результат.
+    """
+    kind = messages[0].kind
+    payload = messages[0].payload if payload is None else payload
+    label = ', '.join(f"#{message.id}" for message in messages)
+    started = time.monotonic()
+    try:
+        func = HANDLERS.get(kind)
+        if func is None:
+            raise PermanentError(f"Нет обработчика для {kind}")
+        func(payload)
+    except Deferred as e:
+        _finish(messages, status='pending', next_attempt_at=timezone.now() + timedelta(seconds=e.delay))
+        metrics.incr('outbox.deferred', len(messages))
+        logger.info(f"Сообщения outbox {label} ({kind}) отложены на {e.delay:.1f} с")
+        return False
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        if isinstance(e, PermanentError):
+            dead, retry = messages, []
+        else:
+            dead = [message for message in messages if message.attempts + 1 >= max_attempts]
+            retry = [message for message in messages if message.attempts + 1 < max_attempts]
+        if dead:
+            _finish(dead, status='dead', attempts=F('attempts') + 1, last_error=error)
+            metrics.incr('outbox.dead', len(dead))
+            logger.error(f"Сообщения outbox {label} ({kind}) не доставлены: {error}")
+        if retry:
+            delay = e.delay if isinstance(e, RetryLater) else backoff(max(message.attempts for message in retry) + 1)
+            _finish(
+                retry, status='pending', attempts=F('attempts') + 1, last_error=error,
+                next_attempt_at=timezone.now() + timedelta(seconds=delay),
+            )
+            metrics.incr('outbox.retried', len(retry))
+            logger.warning(f"Сообщения outbox {label} ({kind}): попытка не удалась, "
+                           f"повтор через {delay:.1f} с: {error}")
+        return False
+
+    now = timezone.now()
+    _finish(messages, status='sent', attempts=F('attempts') + 1, sent_at=now, last_error='')
+    metrics.incr('outbox.sent', len(messages))
+    metrics.observe('outbox.send', time.monotonic() - started)
+    metrics.observe('outbox.lag', sum((now - message.created_at).total_seconds() for message in messages),
+                    count=len(messages))
+    return True
+
+
+class OutboxWorker:
+    """Разбирает outbox пачками, отправляя до concurrency сообщений параллельно"""
+
+    def __init__(self, concurrency=4, batch_size=50, max_attempts=OUTBOX_MAX_ATTEMPTS, poll_interval=1.0):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.stopping = threading.Event()
+
+    def _deliver(self, job):
+        messages, payload = job
+        try:
+            return deliver(messages, payload, self.max_attempts)
+        finally:
+            close_old_connections()
+
+    def run_once(self, pool):
+        """Одна пачка; возвращает число обработанных сообщений"""
+        messages = claim(self.batch_size)
+        if messages:
+            list(pool.map(self._deliver, coalesce(messages)))
+        return len(messages)
+
+    def run(self, once=False, on_idle=None):
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='outbox') as pool:
+            while not self.stopping.is_set():
+                processed = self.run_once(pool)
+                if once and not processed:
+                    break
+                if not processed:
+                    if on_idle is not None:
+                        on_idle()
+                    self.stopping.wait(self.poll_interval)
+
+    def stop(self):
+        self.stopping.set()
+
+
+def outbox_stats():
+    """Размер очереди по статусам и счетчики доставки"""
+    counts = dict.fromkeys(dict(OutboxMessage.STATUS_CHOICES), 0)
+    counts.update(OutboxMessage.objects.values_list('status').annotate(count=Count('id')).order_by())
+    return counts, metrics.snapshot(OUTBOX_METRICS)
+
+
+@handler('telegram.message')
+def send_telegram_message(payload):
+    from telegram import InlineKeyboardMarkup
+    from telegram.error import BadRequest, Forbidden, InvalidToken, RetryAfter
+
+    from telegram_bot.bot import telegram_bot
+    from telegram_bot.ratelimit import retry_after_seconds, scheduler
+
+    if not telegram_bot.token:
+        raise PermanentError("TELEGRAM_BOT_TOKEN не настроен")
+    kwargs = {key: value for key, value in payload.items() if key != 'digest'}
+    if kwargs.get('reply_markup'):
+        kwargs['reply_markup'] = InlineKeyboardMarkup.de_json(kwargs['reply_markup'], None)
+
+    # Поток не ждет лимит дольше TELEGRAM_MAX_WAIT: иначе один чат занял бы весь пул
+    wait = scheduler.reserve(kwargs['chat_id'], max_wait=TELEGRAM_MAX_WAIT)
+    if wait is None:
+        raise Deferred(scheduler.delay(kwargs['chat_id']))
+    if wait:
+        time.sleep(wait)
+    try:
+        telegram_bot.submit('send_message', reserved=True, **kwargs).result(TELEGRAM_SEND_TIMEOUT)
+    except RetryAfter as e:
+        # 429 - не ошибка сообщения: ждем retry_after, не расходуя попытки
+        raise Deferred(retry_after_seconds(e))
+    except (BadRequest, Forbidden, InvalidToken) as e:
+        raise PermanentError(str(e))
+
+
+@handler('email.order_status')
+def send_order_status_email(payload):
+    from .notifications import NotificationService
+
+    try:
+        order = Order.objects.select_related('user').get(id=payload['order_id'])
+    except Order.DoesNotExist:
+        raise PermanentError(f"Заказ #{payload['order_id']} не найден")
+    NotificationService.send_order_status_notification(order, fail_silently=False)
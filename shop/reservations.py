@@ -0,0 +1,193 @@
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+logger = logging.getLogger(__name__)
+
+# Сколько минут товар в корзине держится за покупателем
+DEFAULT_RESERVATION_MINUTES = 15
+
+
+class OutOfStockError(Exception):
+    """Не хватает остатка для одного или нескольких товаров корзины"""
+
+    def __init__(self, products):
+        self.products = products
+        super().__init__(', '.join(product.name for product in products))
+
+
+def reservation_ttl():
+    return timedelta(minutes=getattr(settings, 'SHOP_RESERVATION_MINUTES', DEFAULT_RESERVATION_MINUTES))
+
+
+def _adjust_reserved(quantities):
+    """Применяет {product_id: изменение} к счетчикам Product.reserved"""
+    for product_id, delta in quantities.items():
+        if delta:
+            Product.objects.filter(id=product_id).update(reserved=F('reserved') + delta)
+
+
+def reserve(product, holder, quantity):
+    """Устанавливает резерв корзины holder на товар в quantity штук и продлевает его срок"""
+    try:
+        _reserve(product, holder, quantity)
+    except IntegrityError:
+        # Одновременный запрос той же корзины (двойной клик) первым создал резерв:
+        # транзакция откатилась вместе со счетчиком, повторяем по уже существующей строке
+        _reserve(product, holder, quantity)
+
+
+def _reserve(product, holder, quantity):
+    expires_at = timezone.now() + reservation_ttl()
+    with transaction.atomic():
+        current = StockReservation.objects.select_for_update().filter(holder=holder, product=product).first()
+        delta = quantity - (current.quantity if current else 0)
+        if delta > 0:
+            # Резерв ставится только если свободного остатка хватает
+            updated = Product.objects.filter(
+                id=product.id, available=True, stock__gte=F('reserved') + delta
+            ).update(reserved=F('reserved') + delta)
+            if not updated:
+                raise OutOfStockError([product])
+        elif delta < 0:
+            _adjust_reserved({product.id: delta})
+
+        if current:
+            current.quantity = quantity
+            current.expires_at = expires_at
+            current.save(update_fields=['quantity', 'expires_at'])
+        else:
+            StockReservation.objects.create(holder=holder, product=product, quantity=quantity, expires_at=expires_at)
+
+
+def _reserved_delta(deltas):
+    return Case(
+        *[When(id=product_id, then=Value(delta)) for product_id, delta in deltas.items()],
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def reserve_many(holder, quantities, products):
+    """Устанавливает резервы корзины по {product_id: количество} за постоянное число запросов
+
+    0 снимает резерв; products - {product_id: Product} для сообщения об ошибке.
+    """
+    if not quantities:
+        return
+    expires_at = timezone.now() + reservation_ttl()
+    with transaction.atomic():
+        current = dict(
+            StockReservation.objects.select_for_update()
+            .filter(holder=holder, product_id__in=list(quantities)).values_list('product_id', 'quantity')
+        )
+        deltas = {product_id: quantity - current.get(product_id, 0) for product_id, quantity in quantities.items()}
+        increases = {product_id: delta for product_id, delta in deltas.items() if delta > 0}
+        decreases = {product_id: delta for product_id, delta in deltas.items() if delta < 0}
+
+        if increases:
+            delta = _reserved_delta(increases)
+            updated = Product.objects.filter(
+                id__in=list(increases), available=True, stock__gte=F('reserved') + delta
+            ).update(reserved=F('reserved') + delta)
+            if updated != len(increases):
+                # Условие проверено для всех строк одним UPDATE - находим, каким не хватило остатка
+                rows = Product.objects.filter(id__in=list(increases)).values_list('id', 'stock', 'reserved', 'available')
+                raise OutOfStockError([
+                    products[product_id] for product_id, stock, reserved, available in rows
+                    if not available or stock < reserved + increases[product_id]
+                ] or [products[product_id] for product_id in increases])
+        if decreases:
+            delta = _reserved_delta(decreases)
+            Product.objects.filter(id__in=list(decreases)).update(reserved=F('reserved') + delta)
+
+        StockReservation.objects.bulk_create(
+            [StockReservation(holder=holder, product_id=product_id, quantity=quantity, expires_at=expires_at)
+             for product_id, quantity in quantities.items() if quantity],
+            update_conflicts=True, unique_fields=['holder', 'product'], update_fields=['quantity', 'expires_at'],
+        )
+        released = [product_id for product_id, quantity in quantities.items() if not quantity and product_id in current]
+        if released:
+            StockReservation.objects.filter(holder=holder, product_id__in=released).delete()
+
+
+def release(holder, product=None):
+    """Снимает резервы корзины (все или на один товар)"""
+    if not holder:
+        return 0
+    with transaction.atomic():
+        reservations = StockReservation.objects.select_for_update().filter(holder=holder)
+        if product is not None:
+            reservations = reservations.filter(product=product)
+        rows = list(reservations.values_list('id', 'product_id', 'quantity'))
+        if rows:
+            _release_rows(rows)
+    return len(rows)
+
+
+def transfer(holders, new_holder):
+    """Передает резервы анонимных корзин корзине пользователя после входа"""
+    holders = [holder for holder in holders if holder and holder != new_holder]
+    if not holders:
+        return
+    with transaction.atomic():
+        incoming = list(StockReservation.objects.select_for_update().filter(holder__in=holders))
+        if not incoming:
+            return
+        existing = {
+            reservation.product_id: reservation
+            for reservation in StockReservation.objects.select_for_update().filter(
+                holder=new_holder, product_id__in=[reservation.product_id for reservation in incoming]
+            )
+        }
+        expires_at = timezone.now() + reservation_ttl()
+        for reservation in incoming:
+            target = existing.get(reservation.product_id)
+            if target is None:
+                reservation.holder = new_holder
+                reservation.expires_at = expires_at
+                reservation.save(update_fields=['holder', 'expires_at'])
+                existing[reservation.product_id] = reservation
+            else:
+                # Общий резерв товара не меняется, меняется только владелец
+                target.quantity += reservation.quantity
+                target.expires_at = expires_at
+                target.save(update_fields=['quantity', 'expires_at'])
+                reservation.delete()
+
+
+def _release_rows(rows):
+    quantities = defaultdict(int)
+    for reservation_id, product_id, quantity in rows:
+        quantities[product_id] -= quantity
+    StockReservation.objects.filter(id__in=[row[0] for row in rows]).delete()
+    _adjust_reserved(quantities)
+
+
+def release_expired(batch_size=500, pause=0):
+    """Снимает просроченные резервы пачками; возвращает число снятых резервов"""
+    released = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=timezone.now())
+                .order_by('id').values_list('id', 'product_id', 'quantity')[:batch_size]
+            )
+            if rows:
+                _release_rows(rows)
+        released += len(rows)
+        if len(rows) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+    if released:
+        logger.info(f"Снято просроченных резервов: {released}")
+    return released
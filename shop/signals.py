@@ -1,6 +1,12 @@
-from django.db.models.signals import post_save
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Product
+from .models import Product, Category, Order
+from .cart import CART_COUNT_SESSION_KEY, merge_carts_on_login
+from .catalog import invalidate_catalog_version
+from .events import publish_order_event
+from .orders import invalidate_order_version
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,3 +24,36 @@ def product_saved(sender, instance, created, **kwargs):
             logger.info(f"Товар {instance.name} сохранен без изображения")
     except Exception as e:
         logger.error(f"Ошибка при обработке товара: {e}")
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    """Сбрасывает версию каталога при изменении товаров или категорий"""
+    invalidate_catalog_version()
+
+
+@receiver(post_save, sender=Order)
+def order_changed(sender, instance, **kwargs):
+    """Сбрасывает версию для ETag и отправляет подписчикам SSE новый статус после фиксации транзакции"""
+    order_id = instance.pk
+
+    def notify():
+        invalidate_order_version(order_id)
+        publish_order_event(instance)
+
+    transaction.on_commit(notify)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    """Переносит анонимную корзину в корзину пользователя при входе"""
+    if request is None or not hasattr(request, 'session'):
+        return
+    # Корзина пользователя хранится в БД, cookie удалит CartCookieMiddleware
+    request._merged_cart_cookie = merge_carts_on_login(request, user)
+    request._cart = None
+    # Число товаров для значка пересчитается при первом показе страницы
+    request.session.pop(CART_COUNT_SESSION_KEY, None)
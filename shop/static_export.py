@@ -0,0 +1,200 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, Max
+from django.urls import reverse
+
+from .models import Category, Product, Review
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = '.export-manifest.json'
+
+# Ссылки на файлы, которые нужно положить рядом со страницами
+ASSET_RE = re.compile(r'(?:src|href)="(/(?:static|media)/[^"?#]+)"')
+
+# Страница категории показывает столько же товаров, сколько CategoryDetailView
+CATEGORY_PAGE_SIZE = 12
+
+_client = None
+
+
+def _fingerprint(*parts):
+    return hashlib.sha1(json.dumps(parts, default=str).encode('utf-8')).hexdigest()
+
+
+def url_to_path(url):
+    """'/product/drel/?page=2' -> 'product/drel/page/2/index.html'"""
+    path, _, query = url.partition('?')
+    path = path.strip('/')
+    if query.startswith('page='):
+        path = f"{path}/page/{query[5:]}"
+    return os.path.join(path, 'index.html') if path else 'index.html'
+
+
+def collect_pages():
+    """Возвращает {url: отпечаток} для главной, категорий и товаров"""
+    categories = list(Category.objects.order_by('name').values_list('id', 'slug', 'name'))
+    # Меню категорий есть на каждой странице - его изменение меняет все страницы
+    layout = _fingerprint(categories, getattr(settings, 'SHOP_NAME', ''))
+
+    per_category = {
+        row['category_id']: (row['count'], row['last_updated'])
+        for row in Product.objects.filter(available=True).values('category_id').annotate(
+            count=Count('id'), last_updated=Max('updated_at')
+        )
+    }
+    reviews = {
+        row['product_id']: (row['count'], row['last_created'])
+        for row in Review.objects.filter(approved=True).values('product_id').annotate(
+            count=Count('id'), last_created=Max('created_at')
+        )
+    }
+
+    pages = {reverse('shop:home'): _fingerprint(layout, sorted(per_category.items()))}
+
+    for category_id, slug, name in categories:
+        state = per_category.get(category_id, (0, None))
+        url = reverse('shop:category_detail', kwargs={'slug': slug})
+        fingerprint = _fingerprint(layout, name, state)
+        pages[url] = fingerprint
+        for page in range(2, Paginator(range(state[0]), CATEGORY_PAGE_SIZE).num_pages + 1):
+            pages[f"{url}?page={page}"] = fingerprint
+
+    products = Product.objects.values_list('id', 'slug', 'category_id', 'updated_at')
+    for product_id, slug, category_id, updated_at in products.iterator(chunk_size=2000):
+        url = reverse('shop:product_detail', kwargs={'slug': slug})
+        # Похожие товары берутся из той же категории
+        pages[url] = _fingerprint(layout, updated_at, per_category.get(category_id), reviews.get(product_id))
+
+    return pages
+
+
+def default_host():
+    """Первый конкретный хост из ALLOWED_HOSTS: с ним страницы проходят проверку Host в production"""
+    for host in settings.ALLOWED_HOSTS:
+        if not host.startswith(('.', '*')):
+            return host
+    return 'localhost'
+
+
+def _init_worker(host):
+    global _client
+    from django.test import Client
+    # Ошибка одной view должна давать ответ 500, а не обрывать всю выгрузку
+    _client = Client(HTTP_HOST=host, raise_request_exception=False)
+
+
+def render_page(url, output_dir):
+    """Рендерит страницу через обычные view и шаблоны и сохраняет ее на диск"""
+    try:
+        # Запрос как по HTTPS: иначе SECURE_SSL_REDIRECT отвечает 301 на каждую страницу
+        response = _client.get(url, secure=True)
+        if response.status_code != 200:
+            return url, response.status_code, []
+        content = response.content
+        target = os.path.join(output_dir, url_to_path(url))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+    except Exception as e:
+        logger.error(f"Ошибка выгрузки страницы {url}: {e}")
+        return url, 500, []
+    return url, 200, ASSET_RE.findall(content.decode('utf-8', errors='ignore'))
+
+
+def copy_asset(url, output_dir):
+    """Копирует статический файл или изображение из media в дерево экспорта"""
+    if url.startswith(settings.MEDIA_URL):
+        source = os.path.join(settings.MEDIA_ROOT, url[len(settings.MEDIA_URL):])
+    else:
+        source = finders.find(url[len(settings.STATIC_URL):])
+    if not source or not os.path.isfile(source):
+        return False
+    target = os.path.join(output_dir, url.lstrip('/'))
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return True
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copy2(source, target)
+    return True
+
+
+class StaticSiteExporter:
+    """Инкрементальный экспорт каталога в статический HTML для CDN/nginx"""
+
+    def __init__(self, output_dir, workers=None, host=None, full=False):
+        self.output_dir = str(output_dir)
+        self.workers = workers or os.cpu_count() or 1
+        self.host = host or default_host()
+        self.full = full
+
+    def load_manifest(self):
+        """{url: отпечаток} выгруженных страниц"""
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        if self.full or not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        # Старый формат манифеста - плоский словарь страниц
+        return data.get('pages', {}) if 'pages' in data else data
+
+    def save_manifest(self, manifest, failed=()):
+        """Страницы с ошибкой не попадают в pages и будут перерисованы в следующий раз"""
+        path = os.path.join(self.output_dir, MANIFEST_NAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'pages': manifest, 'failed': dict(failed)}, f)
+        os.replace(path + '.tmp', path)
+
+    def render(self, urls):
+        """Результаты render_page; при одном процессе рендерит без пула"""
+        if self.workers == 1:
+            _init_worker(self.host)
+            return [render_page(url, self.output_dir) for url in urls]
+        # Дочерние процессы не должны наследовать открытые соединения с БД
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker, initargs=(self.host,)) as pool:
+            return list(pool.map(render_page, urls, [self.output_dir] * len(urls), chunksize=16))
+
+    def run(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        previous = self.load_manifest()
+        pages = collect_pages()
+        stale = [url for url, fingerprint in pages.items() if previous.get(url) != fingerprint]
+        removed = [url for url in previous if url not in pages]
+
+        for url in removed:
+            target = os.path.join(self.output_dir, url_to_path(url))
+            if os.path.exists(target):
+                os.remove(target)
+
+        manifest = {url: fingerprint for url, fingerprint in previous.items() if url in pages}
+        failed, assets = [], set()
+        if stale:
+            for url, status, page_assets in self.render(stale):
+                if status == 200:
+                    manifest[url] = pages[url]
+                    assets.update(page_assets)
+                else:
+                    manifest.pop(url, None)
+                    failed.append((url, status))
+                    logger.error(f"Страница {url} не выгружена: HTTP {status}")
+
+        copied = sum(1 for url in assets if copy_asset(url, self.output_dir))
+        self.save_manifest(manifest, failed)
+        return {
+            'pages': len(pages),
+            'rendered': len(stale) - len(failed),
+            'skipped': len(pages) - len(stale),
+            'removed': len(removed),
+            'failed': failed,
+            'assets': copied,
+        }
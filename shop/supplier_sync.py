@@ -0,0 +1,167 @@
+import logging
+import time
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog import invalidate_catalog_version
+from .catalog_import import parse_bool, parse_price, parse_stock
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+SYNC_FIELDS = ('price', 'stock', 'available')
+# Сколько строк блокировать и перечитывать одним запросом при записи
+APPLY_CHUNK_SIZE = 500
+
+
+class SyncSummary:
+    """Итоги синхронизации с фидом поставщика"""
+
+    def __init__(self):
+        self.rows = 0
+        self.matched = 0
+        self.unknown = []
+        self.invalid = []
+        self.unchanged = 0
+        self.zeroed = 0
+        self.changes = []
+        self.applied = False
+        self.elapsed = 0.0
+
+    @property
+    def price_changes(self):
+        return sum(1 for change in self.changes if 'price' in change['fields'])
+
+    @property
+    def stock_changes(self):
+        return sum(1 for change in self.changes if 'stock' in change['fields'])
+
+    def as_dict(self):
+        return {
+            'rows': self.rows,
+            'matched': self.matched,
+            'changed': len(self.changes),
+            'price_changes': self.price_changes,
+            'stock_changes': self.stock_changes,
+            'unchanged': self.unchanged,
+            'zeroed': self.zeroed,
+            'unknown': len(self.unknown),
+            'invalid': len(self.invalid),
+            'applied': self.applied,
+            'elapsed': round(self.elapsed, 3),
+        }
+
+    def __str__(self):
+        return (
+            f"Строк фида: {self.rows}, найдено: {self.matched}, изменено: {len(self.changes)} "
+            f"(цена: {self.price_changes}, остаток: {self.stock_changes}), без изменений: {self.unchanged}, "
+            f"обнулено: {self.zeroed}, неизвестных: {len(self.unknown)}, ошибок: {len(self.invalid)}, "
+            f"{self.elapsed:.2f} с"
+        )
+
+
+class SupplierFeedSync:
+    """Сравнивает фид поставщика с каталогом и записывает только изменившиеся товары"""
+
+    def __init__(self, zero_missing=False):
+        self.zero_missing = zero_missing
+
+    def load_index(self):
+        """Индекс текущих товаров по артикулу и slug: только нужные колонки, без изображений"""
+        by_sku, by_slug, rows = {}, {}, {}
+        queryset = Product.objects.values_list('id', 'sku', 'slug', *SYNC_FIELDS)
+        for product_id, sku, slug, price, stock, available in queryset.iterator(chunk_size=5000):
+            rows[product_id] = (price, stock, available)
+            if sku:
+                by_sku[sku] = product_id
+            by_slug[slug] = product_id
+        return by_sku, by_slug, rows
+
+    def diff(self, feed_rows):
+        """Возвращает итоги и словарь {product_id: новые значения} для изменившихся товаров"""
+        started = time.monotonic()
+        summary = SyncSummary()
+        by_sku, by_slug, current = self.load_index()
+        updates, seen = {}, set()
+
+        for row in feed_rows:
+            summary.rows += 1
+            key = row.get('sku') or row.get('slug')
+            product_id = by_sku.get(row.get('sku')) or by_slug.get(row.get('slug'))
+            if product_id is None:
+                summary.unknown.append(key)
+                continue
+            # Товар есть в фиде, даже если строка с ошибкой: --zero-missing его не обнуляет
+            seen.add(product_id)
+            try:
+                values = self._parse(row)
+            except ValueError as e:
+                summary.invalid.append(f"{key}: {e}")
+                continue
+
+            summary.matched += 1
+            self._compare(product_id, key, current[product_id], values, updates, summary)
+
+        if self.zero_missing:
+            for product_id, (price, stock, available) in current.items():
+                if product_id not in seen and stock:
+                    self._compare(product_id, product_id, (price, stock, available), {'stock': 0}, updates, summary)
+                    summary.zeroed += 1
+
+        summary.elapsed = time.monotonic() - started
+        return summary, updates, current
+
+    def sync(self, feed_rows, dry_run=False):
+        summary, updates, current = self.diff(feed_rows)
+        if updates and not dry_run:
+            self.apply(updates)
+            summary.applied = True
+        logger.info(f"Синхронизация с поставщиком: {summary}")
+        return summary
+
+    def apply(self, updates):
+        """Записывает изменения в одной транзакции, перечитав строки под блокировкой
+
+        Пока сравнивался фид, оформленные заказы могли уменьшить остатки. Поэтому
+        строки блокируются select_for_update, сравниваются заново, и каждый товар
+        обновляет только поля, которые отличаются от фида: остаток товара, у которого
+        изменилась лишь цена, не перезаписывается прочитанным ранее значением.
+        """
+        now = timezone.now()
+        product_ids = list(updates)
+        with transaction.atomic():
+            groups = defaultdict(list)
+            for start in range(0, len(product_ids), APPLY_CHUNK_SIZE):
+                chunk = product_ids[start:start + APPLY_CHUNK_SIZE]
+                fresh = Product.objects.select_for_update().filter(id__in=chunk).values_list('id', *SYNC_FIELDS)
+                for product_id, *values in fresh:
+                    stored = dict(zip(SYNC_FIELDS, values))
+                    changed = {field: value for field, value in updates[product_id].items() if stored[field] != value}
+                    if changed:
+                        groups[tuple(sorted(changed))].append(Product(id=product_id, updated_at=now, **changed))
+            for fields, products in groups.items():
+                Product.objects.bulk_update(products, [*fields, 'updated_at'], batch_size=1000)
+        invalidate_catalog_version()
+
+    def _parse(self, row):
+        values = {}
+        if row.get('price'):
+            values['price'] = parse_price(row['price'])
+        if row.get('stock'):
+            values['stock'] = parse_stock(row['stock'])
+        if row.get('available'):
+            values['available'] = parse_bool(row['available'])
+        return values
+
+    def _compare(self, product_id, key, current, values, updates, summary):
+        fields = {}
+        for field, old in zip(SYNC_FIELDS, current):
+            if field in values and values[field] != old:
+                fields[field] = (old, values[field])
+        if not fields:
+            summary.unchanged += 1
+            return
+        updates.setdefault(product_id, {}).update({field: new for field, (old, new) in fields.items()})
+        summary.changes.append({'product_id': product_id, 'key': key, 'fields': fields})
@@ -1,3 +1,1038 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import quote, unquote
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.http import FileResponse, HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from constr_store.asgi import DisconnectMiddleware
+from telegram_bot.fake_api import FakeBotAPIServer
+from telegram_bot.messages import simple_payment_message
+from telegram_bot.ratelimit import scheduler
+
+from . import order_codes
+from .cart import ABANDONED_CART_DAYS, CART_COOKIE_NAME, CookieCart, DatabaseCart, get_cart_summary
+from .catalog import get_catalog_version
+from .catalog_import import CatalogImporter, ingest_images, iter_catalog_rows, load_image
+from .events import broker, order_event
+from .models import (
+    Cart, CartItem, Category, IdempotencyKey, Order, OrderItem, OutboxMessage, Product, StockReservation,
+)
+from .order_codes import CODE_ALPHABET, BlockAllocator, format_code, reserve_block
+from .orders import OutOfStockError, place_order
+from .outbox import OutboxWorker, enqueue_telegram
+from .reservations import release, release_expired, reserve
+from .static_export import MANIFEST_NAME, StaticSiteExporter
+from .supplier_sync import SupplierFeedSync
+from .views import ProductDetailView
+
+
+# Манифест WhiteNoise появляется только после collectstatic
+TEST_STATIC_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage'
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class CartSummaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.products = [
+            Product.objects.create(
+                name=f'Дрель {i}', slug=f'drel-{i}', description='', price=Decimal('100.50') * (i + 1),
+                stock=10, category=cls.category, image_data='aGVsbG8=',
+            )
+            for i in range(6)
+        ]
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill_cart(self, count):
+        for product in self.products[:count]:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_summary_totals(self):
+        self.fill_cart(3)
+        with self.assertNumQueries(1):
+            summary = get_cart_summary(self.cart)
+            self.assertEqual(summary.total_items, 6)
+            self.assertEqual(summary.total_price, Decimal('1206.00'))
+            self.assertEqual(summary.items[1].line_total, Decimal('402.00'))
+            self.assertEqual(summary.items[1].product.category.name, 'Дрели')
+
+    def assertQueryBudget(self, url, budget):
+        # Сессия, пользователь, корзина, позиции, меню категорий (+ профиль на оформлении)
+        for count in (1, 6):
+            CartItem.objects.all().delete()
+            self.fill_cart(count)
+            # Первый показ после входа один раз записывает в сессию число товаров для значка
+            self.client.get(url)
+            with self.assertNumQueries(budget):
+                response = self.client.get(url)
+            self.assertContains(response, f'Дрель {count - 1}')
+
+    def test_cart_detail_query_budget(self):
+        self.assertQueryBudget(reverse('shop:cart_detail'), 5)
+
+    def test_checkout_query_budget(self):
+        self.assertQueryBudget(reverse('shop:checkout'), 6)
+
+
+CUSTOMER = {
+    'first_name': 'Иван', 'last_name': 'Петров', 'email': 'ivan@example.com',
+    'phone': '+996555000000', 'address': 'ул. Ленина, 1', 'city': 'Бишкек', 'postal_code': '',
+}
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class CartBadgeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=10, category=category,
+        )
+
+    def count(self):
+        return self.client.get(reverse('shop:cart_count_api')).json()['count']
+
+    def test_anonymous_count_from_cookie(self):
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 3})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count(), 3)
+
+    @override_settings(SHOP_ANONYMOUS_CART_BACKEND='shop.cart.SessionDatabaseCart')
+    def test_session_cart_not_created_for_badge(self):
+        response = self.client.get(reverse('shop:home'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Session.objects.exists())
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 2})
+        self.assertEqual(self.count(), 2)
+
+    def test_user_count_kept_in_session(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 2})
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 1})
+        # Только сессия и пользователь, без запросов к корзине
+        with self.assertNumQueries(2):
+            self.assertEqual(self.count(), 3)
+        self.client.post(reverse('shop:cart_remove', args=[self.product.id]))
+        self.assertEqual(self.count(), 0)
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class CookieCartTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=5, category=category,
+        )
+
+    def test_anonymous_cart_kept_in_signed_cookie(self):
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 2})
+        self.assertFalse(Cart.objects.exists())
+        self.assertIn(CART_COOKIE_NAME, self.client.cookies)
+        self.assertEqual(StockReservation.objects.get().quantity, 2)
+        response = self.client.get(reverse('shop:cart_detail'))
+        self.assertEqual(response.context['summary'].total_price, Decimal('200.00'))
+
+    def test_tampered_cookie_ignored(self):
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 2})
+        self.client.cookies[CART_COOKIE_NAME] = self.client.cookies[CART_COOKIE_NAME].value[:-2] + 'xx'
+        response = self.client.get(reverse('shop:cart_detail'))
+        self.assertFalse(response.context['summary'])
+
+    def test_checkout_converts_cookie_cart(self):
+        self.client.post(reverse('shop:cart_add', args=[self.product.id]), {'quantity': 2})
+        request = RequestFactory().get('/')
+        request.COOKIES[CART_COOKIE_NAME] = self.client.cookies[CART_COOKIE_NAME].value
+        cart = CookieCart(request)
+        order, _ = place_order(cart, User.objects.create_user('buyer'), CUSTOMER)
+        self.assertEqual(order.total_price, Decimal('200.00'))
+        self.assertEqual(cart.items, {})
+        self.assertFalse(StockReservation.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (3, 0))
+        response = HttpResponse()
+        cart.save(response)
+        self.assertEqual(response.cookies[CART_COOKIE_NAME].value, '')
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class CartMergeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.products = [
+            Product.objects.create(
+                name=f'Дрель {i}', slug=f'drel-{i}', description='', price=Decimal('100.00'), stock=5,
+                category=category,
+            )
+            for i in range(2)
+        ]
+
+    def login(self):
+        return self.client.post(reverse('accounts:login'), {'username': 'buyer', 'password': 'password'})
+
+    def test_cookie_cart_merged_into_user_cart(self):
+        DatabaseCart(Cart.objects.create(user=self.user)).add(self.products[0], 1)
+        for product in self.products:
+            self.client.post(reverse('shop:cart_add', args=[product.id]), {'quantity': 2})
+        self.login()
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(
+            dict(cart.items.values_list('product_id', 'quantity')),
+            {self.products[0].id: 3, self.products[1].id: 2},
+        )
+        self.assertEqual(self.client.cookies[CART_COOKIE_NAME].value, '')
+        # Резервы cookie переходят корзине пользователя и не удваиваются
+        self.assertEqual(
+            set(StockReservation.objects.values_list('holder', 'quantity')),
+            {(DatabaseCart.holder_for(cart.id), 3), (DatabaseCart.holder_for(cart.id), 2)},
+        )
+        self.assertEqual(self.client.get(reverse('shop:cart_count_api')).json()['count'], 5)
+
+    @override_settings(SHOP_ANONYMOUS_CART_BACKEND='shop.cart.SessionDatabaseCart')
+    def test_session_cart_merged_and_deleted(self):
+        self.client.post(reverse('shop:cart_add', args=[self.products[0].id]), {'quantity': 2})
+        anonymous = Cart.objects.get(user__isnull=True)
+        self.login()
+        self.assertFalse(Cart.objects.filter(id=anonymous.id).exists())
+        self.assertEqual(Cart.objects.get(user=self.user).items.get().quantity, 2)
+
+    def test_purge_abandoned_carts(self):
+        old = timezone.now() - timedelta(days=ABANDONED_CART_DAYS + 1)
+        abandoned = [Cart.objects.create(session_key=f'old-{i}') for i in range(3)]
+        for cart in abandoned:
+            CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+        recent = Cart.objects.create(session_key='recent')
+        own = Cart.objects.create(user=self.user)
+        Cart.objects.filter(id__in=[cart.id for cart in abandoned] + [own.id]).update(updated_at=old)
+
+        out = io.StringIO()
+        call_command('purge_carts', '--batch-size', '2', stdout=out)
+        self.assertIn('Удалено корзин: 3, позиций: 3', out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {recent.id, own.id})
+
+
+class CartBatchAPITests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.products = [
+            Product.objects.create(
+                name=f'Дрель {i}', slug=f'drel-{i}', description='', price=Decimal('10.00'), stock=3,
+                category=category,
+            )
+            for i in range(2)
+        ]
+
+    def batch(self, operations):
+        return self.client.post(
+            reverse('shop:cart_batch_api'), json.dumps({'operations': operations}), content_type='application/json',
+        )
+
+    def assertBatchResponse(self):
+        first, second = self.products
+        response = self.batch([
+            {'op': 'add', 'product_id': first.id, 'quantity': 2},
+            {'op': 'set', 'product_id': second.id, 'quantity': 3},
+            {'op': 'remove', 'product_id': second.id},
+            {'op': 'add', 'product_id': 999999},
+        ])
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['items'], [{
+            'product_id': first.id, 'name': 'Дрель 0', 'price': '10.00', 'quantity': 2, 'line_total': '20.00',
+        }])
+        self.assertEqual((data['total_price'], data['total_items'], data['missing']), ('20.00', 2, [999999]))
+
+    def test_database_cart(self):
+        self.client.force_login(self.user)
+        self.assertBatchResponse()
+        self.assertEqual(Cart.objects.get(user=self.user).items.count(), 1)
+
+    def test_cookie_cart(self):
+        self.assertBatchResponse()
+        self.assertFalse(Cart.objects.exists())
+
+    def test_invalid_operations_rejected(self):
+        self.assertEqual(self.batch([{'op': 'drop', 'product_id': 1}]).status_code, 400)
+        self.assertEqual(self.batch([]).status_code, 400)
+
+    def test_out_of_stock_leaves_cart_unchanged(self):
+        self.client.force_login(self.user)
+        response = self.batch([
+            {'op': 'add', 'product_id': self.products[0].id, 'quantity': 1},
+            {'op': 'add', 'product_id': self.products[1].id, 'quantity': 4},
+        ])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['out_of_stock'], [self.products[1].id])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class PlaceOrderTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        cls.category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.products = [
+            Product.objects.create(
+                name=f'Дрель {i}', slug=f'drel-{i}', description='', price=Decimal('100.00'),
+                stock=3, category=cls.category,
+            )
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        self.cart = Cart.objects.create(user=self.user)
+        for product in self.products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def test_order_created_and_stock_decremented(self):
+        order, order_items = place_order(DatabaseCart(self.cart), self.user, CUSTOMER)
+        self.assertEqual(order.total_price, Decimal('600.00'))
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertEqual(order_items[0].product.name, 'Дрель 0')
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {1})
+        self.assertFalse(self.cart.items.exists())
+
+    def test_out_of_stock_rolls_back(self):
+        Product.objects.filter(id=self.products[2].id).update(stock=1)
+        with self.assertRaises(OutOfStockError) as raised:
+            place_order(DatabaseCart(self.cart), self.user, CUSTOMER)
+        self.assertEqual(raised.exception.products, [self.products[2]])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(list(Product.objects.order_by('id').values_list('stock', flat=True)), [3, 3, 1])
+        self.assertEqual(self.cart.items.count(), 3)
+
+    def test_cancelled_order_restocked_once(self):
+        order, _ = place_order(DatabaseCart(self.cart), self.user, CUSTOMER)
+        stale = Order.objects.get(pk=order.pk)
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {3})
+        # Повторная отмена из другой копии заказа (админка, бот) остатки не удваивает
+        stale.status = 'cancelled'
+        stale.save()
+        order.save()
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {3})
+        self.assertEqual(Order.objects.get(pk=order.pk).status, 'cancelled')
+
+
+class StockReservationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=5, category=category,
+        )
+        cls.users = [User.objects.create_user(f'buyer{i}') for i in range(2)]
+
+    def setUp(self):
+        self.first, self.second = (DatabaseCart(Cart.objects.create(user=user)) for user in self.users)
+
+    def test_reserved_quantity_is_not_available_to_other_carts(self):
+        self.first.add(self.product, 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_quantity, 1)
+        with self.assertRaises(OutOfStockError):
+            self.second.add(self.product, 2)
+        self.first.add(self.product, 3, override=True)
+        self.second.add(self.product, 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 5)
+        self.assertFalse(self.product.is_in_stock)
+        self.assertFalse(Product.objects.filter(stock__gt=F('reserved')).exists())
+
+    def test_checkout_converts_own_reservation(self):
+        self.first.add(self.product, 3)
+        self.second.add(self.product, 2)
+        place_order(self.first, self.users[0], CUSTOMER)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.stock, self.product.reserved), (2, 2))
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+    def test_save_keeps_reserved_counter(self):
+        stale = Product.objects.get(id=self.product.id)
+        self.first.add(self.product, 3)
+        stale.price = Decimal('120.00')
+        stale.save()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.price, self.product.reserved), (Decimal('120.00'), 3))
+        release(self.first.reservation_key)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 0)
+
+    def test_concurrent_first_reserve_for_same_cart(self):
+        self.first.add(self.product, 2)
+        select_for_update = StockReservation.objects.select_for_update
+        calls = []
+
+        def stale_lookup():
+            # Первое чтение не видит резерв, созданный одновременным запросом той же корзины
+            calls.append(1)
+            return StockReservation.objects.none() if len(calls) == 1 else select_for_update()
+
+        with mock.patch.object(StockReservation.objects, 'select_for_update', stale_lookup):
+            reserve(self.product, self.first.reservation_key, 3)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 3)
+        self.assertEqual(StockReservation.objects.get().quantity, 3)
+
+    def test_expired_reservations_released(self):
+        self.first.add(self.product, 3)
+        self.second.add(self.product, 1)
+        StockReservation.objects.filter(holder=self.first.reservation_key).update(expires_at=timezone.now())
+        self.assertEqual(release_expired(batch_size=1), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.reserved, 1)
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class IdempotentCheckoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=5, category=category,
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+        DatabaseCart(Cart.objects.create(user=self.user)).add(self.product, 1)
+
+    def test_repeated_submit_creates_one_order(self):
+        data = dict(CUSTOMER, idempotency_key='checkout-key-1')
+        first = self.client.post(reverse('shop:checkout'), data)
+        second = self.client.post(reverse('shop:checkout'), data)
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertEqual(second['Location'], first['Location'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+
+    @override_settings(TELEGRAM_MANAGER_USERNAME='kg_manager')
+    def test_redirects_to_manager_with_order_message(self):
+        response = self.client.post(reverse('shop:checkout'), dict(CUSTOMER, idempotency_key='checkout-key-3'))
+        text = quote(simple_payment_message(Order.objects.get()), safe='\n')
+        self.assertEqual(response['Location'], f'https://t.me/kg_manager?text={text}')
+        self.assertIn('Дрель 1 шт.', unquote(response['Location']))
+
+    def test_key_reused_with_other_payload_rejected(self):
+        self.client.post(reverse('shop:checkout'), dict(CUSTOMER, idempotency_key='checkout-key-2'))
+        response = self.client.post(reverse('shop:checkout'), dict(CUSTOMER, city='Ош', idempotency_key='checkout-key-2'))
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+
+class OrderStatusETagTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=5, category=category,
+        )
+        cart = DatabaseCart(Cart.objects.create(user=cls.user))
+        cart.add(product, 1)
+        cls.order, _ = place_order(cart, cls.user, CUSTOMER)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+        self.url = reverse('shop:order_status_api', args=[self.order.id])
+
+    def test_unchanged_status_answered_without_queries(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.json()['version'], 1)
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_status_change_produces_new_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'confirmed'
+            self.order.save(update_fields=['status'])
+        self.assertEqual(self.order.version, 2)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'confirmed')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_new_etag_revalidates_after_version_bump(self):
+        old_etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'confirmed'
+            self.order.save(update_fields=['status'])
+        new_etag = self.client.get(self.url, HTTP_IF_NONE_MATCH=old_etag)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=new_etag)
+        self.assertEqual(response.status_code, 304)
+        # Устаревший тег больше не совпадает даже при версии из кэша
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=old_etag).status_code, 200)
+
+    def test_guessed_etag_is_not_accepted(self):
+        self.client.get(self.url)
+        self.client.logout()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"{self.order.id}-1"')
+        self.assertEqual(response.status_code, 403)
+
+
+class OrderCodeTests(TestCase):
+    def test_code_format(self):
+        code = format_code(1)
+        self.assertRegex(code, r'^CHP-[0-9A-HJKMNP-TV-Z]{6}$')
+        self.assertFalse(set(code[4:]) & set('ILOU'))
+        self.assertTrue(set(code[4:]) <= set(CODE_ALPHABET))
+        with self.assertRaises(OverflowError):
+            format_code(len(CODE_ALPHABET) ** 6)
+
+    def test_consecutive_numbers_give_distinct_unrelated_codes(self):
+        codes = [format_code(number) for number in range(1, 5001)]
+        self.assertEqual(len(set(codes)), len(codes))
+        # Соседние номера не должны давать соседние коды
+        self.assertNotEqual(codes[0][:-1], codes[1][:-1])
+
+    def test_allocators_get_disjoint_blocks(self):
+        self.assertEqual(reserve_block('test', 3), (1, 4))
+        self.assertEqual(reserve_block('test', 3), (4, 7))
+        first, second = BlockAllocator('test', block_size=2), BlockAllocator('test', block_size=2)
+        numbers = [allocator.allocate() for allocator in (first, second, first, second, first)]
+        self.assertEqual(numbers, [7, 9, 8, 10, 11])
+
+    def test_orders_get_unique_codes(self):
+        user = User.objects.create_user('buyer')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=10, category=category,
+        )
+        orders = []
+        for _ in range(3):
+            cart = DatabaseCart(Cart.objects.create(user=user))
+            cart.add(product, 1)
+            orders.append(place_order(cart, user, CUSTOMER)[0])
+            cart.cart.delete()
+        codes = {order.qr_code for order in orders}
+        self.assertEqual(len(codes), 3)
+        self.assertTrue(all(code.startswith('CHP-') for code in codes))
+
+
+class OrderEventsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=5, category=category,
+        )
+        cart = DatabaseCart(Cart.objects.create(user=cls.user))
+        cart.add(product, 1)
+        cls.order, _ = place_order(cart, cls.user, CUSTOMER)
+
+    def setUp(self):
+        self.url = reverse('shop:order_events', args=[self.order.id])
+
+    def confirm(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.order.status = 'confirmed'
+            self.order.save(update_fields=['status'])
+
+    async def test_stream_sends_current_and_changed_status(self):
+        response = await self.async_client.get(self.url, {'email': CUSTOMER['email']})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = response.streaming_content
+        first = await anext(stream)
+        self.assertIn(b'retry: 3000', first)
+        self.assertIn(b'"status": "pending"', first)
+
+        await sync_to_async(self.confirm)()
+        second = await asyncio.wait_for(anext(stream), 1)
+        self.assertEqual(second, f'event: status\ndata: {json.dumps(order_event(self.order))}\n\n'.encode())
+
+        # Отключение клиента: DisconnectMiddleware отменяет задачу, ожидающую следующего события
+        reader = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0.01)
+        reader.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await reader
+        self.assertNotIn(f'order:{self.order.id}', broker._subscribers)
+
+    async def test_foreign_order_not_found(self):
+        response = await self.async_client.get(self.url, {'email': 'other@example.com'})
+        self.assertEqual(response.status_code, 404)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+
+
+class DisconnectMiddlewareTests(SimpleTestCase):
+    async def call(self, app, on_sent):
+        incoming = asyncio.Queue()
+        incoming.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+            on_sent(sent, incoming)
+
+        await asyncio.wait_for(DisconnectMiddleware(app)({'type': 'http'}, incoming.get, send), 1)
+        return sent
+
+    async def test_disconnect_cancels_streaming_response(self):
+        finished = []
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            try:
+                while True:
+                    await send({'type': 'http.response.body', 'body': b': keepalive\n\n', 'more_body': True})
+                    await asyncio.sleep(0.01)
+            finally:
+                finished.append(True)
+
+        def on_sent(sent, incoming):
+            if len(sent) == 3:
+                incoming.put_nowait({'type': 'http.disconnect'})
+
+        sent = await self.call(app, on_sent)
+        self.assertEqual(finished, [True])
+        self.assertLess(len(sent), 10)
+
+    async def test_completed_response_is_closed_normally(self):
+        closed = []
+
+        async def app(scope, receive, send):
+            await receive()
+            await send({'type': 'http.response.start', 'status': 200, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b'ok'})
+            # Сервер уже ответил бы http.disconnect, а Django еще закрывает ответ
+            await asyncio.sleep(0.05)
+            closed.append(True)
+
+        def on_sent(sent, incoming):
+            if len(sent) == 2:
+                incoming.put_nowait({'type': 'http.disconnect'})
+
+        await self.call(app, on_sent)
+        self.assertEqual(closed, [True])
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    buyers = 12
+    stock = 5
+
+    def setUp(self):
+        # Повторы при "database is locked" расходуют коды; блок, оставшийся от
+        # предыдущих тестов, после очистки БД повторил бы уже выданные номера
+        order_codes._allocator.reset()
+        category = Category.objects.create(name='Перфораторы', slug='perforatory')
+        self.product = Product.objects.create(
+            name='Перфоратор', slug='perforator', description='', price=Decimal('250.00'),
+            stock=self.stock, category=category,
+        )
+        self.carts = []
+        for i in range(self.buyers):
+            user = User.objects.create_user(f'buyer{i}')
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.carts.append((user, cart))
+
+    def test_no_oversell_under_concurrent_checkouts(self):
+        barrier = threading.Barrier(self.buyers)
+        results = []
+
+        def buy(user, cart):
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        place_order(DatabaseCart(cart), user, CUSTOMER)
+                        results.append('ok')
+                        return
+                    except OutOfStockError:
+                        results.append('out_of_stock')
+                        return
+                    except OperationalError:
+                        # SQLite отвечает "database is locked" вместо ожидания блокировки
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=args) for args in self.carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results.count('ok'), self.stock)
+        self.assertEqual(results.count('out_of_stock'), self.buyers - self.stock)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(OrderItem.objects.filter(product=self.product).count(), self.stock)
+
+
+class OutboxTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeBotAPIServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.reset()
+        scheduler.reset()
+        settings = self.settings(
+            TELEGRAM_BOT_TOKEN='123:fake', TELEGRAM_ADMIN_CHAT_ID='42', TELEGRAM_API_BASE_URL=self.server.base_url,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def drain(self, **options):
+        OutboxWorker(concurrency=2, poll_interval=0, **options).run(once=True)
+
+    def test_message_sent_after_commit(self):
+        with transaction.atomic():
+            message = enqueue_telegram('42', 'Новый заказ', {'inline_keyboard': [[{'text': 'OK', 'callback_data': 'ok'}]]})
+        self.drain()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('sent', 1))
+        sent = self.server.calls_to('sendMessage')
+        self.assertEqual([(call['chat_id'], call['text']) for call in sent], [('42', 'Новый заказ')])
+        self.assertIn('callback_data', sent[0]['reply_markup'])
+
+    def test_rolled_back_transaction_sends_nothing(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue_telegram('42', 'Отмененный заказ')
+            raise RuntimeError()
+        self.assertFalse(OutboxMessage.objects.exists())
+
+    def test_retry_after_and_dead_letter(self):
+        self.server.fail_next('sendMessage', 429, 'Too Many Requests', retry_after=30)
+        message = enqueue_telegram('42', 'Повтор')
+        self.drain()
+        message.refresh_from_db()
+        # 429 откладывает сообщение, не расходуя попытку
+        self.assertEqual((message.status, message.attempts), ('pending', 0))
+        self.assertGreater(message.next_attempt_at, timezone.now() + timedelta(seconds=20))
+
+        self.server.fail_next('sendMessage', 502, 'Bad Gateway')
+        scheduler.reset()
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        self.drain(max_attempts=1)
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('dead', 1))
+        self.assertIn('Bad Gateway', message.last_error)
+
+    def test_bad_request_is_not_retried(self):
+        self.server.fail_next('sendMessage', 400, 'Bad Request: chat not found')
+        message = enqueue_telegram('42', 'Кому?')
+        self.drain()
+        message.refresh_from_db()
+        self.assertEqual((message.status, message.attempts), ('dead', 1))
+
+    def test_burst_over_chat_limit_is_sent_as_digest(self):
+        for order_id in range(1, 26):
+            enqueue_telegram('42', f'Заказ #{order_id}', digest={
+                'title': 'Новые заказы', 'line': f'#{order_id}',
+                'buttons': [{'text': f'OK #{order_id}', 'callback_data': f'confirm_payment_{order_id}'}],
+            })
+        self.drain()
+        sent = self.server.calls_to('sendMessage')
+        self.assertEqual(len(sent), 1)
+        self.assertTrue(sent[0]['text'].startswith('Новые заказы: 25'))
+        self.assertIn('confirm_payment_25', sent[0]['reply_markup'])
+        self.assertEqual(OutboxMessage.objects.filter(status='sent').count(), 25)
+
+    def test_notify_payment_returns_before_sending(self):
+        user = User.objects.create_user('buyer', 'buyer@example.com', 'password')
+        order = Order.objects.create(user=user, total_price=Decimal('100.00'), qr_code='CHP-TEST01', **CUSTOMER)
+        self.client.force_login(user)
+        response = self.client.post(reverse('shop:notify_payment_api', args=[order.id]))
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(self.server.calls_to('sendMessage'), [])
+        self.assertEqual(OutboxMessage.objects.get().payload['chat_id'], '42')
+        self.drain()
+        self.assertIn(f'#{order.id}', self.server.calls_to('sendMessage')[0]['text'])
+
+
+class CatalogVersionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Дрели', slug='dreli')
+
+    def test_category_rename_changes_version(self):
+        version = get_catalog_version()
+        self.category.name = 'Шуруповерты'
+        self.category.slug = 'shurupoverty'
+        self.category.save()
+        self.assertNotEqual(get_catalog_version(), version)
+
+
+class CatalogImportTests(TestCase):
+    def run_import(self, text, **options):
+        rows = iter_catalog_rows(io.BytesIO(text.encode('utf-8')), 'catalog.csv')
+        return CatalogImporter(batch_size=2, **options).run(rows)
+
+    def test_upsert_counts(self):
+        result = self.run_import(
+            "Название;Артикул;Категория;Цена;Остаток\n"
+            "Дрель;D-1;Дрели;1 500,50;5\n"
+            "Перфоратор;P-1;Перфораторы;3000;2\n"
+            "Шуруповерт;S-1;Дрели;цена;1\n"
+        )
+        self.assertEqual((result.created, result.skipped, result.categories_created), (2, 1, 2))
+        self.assertEqual(Product.objects.get(sku='D-1').price, Decimal('1500.50'))
+
+        result = self.run_import(
+            "Название;Артикул;Категория;Цена;Остаток\n"
+            "Дрель;D-1;Дрели;1 500,50;7\n"
+            "Перфоратор;P-1;Перфораторы;3000;2\n"
+        )
+        self.assertEqual((result.created, result.updated, result.unchanged, result.categories_created), (0, 1, 1, 0))
+        self.assertEqual(Product.objects.get(sku='D-1').stock, 7)
+
+    def test_existing_category_slug_is_not_counted_as_created(self):
+        category = Category.objects.create(name='Drills', slug='dreli')
+        result = self.run_import("name,sku,category,price\nДрель,D-1,Дрели,100\n")
+        self.assertEqual(result.categories_created, 0)
+        self.assertEqual(Product.objects.get(sku='D-1').category, category)
+
+    def test_category_name_without_slug_characters(self):
+        result = self.run_import("name,sku,category,price\nДрель,D-1,★★★,100\n")
+        self.assertEqual(result.created, 1)
+        self.assertTrue(Product.objects.get(sku='D-1').category.slug.startswith('category-'))
+
+
+class IngestImagesTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        Product.objects.create(name='Дрель', slug='drel', description='', price=Decimal('100'), category=category)
+        with open(os.path.join(self.media_root, 'drel.png'), 'wb') as f:
+            Image.new('RGB', (2, 2)).save(f, 'PNG')
+        with open(os.path.join(self.media_root, 'notes.txt'), 'w') as f:
+            f.write('секрет')
+
+    def test_image_inside_media_root_loaded(self):
+        version = get_catalog_version()
+        updated_at = Product.objects.get(slug='drel').updated_at
+        self.assertEqual(ingest_images([('drel', 'drel.png')]), 1)
+        product = Product.objects.get(slug='drel')
+        self.assertTrue(product.image_data)
+        self.assertGreater(product.updated_at, updated_at)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_unsafe_sources_rejected(self):
+        sources = [
+            '/etc/passwd', '../../etc/passwd', 'file:///etc/passwd', 'notes.txt',
+            'http://127.0.0.1/drel.png', 'http://169.254.169.254/latest/meta-data/',
+        ]
+        for source in sources:
+            with self.subTest(source=source):
+                with self.assertRaises(ValueError):
+                    load_image(source)
+        self.assertEqual(ingest_images([('drel', source) for source in sources]), 0)
+        self.assertIsNone(Product.objects.get(slug='drel').image_data)
+
+
+class SupplierSyncTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        for sku, stock in (('A', 5), ('B', 3), ('C', 4)):
+            Product.objects.create(
+                name=f'Дрель {sku}', slug=f'drel-{sku.lower()}', sku=sku, description='',
+                price=Decimal('100.00'), stock=stock, category=category,
+            )
+
+    def product(self, sku):
+        return Product.objects.get(sku=sku)
+
+    def test_diff_reports_only_changed_products(self):
+        summary, updates, _ = SupplierFeedSync().diff([
+            {'sku': 'A', 'price': '120', 'stock': '5'},
+            {'sku': 'B', 'price': '100,00', 'stock': '3'},
+            {'sku': 'X', 'price': '1'},
+        ])
+        self.assertEqual(updates, {self.product('A').id: {'price': Decimal('120.00')}})
+        self.assertEqual((summary.matched, summary.unchanged, summary.unknown), (2, 1, ['X']))
+
+    def test_apply_keeps_concurrent_stock_decrement(self):
+        engine = SupplierFeedSync()
+        _, updates, _ = engine.diff([{'sku': 'A', 'price': '120', 'stock': '5'}])
+        # Между сравнением и записью оформлен заказ на 2 шт.
+        Product.objects.filter(sku='A').update(stock=F('stock') - 2)
+        engine.apply(updates)
+        product = self.product('A')
+        self.assertEqual((product.price, product.stock), (Decimal('120.00'), 3))
+
+    def test_zero_missing_skips_malformed_rows(self):
+        summary = SupplierFeedSync(zero_missing=True).sync([
+            {'sku': 'A', 'price': 'сто'},
+            {'sku': 'B', 'stock': '3'},
+        ])
+        self.assertEqual((summary.zeroed, len(summary.invalid)), (1, 1))
+        self.assertEqual([self.product(sku).stock for sku in 'ABC'], [5, 3, 0])
+
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class FeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.product = Product.objects.create(
+            name='Дрель & Ко', slug='drel', sku='D-1', description='', price=Decimal('150.00'),
+            stock=3, category=cls.category,
+        )
+        Product.objects.create(
+            name='Снят с продажи', slug='old', description='', price=Decimal('1'), available=False,
+            category=cls.category,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings = override_settings(FEED_CACHE_DIR=self.cache_dir)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def fetch(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_sitemap_index_and_sections(self):
+        index = self.fetch('/sitemap.xml')
+        self.assertIn('http://testserver/sitemap-products-1.xml', index)
+        self.assertIn('http://testserver/sitemap-pages-1.xml', index)
+        products = self.fetch('/sitemap-products-1.xml')
+        self.assertIn('http://testserver/product/drel/', products)
+        self.assertNotIn('/product/old/', products)
+        self.assertIn('/category/dreli/', self.fetch('/sitemap-pages-1.xml'))
+        self.assertEqual(self.client.get('/sitemap-products-2.xml').status_code, 404)
+
+    def test_feed_formats(self):
+        rows = list(csv.DictReader(io.StringIO(self.fetch('/feeds/products.csv'))))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['sku'], rows[0]['price'], rows[0]['availability']), ('D-1', '150.00 KGS', 'in stock'))
+        self.assertIn('<title>Дрель &amp; Ко</title>', self.fetch('/feeds/products.xml'))
+        self.assertEqual(self.client.get('/feeds/products.json').status_code, 404)
+
+    def test_cached_until_catalog_changes(self):
+        self.fetch('/feeds/products.csv')
+        cached = self.client.get('/feeds/products.csv')
+        cached.close()
+        self.assertIsInstance(cached, FileResponse)
+
+        self.product.price = Decimal('175.00')
+        self.product.save()
+        response = self.client.get('/feeds/products.csv')
+        self.assertNotIsInstance(response, FileResponse)
+        self.assertIn('175.00 KGS', b''.join(response.streaming_content).decode('utf-8'))
+
+
+    async def test_asgi_streams_without_buffering(self):
+        # Под ASGI синхронный итератор Django 4.2 собрал бы целиком в память
+        for cached in (False, True):
+            response = await self.async_client.get('/feeds/products.xml')
+            self.assertTrue(response.is_async)
+            content = b''.join([chunk async for chunk in response.streaming_content])
+            self.assertIn('<title>Дрель &amp; Ко</title>', content.decode('utf-8'))
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertEqual(await sync_to_async(self.fetch)('/feeds/products.xml'), content.decode('utf-8'))
+
+@override_settings(STATICFILES_STORAGE=TEST_STATIC_STORAGE)
+class StaticExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        for slug in ('drel', 'bad'):
+            Product.objects.create(
+                name=f'Дрель {slug}', slug=slug, description='', price=Decimal('100'), stock=1, category=category,
+            )
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output)
+
+    def export(self):
+        return StaticSiteExporter(self.output, workers=1, host='testserver').run()
+
+    def manifest(self):
+        with open(os.path.join(self.output, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+
+    def test_pages_written_and_unchanged_pages_skipped(self):
+        stats = self.export()
+        self.assertEqual((stats['pages'], stats['rendered'], stats['failed']), (4, 4, []))
+        for path in ('index.html', 'category/dreli/index.html', 'product/drel/index.html'):
+            self.assertTrue(os.path.exists(os.path.join(self.output, path)), path)
+        with open(os.path.join(self.output, 'product/drel/index.html'), encoding='utf-8') as f:
+            self.assertIn('Дрель drel', f.read())
+
+        self.assertEqual(self.export()['rendered'], 0)
+
+    @override_settings(SECURE_SSL_REDIRECT=True, ALLOWED_HOSTS=['.shop.example', 'shop.example'])
+    def test_production_settings(self):
+        stats = StaticSiteExporter(self.output, workers=1).run()
+        self.assertEqual((stats['rendered'], stats['failed']), (4, []))
+
+    def test_failed_page_does_not_abort_export(self):
+        get_context_data = ProductDetailView.get_context_data
+
+        def broken(view, **kwargs):
+            if view.object.slug == 'bad':
+                raise RuntimeError('шаблон сломан')
+            return get_context_data(view, **kwargs)
+
+        with mock.patch.object(ProductDetailView, 'get_context_data', broken):
+            stats = self.export()
+        self.assertEqual(stats['failed'], [('/product/bad/', 500)])
+        self.assertEqual(stats['rendered'], 3)
+        manifest = self.manifest()
+        self.assertEqual(manifest['failed'], {'/product/bad/': 500})
+        self.assertNotIn('/product/bad/', manifest['pages'])
+        self.assertIn('/product/drel/', manifest['pages'])
+
+        # Следующая выгрузка перерисовывает только упавшую страницу
+        self.assertEqual(self.export()['rendered'], 1)
@@ -14,9 +14,16 @@ urlpatterns = [
     path('checkout/', views.checkout, name='checkout'),
     path('order/<int:order_id>/qr-pay/', views.qr_payment, name='qr_payment'),
     path('api/orders/<int:order_id>/status/', views.order_status_api, name='order_status_api'),
+    path('api/orders/<int:order_id>/events/', views.order_events, name='order_events'),
     path('api/orders/<int:order_id>/generate-qr/', views.generate_qr_api, name='generate_qr_api'),
     path('api/orders/<int:order_id>/notify-payment/', views.notify_payment_api, name='notify_payment_api'),
     path('api/orders/<int:order_id>/change-payment/', views.change_payment_method_api, name='change_payment_method_api'),
+    path('api/products/batch/', views.products_batch_api, name='products_batch_api'),
+    path('api/cart/batch/', views.cart_batch_api, name='cart_batch_api'),
+    path('api/cart/count/', views.cart_count_api, name='cart_count_api'),
+    path('sitemap.xml', views.sitemap_index, name='sitemap'),
+    path('sitemap-<slug:section>-<int:page>.xml', views.sitemap_section, name='sitemap_section'),
+    path('feeds/products.<slug:format>', views.product_feed, name='product_feed'),
     path('search/', views.search, name='search'),
     path('add-review/<int:product_id>/', views.add_review, name='add_review'),
 ]
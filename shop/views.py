@@ -1,9 +1,10 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Avg
+from django.db import transaction
+from django.db.models import Q, Count, Avg, F
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404, HttpResponseNotModified, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
@@ -11,10 +12,28 @@ from django.views.generic import ListView, DetailView, CreateView
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.conf import settings
+from django.utils.http import parse_etags
 import asyncio
+import json
+import logging
 
-from .models import Product, Category, Cart, CartItem, Order, OrderItem, Review, BankAccount
+from asgiref.sync import sync_to_async
+
+from .models import Product, Category, Order, Review, BankAccount
 from .forms import ProductFilterForm, ReviewForm, CartAddProductForm
+from .catalog import get_catalog_version
+from .cart import CartOperationError, apply_cart_operations, get_cart_count, get_or_create_cart
+from .orders import (
+    OutOfStockError, get_cached_order_version, order_etag, place_order, remember_order_version,
+)
+from .idempotency import idempotent, new_idempotency_key
+from . import feeds
+from .events import order_event, subscribe_order
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число товаров в одном запросе актуализации корзины
+PRODUCTS_BATCH_MAX_IDS = 500
 
 
 def home(request):
@@ -48,7 +67,7 @@ class ProductListView(ListView):
             if form.cleaned_data['price_max']:
                 queryset = queryset.filter(price__lte=form.cleaned_data['price_max'])
             if form.cleaned_data['in_stock']:
-                queryset = queryset.filter(stock__gt=0)
+                queryset = queryset.filter(stock__gt=F('reserved'))
             if form.cleaned_data['sort_by']:
                 queryset = queryset.order_by(form.cleaned_data['sort_by'])
         
@@ -103,21 +122,9 @@ class CategoryDetailView(DetailView):
         return context
 
 
-def get_or_create_cart(request):
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = request.session.session_key
-        if not session_key:
-            request.session.create()
-            session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    return cart
-
-
 def cart_detail(request):
     cart = get_or_create_cart(request)
-    return render(request, 'shop/cart_detail.html', {'cart': cart})
+    return render(request, 'shop/cart_detail.html', {'cart': cart, 'summary': cart.summary()})
 
 
 @require_POST
@@ -127,21 +134,10 @@ def cart_add(request, product_id):
     form = CartAddProductForm(request.POST)
     
     if form.is_valid():
-        quantity = form.cleaned_data['quantity']
-        override = form.cleaned_data['override']
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            if override:
-                cart_item.quantity = quantity
-            else:
-                cart_item.quantity += quantity
-            cart_item.save()
+        try:
+            cart.add(product, form.cleaned_data['quantity'], override=form.cleaned_data['override'])
+        except OutOfStockError:
+            messages.error(request, f'Недостаточно товара "{product.name}" на складе: доступно {product.available_quantity} шт.')
     
     return redirect('shop:cart_detail')
 
@@ -150,60 +146,44 @@ def cart_add(request, product_id):
 def cart_remove(request, product_id):
     cart = get_or_create_cart(request)
     product = get_object_or_404(Product, id=product_id)
-    CartItem.objects.filter(cart=cart, product=product).delete()
+    cart.remove(product)
     return redirect('shop:cart_detail')
 
 
+@idempotent
 def checkout(request):
     cart = get_or_create_cart(request)
+    summary = cart.summary()
     
-    if not cart.items.exists():
+    if not summary:
         messages.error(request, 'Ваша корзина пуста')
         return redirect('shop:cart_detail')
     
     if request.method == 'POST':
-        # Создание заказа
         payment_method = 'telegram'  # Только Telegram оплата
         
         # Получаем данные из формы
-        first_name = request.POST.get('first_name')
-        last_name = request.POST.get('last_name')
-        email = request.POST.get('email')
-        phone = request.POST.get('phone')
-        address = request.POST.get('address')
-        city = request.POST.get('city')
-        postal_code = request.POST.get('postal_code', '')
+        customer = {
+            'first_name': request.POST.get('first_name'),
+            'last_name': request.POST.get('last_name'),
+            'email': request.POST.get('email'),
+            'phone': request.POST.get('phone'),
+            'address': request.POST.get('address'),
+            'city': request.POST.get('city'),
+            'postal_code': request.POST.get('postal_code', ''),
+        }
         
         # Создаем пользователя или используем существующего
         user = None
         if request.user.is_authenticated:
             user = request.user
         
-        # Создаем заказ
-        order = Order.objects.create(
-            user=user,
-            first_name=first_name,
-            last_name=last_name,
-            email=email,
-            phone=phone,
-            address=address,
-            city=city,
-            postal_code=postal_code,
-            total_price=cart.total_price,
-            payment_method=payment_method
-        )
-        
-        # Создаем элементы заказа
-        for item in cart.items.all():
-            OrderItem.objects.create(
-                order=order,
-                product=item.product,
-                quantity=item.quantity,
-                price=item.product.price
-            )
-        
-        # Очищаем корзину
-        cart.items.all().delete()
+        # Заказ, позиции и списание остатков - одна транзакция
+        try:
+            order, _ = place_order(cart, user, customer, payment_method=payment_method)
+        except OutOfStockError as e:
+            messages.error(request, f'Недостаточно товара на складе: {e}')
+            return redirect('shop:cart_detail')
         
         # Формируем сообщение для пользователя
         from django.conf import settings
@@ -211,24 +191,22 @@ def checkout(request):
         
         messages.success(request, f'Заказ #{order.id} оформлен! Теперь напишите менеджеру в Telegram для оплаты.')
         
-        # Формируем сообщение с товарами
-        product_lines = []
-        for item in order.items.all():
-            product_lines.append(f"{item.product.name} {item.quantity} шт.")
-        
-        products_text = "\n".join(product_lines) if product_lines else "нет товаров"
-        simple_message = f"Я хочу оплатить заказ #{order.id}: {products_text}"
-        
-        # Отладка - выводим в консоль
-        print(f"DEBUG: Товары в заказе {order.id}: {product_lines}")
-        print(f"DEBUG: Сообщение для Telegram: {repr(simple_message)}")
+        # Тот же текст, что и у остальных сообщений о заказе
+        from telegram_bot.messages import simple_payment_message
+        simple_message = simple_payment_message(order)
+        logger.debug(f"Сообщение для Telegram по заказу #{order.id}: {simple_message!r}")
         
         # Перенаправляем в Telegram с настоящими переносами строк
         from urllib.parse import quote
         encoded_message = quote(simple_message, safe='\n')
         return redirect(f'https://t.me/{telegram_username}?text={encoded_message}')
     
-    return render(request, 'shop/checkout.html', {'cart': cart})
+    return render(request, 'shop/checkout.html', {
+        'cart': cart,
+        'summary': summary,
+        # Повторная отправка формы (двойной клик) не создаст второй заказ
+        'idempotency_key': new_idempotency_key(),
+    })
 
 
 @require_POST
@@ -290,7 +268,21 @@ def qr_payment(request, order_id):
 
 
 def order_status_api(request, order_id):
-    """API для проверки статуса заказа"""
+    """API для проверки статуса заказа
+
+    Поддерживает If-None-Match: неизменившийся статус подтверждается ответом 304
+    по версии из кэша, без единого запроса к БД.
+    """
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if if_none_match:
+        version = get_cached_order_version(order_id)
+        # Проверка доступа здесь не нужна: подписанный тег есть только у того, кто ее уже прошел
+        if version is not None and order_etag(order_id, version) in if_none_match:
+            response = HttpResponseNotModified()
+            response['ETag'] = order_etag(order_id, version)
+            response['Cache-Control'] = 'private, no-cache'
+            return response
+
     try:
         if request.user.is_authenticated:
             order = get_object_or_404(Order, id=order_id, user=request.user)
@@ -304,16 +296,21 @@ def order_status_api(request, order_id):
                     'error': 'Доступ запрещен. Укажите email в параметрах запроса.'
                 }, status=403)
             order = get_object_or_404(Order, id=order_id, email=email)
-        
-        print(f"Проверка статуса заказа #{order_id}: paid={order.paid}, status={order.status}")  # Отладка
-        
-        return JsonResponse({
+
+        logger.debug(f"Проверка статуса заказа #{order_id}: paid={order.paid}, status={order.status}")
+        remember_order_version(order)
+
+        response = JsonResponse({
             'paid': order.paid,
             'status': order.status,
-            'order_id': order.id
+            'order_id': order.id,
+            'version': order.version,
         })
+        response['ETag'] = order_etag(order.id, order.version)
+        response['Cache-Control'] = 'private, no-cache'
+        return response
     except Exception as e:
-        print(f"Ошибка в order_status_api: {e}")  # Отладка
+        logger.error(f"Ошибка в order_status_api: {e}")
         return JsonResponse({
             'paid': False,
             'status': 'error',
@@ -321,6 +318,56 @@ def order_status_api(request, order_id):
         }, status=500)
 
 
+ORDER_EVENTS_KEEPALIVE = 15
+# Через столько секунд поток закрывается, EventSource переподключится сам
+ORDER_EVENTS_MAX_DURATION = 300
+
+
+def _find_order_for_request(request, order_id):
+    """Заказ текущего пользователя или заказ с email из параметров запроса"""
+    if request.user.is_authenticated:
+        return Order.objects.filter(id=order_id, user=request.user).first()
+    email = request.GET.get('email')
+    if not email:
+        return None
+    return Order.objects.filter(id=order_id, email=email).first()
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def order_events(request, order_id):
+    """Server-Sent Events: статус заказа приходит клиенту сразу после изменения"""
+    order = await sync_to_async(_find_order_for_request)(request, order_id)
+    if order is None:
+        return JsonResponse({'success': False, 'error': 'Заказ не найден'}, status=404)
+
+    # Подписываемся до отправки текущего состояния, чтобы не пропустить изменение между ними
+    subscription = subscribe_order(order.id)
+
+    async def stream():
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ORDER_EVENTS_MAX_DURATION
+        try:
+            yield f"retry: 3000\n{_sse('status', order_event(order))}"
+            while loop.time() < deadline:
+                try:
+                    timeout = min(ORDER_EVENTS_KEEPALIVE, deadline - loop.time())
+                    event = await asyncio.wait_for(subscription.get(), timeout=max(timeout, 0))
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse('status', event)
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 def generate_qr_api(request, order_id):
     """API для генерации QR-кода заказа"""
     if request.method != 'POST':
@@ -407,14 +454,19 @@ def change_payment_method_api(request, order_id):
 
 
 @csrf_exempt
+@idempotent
 def notify_payment_api(request, order_id):
     """API для отправки уведомления об оплате"""
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Method not allowed'}, status=405)
     
     try:
+        from telegram_bot.messages import with_message_items
+
+        # Позиции с товарами для текста уведомления - одним запросом
+        orders = with_message_items(Order.objects.all())
         if request.user.is_authenticated:
-            order = get_object_or_404(Order, id=order_id, user=request.user)
+            order = get_object_or_404(orders, id=order_id, user=request.user)
         else:
             # Для неавторизованных пользователей ищем заказ по email
             email = request.GET.get('email')
@@ -423,14 +475,14 @@ def notify_payment_api(request, order_id):
                     'success': False,
                     'error': 'Доступ запрещен. Укажите email в параметрах запроса.'
                 }, status=403)
-            order = get_object_or_404(Order, id=order_id, email=email)
+            order = get_object_or_404(orders, id=order_id, email=email)
         
-        # Отправляем уведомление в Telegram
+        # Уведомление уходит через outbox: ответ не ждет Telegram
         try:
-            from telegram_notifications_sync import send_telegram_notification_sync
+            from telegram_notifications_sync import enqueue_telegram_notification
             
-            # Используем синхронную функцию
-            success = send_telegram_notification_sync(order)
+            with transaction.atomic():
+                success = enqueue_telegram_notification(order) is not None
             
             if success:
                 return JsonResponse({
@@ -459,3 +511,115 @@ def notify_payment_api(request, order_id):
             'success': False,
             'error': f'Ошибка API: {str(e)}'
         }, status=500)
+
+
+@require_POST
+def products_batch_api(request):
+    """API для актуализации цен и остатков товаров из корзины браузера"""
+    try:
+        data = json.loads(request.body or '{}')
+        ids = [int(product_id) for product_id in data.get('ids', [])]
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'success': False, 'error': 'Некорректный список товаров'}, status=400)
+
+    if len(ids) > PRODUCTS_BATCH_MAX_IDS:
+        return JsonResponse({
+            'success': False,
+            'error': f'Можно запросить не более {PRODUCTS_BATCH_MAX_IDS} товаров'
+        }, status=400)
+
+    version = get_catalog_version()
+    if data.get('version') == version:
+        # Каталог не менялся - клиенту не нужно ничего обновлять
+        return JsonResponse({'success': True, 'version': version, 'changed': False})
+
+    products = {}
+    rows = Product.objects.filter(id__in=set(ids)).values('id', 'name', 'price', 'stock', 'reserved', 'available')
+    for row in rows:
+        stock = max(row['stock'] - row['reserved'], 0)
+        products[str(row['id'])] = {
+            'name': row['name'],
+            'price': str(row['price']),
+            'stock': stock,
+            'available': row['available'],
+            'in_stock': row['available'] and stock > 0,
+        }
+
+    return JsonResponse({
+        'success': True,
+        'version': version,
+        'changed': True,
+        'products': products,
+        'missing': [product_id for product_id in ids if str(product_id) not in products],
+    })
+
+
+@require_POST
+def cart_batch_api(request):
+    """Применяет к корзине пачку операций add/remove/set и возвращает ее состав"""
+    try:
+        data = json.loads(request.body or '{}')
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Некорректный JSON'}, status=400)
+
+    cart = get_or_create_cart(request)
+    try:
+        missing = apply_cart_operations(cart, data.get('operations') if isinstance(data, dict) else None)
+    except CartOperationError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except OutOfStockError as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Недостаточно товара на складе: {e}',
+            'out_of_stock': [product.id for product in e.products],
+        }, status=409)
+
+    summary = cart.summary()
+    return JsonResponse({
+        'success': True,
+        'items': [
+            {
+                'product_id': item.product.id,
+                'name': item.product.name,
+                'price': str(item.product.price),
+                'quantity': item.quantity,
+                'line_total': str(item.line_total),
+            }
+            for item in summary
+        ],
+        'total_price': str(summary.total_price),
+        'total_items': summary.total_items,
+        'missing': missing,
+    })
+
+
+def cart_count_api(request):
+    """Число товаров в корзине для значка в шапке"""
+    response = JsonResponse({'success': True, 'count': get_cart_count(request)})
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def sitemap_index(request):
+    """Индекс sitemap: статические страницы и шарды товаров по 50 000 URL"""
+    return feeds.cached_response(request, 'sitemap.xml', 'application/xml', feeds.generate_sitemap_index)
+
+
+def sitemap_section(request, section, page):
+    """Отдельный файл sitemap"""
+    if section == 'pages' and page == 1:
+        generate = feeds.generate_sitemap_pages
+    elif section == 'products' and 1 <= page <= feeds.sitemap_pages_count():
+        generate = lambda base_url: feeds.generate_sitemap_products(base_url, page)
+    else:
+        raise Http404("Раздел sitemap не найден")
+    return feeds.cached_response(request, f'sitemap-{section}-{page}.xml', 'application/xml', generate)
+
+
+def product_feed(request, format):
+    """Товарный фид для маркетплейсов в CSV или XML"""
+    if format == 'csv':
+        return feeds.cached_response(request, 'products.csv', 'text/csv; charset=utf-8', feeds.generate_feed_csv)
+    if format == 'xml':
+        return feeds.cached_response(request, 'products.xml', 'application/xml', feeds.generate_feed_xml)
+    raise Http404("Формат фида не поддерживается")
@@ -32,6 +32,8 @@ class Cart {
                 image_url: imageUrl,
                 category: category
             });
+            // Новый товар еще не сверялся с сервером
+            localStorage.removeItem('cart_version');
         }
         
         this.saveToStorage();
@@ -67,6 +69,55 @@ class Cart {
         return this.items.reduce((count, item) => count + item.quantity, 0);
     }
 
+    // Актуализирует цены и остатки товаров корзины одним запросом к серверу
+    async refresh() {
+        if (this.items.length === 0) return;
+
+        const data = await apiCall('/api/products/batch/', {
+            method: 'POST',
+            body: JSON.stringify({
+                ids: this.items.map(item => item.product_id),
+                version: localStorage.getItem('cart_version')
+            })
+        });
+
+        if (data.changed) {
+            this.items = this.items.filter(item => {
+                const product = data.products[item.product_id];
+                if (!product || !product.in_stock) return false;
+                item.name = product.name;
+                item.price = parseFloat(product.price);
+                item.quantity = Math.min(item.quantity, product.stock);
+                return true;
+            });
+            this.saveToStorage();
+            this.updateUI();
+        }
+        localStorage.setItem('cart_version', data.version);
+    }
+
+    // Переносит корзину браузера в серверную корзину одним запросом
+    async sync() {
+        if (this.items.length === 0) return null;
+
+        const data = await apiCall('/api/cart/batch/', {
+            method: 'POST',
+            body: JSON.stringify({
+                operations: this.items.map(item => ({
+                    op: 'set',
+                    product_id: item.product_id,
+                    quantity: item.quantity
+                }))
+            })
+        });
+
+        if (data.success) {
+            this.clear();
+            updateCartBadge(data.total_items);
+        }
+        return data;
+    }
+
     updateUI() {
         // Update cart count in navbar
         const cartCount = document.querySelector('.cart-count');
@@ -79,6 +130,15 @@ class Cart {
 // Initialize cart
 const cart = new Cart();
 
+// Значок серверной корзины в шапке
+function updateCartBadge(count) {
+    const badge = document.querySelector('.cart-badge');
+    if (badge) {
+        badge.textContent = count;
+        badge.hidden = !count;
+    }
+}
+
 // Utility functions
 function formatPrice(price) {
     return new Intl.NumberFormat('ru-RU', {
@@ -326,6 +386,7 @@ window.validateForm = validateForm;
 window.previewImage = previewImage;
 window.confirmAction = confirmAction;
 window.apiCall = apiCall;
+window.updateCartBadge = updateCartBadge;
 window.initSearch = initSearch;
 window.smoothScroll = smoothScroll;
 
@@ -334,4 +395,19 @@ document.addEventListener('DOMContentLoaded', function() {
     initSearch();
     initLazyLoading();
     cart.updateUI();
+    cart.refresh().catch(error => console.error('Cart refresh failed:', error));
+
+    // Перед переходом в корзину отправляем на сервер товары из localStorage
+    document.querySelectorAll('[data-cart-sync]').forEach(link => {
+        link.addEventListener('click', async function(event) {
+            if (cart.items.length === 0) return;
+            event.preventDefault();
+            try {
+                await cart.sync();
+            } catch (error) {
+                console.error('Cart sync failed:', error);
+            }
+            window.location.href = link.href;
+        });
+    });
 });
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import TelegramUser
+from .models import Broadcast, TelegramUser
 
 @admin.register(TelegramUser)
 class TelegramUserAdmin(admin.ModelAdmin):
@@ -7,3 +7,10 @@ class TelegramUserAdmin(admin.ModelAdmin):
     list_filter = ('is_active', 'created_at')
     search_fields = ('username', 'first_name', 'last_name', 'chat_id')
     readonly_fields = ('chat_id', 'created_at')
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'sent', 'failed', 'blocked', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    readonly_fields = ('status', 'last_user_id', 'sent', 'failed', 'blocked', 'created_at', 'started_at', 'finished_at')
@@ -1,92 +1,199 @@
-import logging
 import asyncio
+import atexit
+import logging
+import os
+import threading
 from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
 from django.conf import settings
-from asgiref.sync import sync_to_async
+
+from .messages import admin_order_message, cart_lines, items_summary, order_items
+from .ratelimit import RATE_LIMITED_METHODS, retry_after_seconds, scheduler
 
 logger = logging.getLogger(__name__)
 
+# Соединения с Bot API, которые клиент держит открытыми между сообщениями
+CONNECTION_POOL_SIZE = 8
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 10
+# Сколько раз повторять сообщение рассылки после 429
+SEND_MANY_RETRIES = 2
+
+
 class TelegramBot:
+    """Клиент Bot API с собственным event loop в фоновом потоке
+
+    Один loop и один telegram.Bot с пулом HTTP-соединений живут все время
+    работы процесса, поэтому сообщения не платят за новый loop и TLS-рукопожатие.
+    Методы send_* можно вызывать из любого потока: текст собирается в вызывающем
+    потоке (там доступна ORM), а отправка выполняется в loop и возвращает
+    concurrent.futures.Future.
+    """
+
     def __init__(self):
-        token = getattr(settings, 'TELEGRAM_BOT_TOKEN', None)
-        if not token:
-            self.bot = None
+        if not self.token:
             logger.warning("TELEGRAM_BOT_TOKEN not configured")
-        else:
-            self.bot = Bot(token=token)
-        self.admin_chat_id = getattr(settings, 'TELEGRAM_ADMIN_CHAT_ID', None)
-    
-    async def send_payment_notification(self, order):
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._pid = None
+        self._client = None
+        self._client_key = None
+        self._client_lock = None
+
+    # Настройки читаются при каждом обращении, чтобы их можно было подменить в тестах
+    @property
+    def token(self):
+        return getattr(settings, 'TELEGRAM_BOT_TOKEN', None)
+
+    @property
+    def admin_chat_id(self):
+        return getattr(settings, 'TELEGRAM_ADMIN_CHAT_ID', None)
+
+    @property
+    def base_url(self):
+        return getattr(settings, 'TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')
+
+    @property
+    def configured(self):
+        return bool(self.token and self.admin_chat_id)
+
+    def _ensure_loop(self):
+        with self._lock:
+            # После fork поток и соединения родителя в дочернем процессе недоступны
+            if self._loop is None or self._pid != os.getpid() or not self._thread.is_alive():
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._run_loop, args=(loop,), name='telegram-bot', daemon=True)
+                self._loop, self._pid, self._client = loop, os.getpid(), None
+                # Lock привязывается к loop при первом использовании, поэтому новый на каждый loop
+                self._client_lock = asyncio.Lock()
+                self._thread.start()
+            return self._loop
+
+    @staticmethod
+    def _run_loop(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    async def _get_client(self):
+        key = (self.token, self.base_url)
+        if self._client is not None and self._client_key == key:
+            return self._client
+        # Первые одновременные вызовы ждут один клиент, а не создают по пулу соединений каждый
+        async with self._client_lock:
+            if self._client is None or self._client_key != key:
+                if self._client is not None:
+                    await self._client.shutdown()
+                client = Bot(token=self.token, base_url=self.base_url, request=HTTPXRequest(
+                    connection_pool_size=CONNECTION_POOL_SIZE,
+                    connect_timeout=CONNECT_TIMEOUT,
+                    read_timeout=READ_TIMEOUT,
+                ))
+                await client.initialize()
+                self._client, self._client_key = client, key
+        return self._client
+
+    async def _call(self, method, kwargs, reserved):
+        client = await self._get_client()
+        chat_id = kwargs.get('chat_id')
+        if method in RATE_LIMITED_METHODS and not reserved:
+            # Ожидание в loop не занимает потоков: сообщения сверх лимита просто встают в очередь
+            await asyncio.sleep(scheduler.reserve(chat_id))
+        try:
+            return await getattr(client, method)(**kwargs)
+        except RetryAfter as e:
+            scheduler.backoff(chat_id, retry_after_seconds(e))
+            raise
+
+    def submit(self, method, reserved=False, **kwargs):
+        """Планирует вызов метода telegram.Bot в фоновом loop, возвращает Future
+
+        Отправки сообщений проходят через лимиты Bot API; reserved=True - вызывающий
+        уже занял место через scheduler.reserve().
+        """
+        future = asyncio.run_coroutine_threadsafe(self._call(method, kwargs, reserved), self._ensure_loop())
+        future.add_done_callback(lambda done: self._log_failure(method, done))
+        return future
+
+    @staticmethod
+    def _log_failure(method, future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Ошибка вызова Telegram {method}: {future.exception()}")
+
+    def send_message(self, chat_id, text, reply_markup=None):
+        return self.submit('send_message', chat_id=chat_id, text=text, reply_markup=reply_markup)
+
+    async def _send_many(self, chat_ids, kwargs, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def send(chat_id):
+            async with semaphore:
+                for attempt in range(SEND_MANY_RETRIES + 1):
+                    try:
+                        await self._call('send_message', {**kwargs, 'chat_id': chat_id}, False)
+                        return chat_id, None
+                    except RetryAfter as e:
+                        # _call уже приостановил чат: следующая попытка дождется retry_after
+                        if attempt == SEND_MANY_RETRIES:
+                            return chat_id, e
+                    except Exception as e:
+                        return chat_id, e
+
+        return await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+
+    def send_many(self, chat_ids, text, concurrency=20, **kwargs):
+        """Одно сообщение во много чатов через общий клиент и лимиты Bot API
+
+        Одновременно в работе не больше concurrency отправок. Возвращает Future
+        со списком (chat_id, исключение или None) в порядке chat_ids.
+        """
+        kwargs['text'] = text
+        return asyncio.run_coroutine_threadsafe(
+            self._send_many(list(chat_ids), kwargs, concurrency), self._ensure_loop()
+        )
+
+    def shutdown(self, timeout=5):
+        """Закрывает соединения клиента и останавливает loop"""
+        with self._lock:
+            loop, thread, client = self._loop, self._thread, self._client
+            if loop is None or self._pid != os.getpid():
+                return
+            self._loop = self._client = None
+        if client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(client.shutdown(), loop).result(timeout)
+            except Exception as e:
+                logger.warning(f"Не удалось закрыть клиент Telegram: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+    def send_payment_notification(self, order):
         """Отправить уведомление о новом платеже администратору"""
-        if not self.bot or not self.admin_chat_id:
+        if not self.configured:
             logger.warning("Telegram bot not configured, skipping notification")
             return
             
         try:
-            # Формируем сообщение с полной информацией
-            from datetime import datetime, timedelta
-            
-            # Конвертируем время в Кыргызстан (+6 UTC)
-            kg_time = order.created_at + timedelta(hours=6)
-            
-            message = f"""🤖 Бот KG Style:
-──────────────
-💰 НОВЫЙ ЗАКАЗ
-──────────────
-📦 Заказ: #{order.id}
-💰 Сумма: {order.total_price} сом
-🔖 Код: {order.qr_code}
-──────────────
-👤 Клиент:
-• Имя: {order.first_name} {order.last_name}
-• Email: {order.email}
-• Тел: {order.phone}
-──────────────
-📍 Доставка:
-• Город: {order.city}
-• Адрес: {order.address}
-• Индекс: {order.postal_code or 'Не указан'}
-──────────────
-⏰ Время: {kg_time.strftime('%d.%m.%Y %H:%M')} (KG)
-🛒 Товары: {self.get_order_items(order)}
-──────────────
-
-🔗 Админка: http://127.0.0.1:8000/admin/shop/order/{order.id}/change/
-──────────────"""
-            
-            # Создаем кнопки для подтверждения/отклонения
-            keyboard = [
-                [
-                    InlineKeyboardButton("✅ Подтвердить", callback_data=f"confirm_payment_{order.id}"),
-                    InlineKeyboardButton("❌ Отклонить", callback_data=f"reject_payment_{order.id}")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
+            # Первые 3 товара; позиции берутся из prefetch или одним запросом
+            message, keyboard = admin_order_message(order, items_limit=3)
+            reply_markup = InlineKeyboardMarkup.de_json(keyboard, None)
+
             # Отправляем сообщение
-            await self.bot.send_message(
-                chat_id=self.admin_chat_id,
-                text=message,
-                reply_markup=reply_markup
-            )
-            
-            logger.info(f"Отправлено уведомление о платеже для заказа #{order.id}")
+            future = self.send_message(self.admin_chat_id, message, reply_markup)
+            logger.info(f"Уведомление о платеже для заказа #{order.id} поставлено в очередь")
+            return future
             
         except Exception as e:
             logger.error(f"Ошибка отправки уведомления о платеже: {e}")
     
     def get_order_items(self, order):
         """Получить список товаров заказа"""
-        items = []
-        for item in order.items.all()[:3]:  # Показываем первые 3 товара
-            items.append(f"{item.product.name}")
-        if order.items.count() > 3:
-            items.append(f"и еще {order.items.count() - 3} шт.")
-        return ", ".join(items)
+        return items_summary(order_items(order), limit=3)
     
-    async def send_cart_to_telegram(self, cart, user_info):
+    def send_cart_to_telegram(self, cart, user_info):
         """Отправить корзину в Telegram для оплаты"""
-        if not self.bot or not self.admin_chat_id:
+        if not self.configured:
             logger.warning("Telegram bot not configured, skipping cart notification")
             return
             
@@ -108,11 +215,8 @@ class TelegramBot:
 📦 Товары в корзине:
 """
             
-            total_price = 0
-            for item in cart.items.all():
-                item_total = item.product.price * item.quantity
-                total_price += item_total
-                message += f"• {item.product.name} x{item.quantity} = {item_total} сом\n"
+            lines, total_price = cart_lines(cart)
+            message += "\n".join(lines) + "\n"
             
             message += f"""
 ──────────────────
@@ -133,50 +237,45 @@ class TelegramBot:
             reply_markup = InlineKeyboardMarkup(keyboard)
             
             # Отправляем сообщение
-            await self.bot.send_message(
-                chat_id=self.admin_chat_id,
-                text=message,
-                reply_markup=reply_markup
-            )
-            
-            logger.info(f"Отправлена корзина в Telegram для пользователя {user_info.get('email', '')}")
+            future = self.send_message(self.admin_chat_id, message, reply_markup)
+            logger.info(f"Корзина пользователя {user_info.get('email', '')} поставлена в очередь Telegram")
+            return future
             
         except Exception as e:
             logger.error(f"Ошибка отправки корзины в Telegram: {e}")
     
-    async def send_payment_confirmation(self, order):
-        """Отправить уведомление клиенту о подтверждении оплаты"""
+    def send_payment_confirmation(self, order):
+        """Отправить подтверждение оплаты в чат администратора"""
         try:
-            message = f"""✅ Ваш платеж подтвержден!
-            
-Заказ #{order.id} на сумму {order.total_price} сом оплачен.
-Ваш заказ готовится к отправке.
+            message = f"""✅ Платеж подтвержден!
 
-Спасибо за покупку! 🛍️"""
-            
-            # Здесь можно добавить отправку клиенту в Telegram, если у него есть chat_id
-            # Пока отправляем только админу
+Заказ #{order.id} на сумму {order.total_price} сом оплачен.
+Клиент: {order.first_name} {order.last_name}, {order.phone}
+Заказ готовится к отправке."""
             
-            logger.info(f"Отправлено подтверждение оплаты для заказа #{order.id}")
+            # Заказ не связан с TelegramUser, поэтому клиенту в Telegram написать нельзя -
+            # подтверждение уходит администратору
+            future = self.send_message(self.admin_chat_id, message)
+            logger.info(f"Подтверждение оплаты для заказа #{order.id} поставлено в очередь")
+            return future
             
         except Exception as e:
             logger.error(f"Ошибка отправки подтверждения оплаты: {e}")
 
 # Глобальный экземпляр бота
 telegram_bot = TelegramBot()
+atexit.register(telegram_bot.shutdown)
 
-# Синхронные обертки
+# Обертки для вызова из синхронного кода: возвращают Future или None, если бот не настроен
 def send_payment_notification(order):
-    """Синхронная обертка для отправки уведомления о платеже"""
-    if telegram_bot.bot and telegram_bot.admin_chat_id:
-        asyncio.run(telegram_bot.send_payment_notification(order))
+    """Отправка уведомления о платеже через фоновый клиент"""
+    return telegram_bot.send_payment_notification(order)
 
 def send_cart_to_telegram(cart, user_info):
-    """Синхронная обертка для отправки корзины в Telegram"""
-    if telegram_bot.bot and telegram_bot.admin_chat_id:
-        asyncio.run(telegram_bot.send_cart_to_telegram(cart, user_info))
+    """Отправка корзины в Telegram через фоновый клиент"""
+    return telegram_bot.send_cart_to_telegram(cart, user_info)
 
 def send_payment_confirmation(order):
-    """Синхронная обертка для отправки подтверждения оплаты"""
-    if telegram_bot.bot and telegram_bot.admin_chat_id:
-        asyncio.run(telegram_bot.send_payment_confirmation(order))
+    """Отправка подтверждения оплаты через фоновый клиент"""
+    if telegram_bot.configured:
+        return telegram_bot.send_payment_confirmation(order)
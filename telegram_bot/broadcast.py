@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .bot import telegram_bot
+from .models import Broadcast, BroadcastDelivery, TelegramUser
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CONCURRENCY = 20
+BROADCAST_BATCH_SIZE = 500
+# Ожидание одной пачки: при лимите 30 сообщений в секунду 500 сообщений уходят за ~17 с
+BATCH_TIMEOUT = 300
+
+
+def delivery_status(error):
+    """Статус доставки по исключению клиента"""
+    from telegram.error import Forbidden
+
+    if error is None:
+        return 'sent'
+    if isinstance(error, Forbidden):
+        return 'blocked'
+    return 'failed'
+
+
+class BroadcastSender:
+    """Рассылает Broadcast активным TelegramUser пачками
+
+    Получатели читаются потоково (.iterator()) по возрастанию id начиная с
+    контрольной точки broadcast.last_user_id. Каждая пачка уходит через общий
+    клиент бота с ограничением одновременных отправок и лимитами Bot API, затем
+    результаты пачки и новая контрольная точка записываются одной транзакцией.
+    После падения рассылка продолжается с последней записанной пачки.
+    """
+
+    def __init__(self, broadcast, concurrency=BROADCAST_CONCURRENCY, batch_size=BROADCAST_BATCH_SIZE):
+        self.broadcast = broadcast
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.stopping = threading.Event()
+
+    def recipients(self):
+        return TelegramUser.objects.filter(
+            is_active=True, id__gt=self.broadcast.last_user_id
+        ).order_by('id').values_list('id', 'chat_id').iterator(chunk_size=self.batch_size)
+
+    def batches(self):
+        batch = []
+        for row in self.recipients():
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def send_batch(self, batch):
+        kwargs = {'parse_mode': self.broadcast.parse_mode} if self.broadcast.parse_mode else {}
+        future = telegram_bot.send_many(
+            [chat_id for _, chat_id in batch], self.broadcast.text, concurrency=self.concurrency, **kwargs
+        )
+        return future.result(BATCH_TIMEOUT)
+
+    def save_batch(self, batch, results):
+        deliveries = [
+            BroadcastDelivery(
+                broadcast=self.broadcast, chat_id=chat_id, status=delivery_status(error),
+                error=str(error)[:255] if error else '',
+            )
+            for chat_id, error in results
+        ]
+        counts = {status: 0 for status, _ in BroadcastDelivery.STATUS_CHOICES}
+        for delivery in deliveries:
+            counts[delivery.status] += 1
+        blocked = [delivery.chat_id for delivery in deliveries if delivery.status == 'blocked']
+        last_user_id = batch[-1][0]
+
+        with transaction.atomic():
+            # Пачку, отправленную повторно после падения, повторно не записываем
+            BroadcastDelivery.objects.bulk_create(deliveries, ignore_conflicts=True)
+            if blocked:
+                TelegramUser.objects.filter(chat_id__in=blocked).update(is_active=False)
+            Broadcast.objects.filter(pk=self.broadcast.pk).update(
+                last_user_id=last_user_id,
+                sent=F('sent') + counts['sent'],
+                failed=F('failed') + counts['failed'],
+                blocked=F('blocked') + counts['blocked'],
+            )
+        self.broadcast.last_user_id = last_user_id
+        return counts
+
+    def run(self):
+        """Отправляет рассылку до конца или до stop(); возвращает обновленный Broadcast"""
+        Broadcast.objects.filter(pk=self.broadcast.pk).update(
+            status='running', started_at=self.broadcast.started_at or timezone.now()
+        )
+        # Падение или прерывание посреди рассылки оставляет ее на паузе с последней
+        # записанной контрольной точкой, чтобы ее можно было продолжить через --resume
+        status = 'paused'
+        try:
+            for batch in self.batches():
+                if self.stopping.is_set():
+                    break
+                started = time.monotonic()
+                counts = self.save_batch(batch, self.send_batch(batch))
+                logger.info(
+                    f"Рассылка #{self.broadcast.pk}: пачка из {len(batch)} за {time.monotonic() - started:.1f} с, "
+                    f"доставлено {counts['sent']}, ошибок {counts['failed']}, заблокировали {counts['blocked']}"
+                )
+            else:
+                status = 'done'
+        finally:
+            Broadcast.objects.filter(pk=self.broadcast.pk).update(
+                status=status, finished_at=timezone.now() if status == 'done' else None
+            )
+            if status != 'done':
+                logger.warning(f"Рассылка #{self.broadcast.pk} приостановлена после пользователя {self.broadcast.last_user_id}")
+        self.broadcast.refresh_from_db()
+        return self.broadcast
+
+    def stop(self):
+        """Остановиться после текущей пачки"""
+        self.stopping.set()
@@ -0,0 +1,116 @@
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+from dashboard.metrics import get_snapshot, period_totals
+from .bot import telegram_bot
+from .models import TelegramUser
+
+logger = logging.getLogger(__name__)
+
+PERIOD_TITLES = {
+    'today': 'сегодня',
+    'week': '7 дней',
+    'month': '30 дней',
+}
+# Русские синонимы аргумента /stats
+PERIOD_ALIASES = {
+    'сегодня': 'today',
+    'неделя': 'week',
+    'месяц': 'month',
+}
+
+HELP_TEXT = """Команды администратора:
+/stats today|week|month - продажи за период
+/pending - заказы, ожидающие подтверждения"""
+
+
+def parse_command(text):
+    """'/stats@kg_bot week' -> ('stats', ['week'])"""
+    parts = text.split()
+    if not parts or not parts[0].startswith('/'):
+        return None, []
+    return parts[0][1:].split('@')[0].lower(), parts[1:]
+
+
+def stats_message(period, snapshot):
+    totals = period_totals(snapshot['days'], period, snapshot['today'])
+    pending = snapshot['pending_count']
+    return f"""📊 Статистика: {PERIOD_TITLES[period]}
+──────────────
+📦 Заказов: {totals['orders']}
+💰 Выручка: {totals['revenue']} сом
+🧾 Средний чек: {totals['avg']} сом
+⏳ Ожидают подтверждения: {pending}
+──────────────
+🕒 Данные на {timezone.localtime(snapshot['updated_at']).strftime('%H:%M:%S')}"""
+
+
+def pending_message(snapshot):
+    total = snapshot['pending_count']
+    if not total:
+        return "✅ Заказов, ожидающих подтверждения, нет"
+    lines = [f"⏳ Ожидают подтверждения: {total}", "──────────────"]
+    for order in snapshot['pending']:
+        created = timezone.localtime(order['created_at']).strftime('%d.%m %H:%M')
+        paid = ' • 💳' if order['paid'] else ''
+        lines.append(
+            f"#{order['id']} • {order['total_price']} сом • {order['first_name']} {order['last_name']} "
+            f"• {order['phone']} • {created}{paid}"
+        )
+    if total > len(snapshot['pending']):
+        lines.append(f"и еще {total - len(snapshot['pending'])}")
+    return "\n".join(lines)
+
+
+def command_reply(command, args):
+    """Текст ответа на команду; данные только из снимка метрик в кэше"""
+    if command == 'stats':
+        period = (args[0].lower() if args else 'today')
+        period = PERIOD_ALIASES.get(period, period)
+        if period not in PERIOD_TITLES:
+            return "Использование: /stats today|week|month"
+        return stats_message(period, get_snapshot())
+    if command in ('pending', 'orders'):
+        return pending_message(get_snapshot())
+    if command in ('start', 'help'):
+        return HELP_TEXT
+    return None
+
+
+def update_subscription(message, active):
+    """/start подписывает чат на рассылки, /stop - отписывает"""
+    sender = message.get('from') or {}
+    TelegramUser.objects.update_or_create(chat_id=message['chat']['id'], defaults={
+        'username': sender.get('username'),
+        'first_name': sender.get('first_name'),
+        'last_name': sender.get('last_name'),
+        'is_active': active,
+    })
+    if active:
+        return "👋 Вы подписались на новости KG Style. Отписаться: /stop"
+    return "Вы отписались от рассылки. Подписаться снова: /start"
+
+
+def is_admin_chat(chat_id):
+    admin_chat_id = str(getattr(settings, 'TELEGRAM_ADMIN_CHAT_ID', '') or '')
+    return bool(admin_chat_id) and str(chat_id) == admin_chat_id
+
+
+def handle_message(message):
+    """Команды бота: статистика для администратора, подписка для остальных"""
+    chat_id = message.get('chat', {}).get('id')
+    command, args = parse_command(message.get('text') or '')
+    if command is None or chat_id is None:
+        return None
+    if is_admin_chat(chat_id):
+        reply = command_reply(command, args)
+    elif command in ('start', 'stop'):
+        reply = update_subscription(message, command == 'start')
+    else:
+        logger.warning(f"Команда /{command} из чужого чата {chat_id} проигнорирована")
+        return None
+    if reply is None or not telegram_bot.token:
+        return None
+    return telegram_bot.submit('send_message', chat_id=chat_id, text=reply)
@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from shop import metrics
+
+# Telegram хранит неподтвержденные обновления до суток
+DEDUP_TTL = 24 * 60 * 60
+DEDUP_LOCAL_SIZE = 10000
+DEDUP_CACHE_PREFIX = 'telegram:update:'
+DUPLICATES_METRIC = 'telegram.duplicates_dropped'
+
+
+def update_keys(update):
+    """Идентификаторы обновления: update_id и id нажатия кнопки"""
+    keys = []
+    if update.get('update_id') is not None:
+        keys.append(f"u:{update['update_id']}")
+    callback_id = (update.get('callback_query') or {}).get('id')
+    if callback_id:
+        keys.append(f"c:{callback_id}")
+    return keys
+
+
+class UpdateDeduplicator:
+    """Отбрасывает повторные доставки обновлений Telegram
+
+    Сначала проверяется локальный LRU процесса, затем общий для процессов кэш
+    (cache.add атомарен: из двух одновременных доставок пройдет одна).
+    """
+
+    def __init__(self, size=DEDUP_LOCAL_SIZE, ttl=DEDUP_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _remember(self, key):
+        with self._lock:
+            self._seen[key] = True
+            self._seen.move_to_end(key)
+            if len(self._seen) > self.size:
+                self._seen.popitem(last=False)
+
+    def _seen_locally(self, key):
+        with self._lock:
+            if key in self._seen:
+                self._seen.move_to_end(key)
+                return True
+            return False
+
+    def is_duplicate(self, update):
+        """Отмечает обновление как принятое; True, если оно уже было"""
+        keys = update_keys(update)
+        duplicate = any(self._seen_locally(key) for key in keys)
+        if not duplicate:
+            for key in keys:
+                if not cache.add(DEDUP_CACHE_PREFIX + key, 1, self.ttl):
+                    duplicate = True
+                self._remember(key)
+        if duplicate:
+            metrics.incr(DUPLICATES_METRIC)
+        return duplicate
+
+    def forget(self, update):
+        """Снимает отметку, если обновление не удалось принять в обработку"""
+        keys = update_keys(update)
+        with self._lock:
+            for key in keys:
+                self._seen.pop(key, None)
+        cache.delete_many([DEDUP_CACHE_PREFIX + key for key in keys])
+
+    def dropped(self):
+        """Сколько повторных доставок отброшено"""
+        return metrics.snapshot([DUPLICATES_METRIC])[DUPLICATES_METRIC]
+
+
+deduplicator = UpdateDeduplicator()
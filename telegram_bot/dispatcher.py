@@ -0,0 +1,68 @@
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+DEFAULT_QUEUE_SIZE = 1000
+
+
+class UpdateDispatcher:
+    """Обрабатывает обновления Telegram в пуле потоков, отдельно от запроса webhook
+
+    Очередь ограничена: при переполнении submit() возвращает False, и webhook
+    отвечает 503, чтобы Telegram доставил обновление повторно позже.
+    """
+
+    def __init__(self, handler, workers=None, queue_size=None):
+        self.handler = handler
+        self.workers = workers or getattr(settings, 'TELEGRAM_WEBHOOK_WORKERS', DEFAULT_WORKERS)
+        self.queue_size = queue_size or getattr(settings, 'TELEGRAM_WEBHOOK_QUEUE_SIZE', DEFAULT_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._queue = None
+        self._threads = []
+        self._pid = None
+
+    def _ensure_started(self):
+        with self._lock:
+            # После fork потоки родителя в дочернем процессе не работают
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.Queue(self.queue_size)
+                self._threads = [
+                    threading.Thread(target=self._work, args=(self._queue,), name=f'telegram-updates-{i}', daemon=True)
+                    for i in range(self.workers)
+                ]
+                self._pid = os.getpid()
+                for thread in self._threads:
+                    thread.start()
+            return self._queue
+
+    def submit(self, update):
+        """Ставит обновление в очередь; False, если очередь заполнена"""
+        try:
+            self._ensure_started().put_nowait(update)
+            return True
+        except queue.Full:
+            logger.warning(f"Очередь обновлений Telegram заполнена, update_id={update.get('update_id')}")
+            return False
+
+    def join(self):
+        """Ждет обработки всех поставленных обновлений (для тестов и остановки)"""
+        if self._queue is not None:
+            self._queue.join()
+
+    def _work(self, updates):
+        while True:
+            update = updates.get()
+            try:
+                self.handler(update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления Telegram {update.get('update_id')}: {e}")
+            finally:
+                close_old_connections()
+                updates.task_done()
@@ -0,0 +1,131 @@
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class FakeBotAPIServer:
+    """Локальная замена api.telegram.org для тестов
+
+    Запоминает все вызовы, отвечает как Bot API и умеет по запросу возвращать
+    ошибки (например, 429 с retry_after). Используется с настройкой
+    TELEGRAM_API_BASE_URL=server.base_url.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self._failures = defaultdict(deque)
+        self._updates = []
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_port}/bot'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='fake-bot-api', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self._failures.clear()
+            self._updates.clear()
+
+    def fail_next(self, method, status=500, description='Internal Server Error', retry_after=None, times=1):
+        """Следующие times вызовов method завершатся ошибкой"""
+        error = {'ok': False, 'error_code': status, 'description': description}
+        if retry_after is not None:
+            error['parameters'] = {'retry_after': retry_after}
+        with self._lock:
+            self._failures[method].extend([error] * times)
+
+    def push_update(self, update):
+        """Обновление, которое вернет getUpdates, пока его не подтвердят смещением"""
+        with self._lock:
+            self._updates.append(update)
+
+    def calls_to(self, method):
+        with self._lock:
+            return [params for name, params, _ in self.calls if name == method]
+
+    def wait_for(self, method, count=1, timeout=5):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if len(self.calls_to(method)) >= count:
+                return True
+            time.sleep(0.01)
+        return False
+
+    def _respond(self, method, params):
+        with self._lock:
+            self.calls.append((method, params, time.monotonic()))
+            failures = self._failures.get(method)
+            if failures:
+                error = failures.popleft()
+                return error['error_code'], error
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        elif method == 'sendMessage':
+            result = {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        elif method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            limit = int(params.get('limit') or 100)
+            with self._lock:
+                # Как и Telegram, запрос со смещением подтверждает все обновления до него
+                self._updates = [update for update in self._updates if update['update_id'] >= offset]
+                result = self._updates[:limit]
+        else:
+            result = True
+        return 200, {'ok': True, 'result': result}
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    params = json.loads(body or '{}')
+                else:
+                    params = dict(parse_qsl(body))
+                status, payload = server._respond(self.path.rsplit('/', 1)[-1], params)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,49 @@
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_bot.bot import telegram_bot
+from telegram_bot.broadcast import BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY, BroadcastSender
+from telegram_bot.models import Broadcast, TelegramUser
+
+
+class Command(BaseCommand):
+    help = 'Рассылка сообщения активным подписчикам бота с продолжением после остановки'
+
+    def add_arguments(self, parser):
+        target = parser.add_mutually_exclusive_group(required=True)
+        target.add_argument('--text', help='Текст новой рассылки')
+        target.add_argument('--resume', type=int, metavar='ID', help='Продолжить рассылку с контрольной точки')
+        parser.add_argument('--parse-mode', default='', choices=['', 'HTML', 'MarkdownV2'], help='Разметка текста')
+        parser.add_argument('--concurrency', type=int, default=BROADCAST_CONCURRENCY,
+                            help='Число одновременных отправок')
+        parser.add_argument('--batch-size', type=int, default=BROADCAST_BATCH_SIZE,
+                            help='Получателей в пачке (контрольная точка сохраняется после каждой)')
+
+    def handle(self, *args, **options):
+        if not telegram_bot.token:
+            raise CommandError('TELEGRAM_BOT_TOKEN не настроен')
+        if options['resume']:
+            try:
+                broadcast = Broadcast.objects.get(pk=options['resume'])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f"Рассылка #{options['resume']} не найдена")
+            if broadcast.status == 'done':
+                raise CommandError(f"Рассылка #{broadcast.pk} уже завершена")
+        else:
+            broadcast = Broadcast.objects.create(text=options['text'], parse_mode=options['parse_mode'])
+
+        sender = BroadcastSender(broadcast, concurrency=options['concurrency'], batch_size=options['batch_size'])
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: sender.stop())
+
+        remaining = TelegramUser.objects.filter(is_active=True, id__gt=broadcast.last_user_id).count()
+        self.stdout.write(f"Рассылка #{broadcast.pk}: получателей осталось {remaining}")
+        broadcast = sender.run()
+        self.stdout.write(
+            f"Рассылка #{broadcast.pk} - {broadcast.get_status_display().lower()}. Доставлено: {broadcast.sent}, "
+            f"ошибок: {broadcast.failed}, заблокировали бота: {broadcast.blocked}"
+        )
+        if broadcast.status == 'paused':
+            self.stdout.write(f"Продолжить: python manage.py broadcast --resume {broadcast.pk}")
+        telegram_bot.shutdown()
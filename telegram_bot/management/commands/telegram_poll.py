@@ -0,0 +1,32 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from telegram_bot.polling import BATCH_LIMIT, POLL_TIMEOUT, UpdatePoller
+
+
+class Command(BaseCommand):
+    help = 'Получает обновления бота через getUpdates (long polling) вместо webhook'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Число потоков обработки пачки')
+        parser.add_argument('--timeout', type=int, default=POLL_TIMEOUT, help='Таймаут long polling в секундах')
+        parser.add_argument('--limit', type=int, default=BATCH_LIMIT, help='Максимум обновлений в одном ответе')
+        parser.add_argument('--once', action='store_true', help='Обработать накопившиеся обновления и завершиться')
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            raise CommandError('TELEGRAM_BOT_TOKEN не настроен')
+        poller = UpdatePoller(
+            concurrency=options['concurrency'],
+            # В режиме --once ждать новых обновлений незачем
+            timeout=0 if options['once'] else options['timeout'],
+            limit=options['limit'],
+        )
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: poller.stop())
+
+        self.stdout.write('Webhook отключен, получение обновлений через getUpdates...')
+        poller.run(once=options['once'])
+        self.stdout.write('Получение обновлений остановлено')
@@ -0,0 +1,117 @@
+from datetime import timedelta
+
+from django.contrib.sites.models import Site
+from django.db.models import Prefetch
+
+from shop.models import CartItem, OrderItem
+
+# Поля позиций, которые нужны сообщениям: товар подтягивается тем же запросом
+ITEM_FIELDS = ('order', 'product', 'quantity', 'price', 'product__name')
+CART_ITEM_FIELDS = ('cart', 'product', 'quantity', 'product__name', 'product__price')
+LINE = '──────────────'
+
+
+def message_items_prefetch():
+    """Prefetch позиций заказа с названием товара - один запрос на любые размеры заказа"""
+    return Prefetch('items', queryset=OrderItem.objects.select_related('product').only(*ITEM_FIELDS).order_by('id'))
+
+
+def with_message_items(queryset):
+    """Заказы вместе со всем, что нужно для сообщений Telegram"""
+    return queryset.prefetch_related(message_items_prefetch())
+
+
+def order_items(order):
+    """Позиции заказа: из prefetch, если он был, иначе одним запросом"""
+    if 'items' in getattr(order, '_prefetched_objects_cache', {}):
+        return list(order.items.all())
+    return list(order.items.select_related('product').only(*ITEM_FIELDS).order_by('id'))
+
+
+def items_summary(items, limit=None):
+    """«Товар x2, Товар x1 и еще 3 шт.»"""
+    shown = items if limit is None else items[:limit]
+    parts = [f"{item.product.name} x{item.quantity}" for item in shown]
+    if len(items) > len(shown):
+        parts.append(f"и еще {len(items) - len(shown)} шт.")
+    return ", ".join(parts)
+
+
+def admin_order_message(order, site_domain=None, items_limit=None):
+    """Текст и клавиатура уведомления администратору о новом заказе"""
+    items = order_items(order)
+    # Конвертируем время в Кыргызстан (+6 UTC)
+    kg_time = order.created_at + timedelta(hours=6)
+
+    # Site кэшируется фреймворком sites: запрос только при первом вызове в процессе
+    domain = site_domain or Site.objects.get_current().domain
+
+    message = f"""🤖 Бот KG Style:
+{LINE}
+💰 НОВЫЙ ЗАКАЗ
+{LINE}
+📦 Заказ: #{order.id}
+💰 Сумма: {order.total_price} сом
+🔖 Код: {order.qr_code}
+{LINE}
+👤 Клиент:
+• Имя: {order.first_name} {order.last_name}
+• Email: {order.email}
+• Тел: {order.phone}
+{LINE}
+📍 Доставка:
+• Город: {order.city}
+• Адрес: {order.address}
+• Индекс: {order.postal_code or 'Не указан'}
+{LINE}
+⏰ Время: {kg_time.strftime('%d.%m.%Y %H:%M')} (KG)
+🛒 Товары: {items_summary(items, items_limit)}
+{LINE}
+
+🔗 Админка: https://{domain}/admin/shop/order/{order.id}/change/
+🛍️ Страница заказа: https://{domain}/order/{order.id}/
+⚠️ Вход в админку: https://{domain}/admin/
+{LINE}"""
+
+    keyboard = {
+        "inline_keyboard": [
+            [
+                {"text": "✅ Подтвердить", "callback_data": f"confirm_payment_{order.id}"},
+                {"text": "❌ Отклонить", "callback_data": f"reject_payment_{order.id}"}
+            ]
+        ]
+    }
+    return message, keyboard
+
+
+def customer_payment_message(order):
+    """Сообщение клиента администратору с перечнем товаров и суммами"""
+    items_text = "".join(
+        f"• {item.product.name} x{item.quantity} = {item.total_price} сом\n" for item in order_items(order)
+    )
+    return f"""Здравствуйте! Я хочу оплатить заказ #{order.id}
+
+📦 Товары:
+{items_text}
+💰 Итого: {order.total_price} сом
+👤 Имя: {order.first_name} {order.last_name}
+📞 Тел: {order.phone}
+📍 Адрес: {order.address}, {order.city}"""
+
+
+def simple_payment_message(order):
+    """Короткое сообщение клиента: номер заказа и товары по строкам"""
+    lines = [f"{item.product.name} {item.quantity} шт." for item in order_items(order)]
+    products_text = "\n".join(lines) if lines else "нет товаров"
+    return f"Я хочу оплатить заказ #{order.id}: {products_text}"
+
+
+def cart_lines(cart):
+    """Строки корзины и итог одним запросом (товары через JOIN)"""
+    items = CartItem.objects.filter(cart=cart).select_related('product').only(*CART_ITEM_FIELDS).order_by('id')
+    lines, total = [], 0
+    for item in items:
+        item_total = item.product.price * item.quantity
+        total += item_total
+        lines.append(f"• {item.product.name} x{item.quantity} = {item_total} сом")
+    return lines, total
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UpdateOffset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True, verbose_name='Бот')),
+                ('offset', models.BigIntegerField(default=0, verbose_name='Смещение')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Смещение обновлений',
+                'verbose_name_plural': 'Смещения обновлений',
+            },
+        ),
+    ]
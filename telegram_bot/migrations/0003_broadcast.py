@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7 on 2026-10-19 06:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0002_update_offset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Текст')),
+                ('parse_mode', models.CharField(blank=True, default='', max_length=10, verbose_name='Разметка')),
+                ('status', models.CharField(choices=[('draft', 'Черновик'), ('running', 'Отправляется'), ('paused', 'Остановлена'), ('done', 'Завершена')], default='draft', max_length=20, verbose_name='Статус')),
+                ('last_user_id', models.BigIntegerField(default=0, verbose_name='Последний обработанный пользователь')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='Доставлено')),
+                ('failed', models.PositiveIntegerField(default=0, verbose_name='Ошибок')),
+                ('blocked', models.PositiveIntegerField(default=0, verbose_name='Заблокировали бота')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начата')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'Рассылка',
+                'verbose_name_plural': 'Рассылки',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BroadcastDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='Chat ID')),
+                ('status', models.CharField(choices=[('sent', 'Доставлено'), ('failed', 'Ошибка'), ('blocked', 'Бот заблокирован')], max_length=20, verbose_name='Статус')),
+                ('error', models.CharField(blank=True, default='', max_length=255, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата')),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='telegram_bot.broadcast')),
+            ],
+            options={
+                'verbose_name': 'Доставка рассылки',
+                'verbose_name_plural': 'Доставки рассылки',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='broadcastdelivery',
+            constraint=models.UniqueConstraint(fields=('broadcast', 'chat_id'), name='unique_broadcast_delivery'),
+        ),
+    ]
@@ -15,3 +15,71 @@ class TelegramUser(models.Model):
     
     def __str__(self):
         return f"@{self.username}" if self.username else f"Chat {self.chat_id}"
+
+
+class UpdateOffset(models.Model):
+    """Смещение getUpdates: следующее еще не обработанное update_id"""
+    name = models.CharField(max_length=50, unique=True, verbose_name="Бот")
+    offset = models.BigIntegerField(default=0, verbose_name="Смещение")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    class Meta:
+        verbose_name = "Смещение обновлений"
+        verbose_name_plural = "Смещения обновлений"
+
+    def __str__(self):
+        return f"{self.name}: {self.offset}"
+
+
+class Broadcast(models.Model):
+    """Рассылка подписчикам бота; last_user_id - контрольная точка для продолжения"""
+    STATUS_CHOICES = [
+        ('draft', 'Черновик'),
+        ('running', 'Отправляется'),
+        ('paused', 'Остановлена'),
+        ('done', 'Завершена'),
+    ]
+
+    text = models.TextField(verbose_name="Текст")
+    parse_mode = models.CharField(max_length=10, blank=True, default='', verbose_name="Разметка")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft', verbose_name="Статус")
+    last_user_id = models.BigIntegerField(default=0, verbose_name="Последний обработанный пользователь")
+    sent = models.PositiveIntegerField(default=0, verbose_name="Доставлено")
+    failed = models.PositiveIntegerField(default=0, verbose_name="Ошибок")
+    blocked = models.PositiveIntegerField(default=0, verbose_name="Заблокировали бота")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="Начата")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершена")
+
+    class Meta:
+        verbose_name = "Рассылка"
+        verbose_name_plural = "Рассылки"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"Рассылка #{self.id} ({self.get_status_display()})"
+
+
+class BroadcastDelivery(models.Model):
+    """Результат отправки рассылки одному получателю"""
+    STATUS_CHOICES = [
+        ('sent', 'Доставлено'),
+        ('failed', 'Ошибка'),
+        ('blocked', 'Бот заблокирован'),
+    ]
+
+    broadcast = models.ForeignKey(Broadcast, on_delete=models.CASCADE, related_name='deliveries')
+    chat_id = models.BigIntegerField(verbose_name="Chat ID")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, verbose_name="Статус")
+    error = models.CharField(max_length=255, blank=True, default='', verbose_name="Ошибка")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата")
+
+    class Meta:
+        verbose_name = "Доставка рассылки"
+        verbose_name_plural = "Доставки рассылки"
+        constraints = [
+            models.UniqueConstraint(fields=['broadcast', 'chat_id'], name='unique_broadcast_delivery'),
+        ]
+
+    def __str__(self):
+        return f"{self.chat_id}: {self.get_status_display()}"
@@ -0,0 +1,114 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import UpdateOffset
+from .views import process_update
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30
+BATCH_LIMIT = 100
+# Пауза после ошибки сети или API растет до этого значения
+MAX_ERROR_PAUSE = 60
+# Нажатия кнопок и команды администратора (/stats, /pending)
+ALLOWED_UPDATES = ['callback_query', 'message']
+
+
+class PollingError(Exception):
+    def __init__(self, message, retry_after=None):
+        self.retry_after = retry_after
+        super().__init__(message)
+
+
+class UpdatePoller:
+    """Получает обновления через getUpdates вместо webhook
+
+    Один запрос long polling возвращает всю накопившуюся пачку; она обрабатывается
+    пулом потоков, после чего смещение сохраняется в БД. Telegram считает
+    обновления подтвержденными при следующем запросе с этим смещением.
+
+    Повторы отсекает только смещение. Дедупликатор webhook отмечает обновление
+    до обработки: после падения посреди пачки он отбросил бы ее повторную доставку.
+    """
+
+    def __init__(self, concurrency=4, timeout=POLL_TIMEOUT, limit=BATCH_LIMIT, name='default'):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.limit = limit
+        self.name = name
+        self.session = requests.Session()
+        self.stopping = threading.Event()
+
+    @property
+    def api_url(self):
+        return f"{settings.TELEGRAM_API_BASE_URL}{settings.TELEGRAM_BOT_TOKEN}"
+
+    def call(self, method, params=None, http_timeout=10):
+        try:
+            response = self.session.post(f"{self.api_url}/{method}", json=params or {}, timeout=http_timeout)
+            result = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise PollingError(f"{method}: {e}")
+        if not result.get('ok'):
+            retry_after = result.get('parameters', {}).get('retry_after')
+            raise PollingError(f"{method}: {result.get('description')}", retry_after)
+        return result['result']
+
+    def delete_webhook(self):
+        """getUpdates не работает, пока у бота установлен webhook"""
+        self.call('deleteWebhook', {'drop_pending_updates': False})
+
+    def load_offset(self):
+        return UpdateOffset.objects.get_or_create(name=self.name)[0].offset
+
+    def save_offset(self, offset):
+        UpdateOffset.objects.update_or_create(name=self.name, defaults={'offset': offset})
+
+    def _process(self, update):
+        try:
+            process_update(update)
+        except Exception as e:
+            logger.error(f"Ошибка обработки обновления Telegram {update.get('update_id')}: {e}")
+        finally:
+            close_old_connections()
+
+    def poll_once(self, pool, offset):
+        """Одна пачка обновлений; возвращает новое смещение"""
+        updates = self.call('getUpdates', {
+            'offset': offset, 'limit': self.limit, 'timeout': self.timeout, 'allowed_updates': ALLOWED_UPDATES,
+        }, http_timeout=self.timeout + 10)
+        if not updates:
+            return offset
+        list(pool.map(self._process, updates))
+        offset = max(update['update_id'] for update in updates) + 1
+        # Смещение фиксируется только после обработки всей пачки: при падении она придет снова
+        self.save_offset(offset)
+        logger.info(f"Обработано обновлений Telegram: {len(updates)}")
+        return offset
+
+    def run(self, once=False):
+        self.delete_webhook()
+        offset = self.load_offset()
+        pause = 1
+        with ThreadPoolExecutor(self.concurrency, thread_name_prefix='telegram-poll') as pool:
+            while not self.stopping.is_set():
+                try:
+                    new_offset = self.poll_once(pool, offset)
+                    pause = 1
+                except PollingError as e:
+                    logger.warning(f"Ошибка getUpdates: {e}")
+                    self.stopping.wait(e.retry_after or pause)
+                    pause = min(pause * 2, MAX_ERROR_PAUSE)
+                    continue
+                if once and new_offset == offset:
+                    break
+                offset = new_offset
+        self.session.close()
+
+    def stop(self):
+        self.stopping.set()
@@ -0,0 +1,114 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+# Лимиты Bot API: около 30 сообщений в секунду на бота и 20 в минуту в одну группу
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_CHAT_RATE_PER_MINUTE = 20
+# Корзины чатов, которые давно не использовались, удаляются при таком их числе
+MAX_CHAT_BUCKETS = 10000
+
+# Методы, которые Telegram считает отправкой сообщения
+RATE_LIMITED_METHODS = {'send_message', 'send_photo', 'send_document', 'edit_message_text'}
+
+
+def retry_after_seconds(error):
+    """retry_after из telegram.error.RetryAfter (число или timedelta в зависимости от версии)"""
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if isinstance(retry_after, timedelta) else float(retry_after)
+
+
+class TokenBucket:
+    """Корзина токенов с резервированием: отрицательный остаток - очередь будущих отправок"""
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now):
+        """Через сколько секунд освободится токен"""
+        self.refill(now)
+        wait = 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def idle(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class SendScheduler:
+    """Общий и поканальный лимиты отправки в Bot API для всех потоков процесса
+
+    reserve() занимает место в обеих корзинах и возвращает, сколько нужно подождать
+    перед отправкой; ответ 429 с retry_after приостанавливает чат через backoff().
+    """
+
+    def __init__(self, global_rate=None, chat_rate_per_minute=None, clock=time.monotonic):
+        self.global_rate = global_rate or getattr(settings, 'TELEGRAM_GLOBAL_RATE', DEFAULT_GLOBAL_RATE)
+        per_minute = chat_rate_per_minute or getattr(
+            settings, 'TELEGRAM_CHAT_RATE_PER_MINUTE', DEFAULT_CHAT_RATE_PER_MINUTE
+        )
+        self.chat_rate = per_minute / 60
+        self.chat_capacity = per_minute
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._global = TokenBucket(self.global_rate, self.global_rate, self.clock())
+            self._chats = {}
+
+    def _chat(self, chat_id, now):
+        bucket = self._chats.get(str(chat_id))
+        if bucket is None:
+            if len(self._chats) >= MAX_CHAT_BUCKETS:
+                self._chats = {key: value for key, value in self._chats.items() if not value.idle(now)}
+            bucket = self._chats[str(chat_id)] = TokenBucket(self.chat_rate, self.chat_capacity, now)
+        return bucket
+
+    def delay(self, chat_id):
+        """Через сколько секунд в чат можно будет отправить сообщение (без резервирования)"""
+        with self._lock:
+            now = self.clock()
+            return max(self._global.wait(now), self._chat(chat_id, now).wait(now))
+
+    def available(self, chat_id):
+        """Сколько сообщений можно отправить в чат прямо сейчас"""
+        with self._lock:
+            now = self.clock()
+            chat = self._chat(chat_id, now)
+            if chat.wait(now) > 0 or self._global.wait(now) > 0:
+                return 0
+            return int(min(chat.tokens, self._global.tokens))
+
+    def reserve(self, chat_id, max_wait=None):
+        """Резервирует отправку; возвращает задержку в секундах или None, если ждать дольше max_wait"""
+        with self._lock:
+            now = self.clock()
+            chat = self._chat(chat_id, now)
+            wait = max(self._global.wait(now), chat.wait(now))
+            if max_wait is not None and wait > max_wait:
+                return None
+            self._global.tokens -= 1
+            chat.tokens -= 1
+            return wait
+
+    def backoff(self, chat_id, seconds):
+        """Telegram ответил 429: до истечения retry_after в чат ничего не отправляем"""
+        with self._lock:
+            now = self.clock()
+            chat = self._chat(chat_id, now)
+            chat.blocked_until = max(chat.blocked_until, now + seconds)
+
+
+scheduler = SendScheduler()
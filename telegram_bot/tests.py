@@ -1,3 +1,376 @@
-from django.test import TestCase
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+
+from shop.models import Category, Order, OrderItem, OutboxMessage, Product
+from . import views
+from .bot import TelegramBot
+from .dedup import UpdateDeduplicator, deduplicator
+from .dispatcher import UpdateDispatcher
+from dashboard.metrics import get_snapshot
+from .commands import command_reply
+from .fake_api import FakeBotAPIServer
+from .messages import admin_order_message, customer_payment_message, simple_payment_message, with_message_items
+from .broadcast import BroadcastSender
+from .models import Broadcast, BroadcastDelivery, TelegramUser, UpdateOffset
+from .polling import UpdatePoller
+from .ratelimit import SendScheduler, scheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class SendSchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = SendScheduler(global_rate=30, chat_rate_per_minute=20, clock=self.clock)
+
+    def test_chat_limit_queues_messages_over_budget(self):
+        waits = [self.scheduler.reserve('admin') for _ in range(22)]
+        self.assertEqual(waits[:20], [0] * 20)
+        self.assertAlmostEqual(waits[20], 3)
+        self.assertAlmostEqual(waits[21], 6)
+        self.assertEqual(self.scheduler.available('admin'), 0)
+        self.clock.now += 60
+        self.assertEqual(self.scheduler.available('admin'), 18)
+
+    def test_max_wait_does_not_consume_budget(self):
+        for _ in range(20):
+            self.scheduler.reserve('admin')
+        self.assertIsNone(self.scheduler.reserve('admin', max_wait=1))
+        self.assertAlmostEqual(self.scheduler.delay('admin'), 3)
+
+    def test_global_limit_shared_by_chats(self):
+        waits = [self.scheduler.reserve(chat_id) for chat_id in range(31)]
+        self.assertEqual(waits[:30], [0] * 30)
+        self.assertAlmostEqual(waits[30], 1 / 30)
+
+    def test_retry_after_blocks_chat(self):
+        self.scheduler.backoff('admin', 15)
+        self.assertAlmostEqual(self.scheduler.delay('admin'), 15)
+        self.assertEqual(self.scheduler.delay('other'), 0)
+
+
+def callback_update(update_id, data, callback_id=None):
+    return {
+        'update_id': update_id,
+        'callback_query': {'id': callback_id or f'cb-{update_id}', 'data': data, 'message': {'chat': {'id': 42}}},
+    }
+
+
+class WebhookTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeBotAPIServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.reset()
+        cache.clear()
+        settings = self.settings(
+            TELEGRAM_BOT_TOKEN='123:fake', TELEGRAM_API_BASE_URL=self.server.base_url,
+            TELEGRAM_WEBHOOK_SECRET='s3cret',
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        user = User.objects.create_user('buyer', 'buyer@example.com')
+        self.user = user
+        self.order = self.create_order()
+
+    def create_order(self):
+        return Order.objects.create(
+            user=self.user, total_price=Decimal('100.00'), first_name='Иван', last_name='Петров',
+            email='buyer@example.com', phone='+996555000000', address='ул. Ленина, 1', city='Бишкек',
+        )
+
+    def post(self, update, secret='s3cret'):
+        return self.client.post(
+            '/telegram/webhook/', update, content_type='application/json',
+            HTTP_X_TELEGRAM_BOT_API_SECRET_TOKEN=secret,
+        )
+
+    def test_rejects_wrong_secret(self):
+        response = self.post(callback_update(1, f'confirm_payment_{self.order.id}'), secret='wrong')
+        self.assertEqual(response.status_code, 403)
+
+    def test_acknowledges_before_processing(self):
+        response = self.post(callback_update(1, f'confirm_payment_{self.order.id}'))
+        self.assertEqual(response.json(), {'status': 'ok'})
+        views.dispatcher.join()
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.paid)
+        self.assertEqual(OutboxMessage.objects.get().kind, 'email.order_status')
+        self.assertTrue(self.server.wait_for('answerCallbackQuery'))
+
+    def test_rejected_payment_returns_stock(self):
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        product = Product.objects.create(
+            name='Дрель', slug='drel', description='', price=Decimal('100.00'), stock=2, category=category,
+        )
+        OrderItem.objects.create(order=self.order, product=product, quantity=3, price=product.price)
+        self.post(callback_update(12, f'reject_payment_{self.order.id}'))
+        views.dispatcher.join()
+        self.order.refresh_from_db()
+        product.refresh_from_db()
+        self.assertEqual((self.order.status, product.stock), ('cancelled', 5))
+
+    def test_redelivered_update_processed_once(self):
+        update = callback_update(11, f'confirm_payment_{self.order.id}')
+        self.post(update)
+        views.dispatcher.join()
+        dropped = deduplicator.dropped()
+        self.assertEqual(self.post(update).json(), {'status': 'duplicate'})
+        views.dispatcher.join()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.version, 2)
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        self.assertEqual(deduplicator.dropped(), dropped + 1)
+
+    def test_full_queue_answers_503(self):
+        release = threading.Event()
+        busy = UpdateDispatcher(lambda update: release.wait(5), workers=1, queue_size=1)
+        self.addCleanup(release.set)
+        with mock.patch.object(views, 'dispatcher', busy):
+            statuses = []
+            for update_id in range(100, 103):
+                statuses.append(self.post(callback_update(update_id, 'noop')).status_code)
+                time.sleep(0.05)
+        self.assertEqual(statuses, [200, 200, 503])
+        # Отклоненное обновление при повторной доставке не считается дубликатом
+        self.assertFalse(deduplicator.is_duplicate(callback_update(102, 'noop')))
+
+    def test_polling_processes_batch_and_saves_offset(self):
+        orders = [self.order, self.create_order(), self.create_order()]
+        for update_id, order in enumerate(orders, start=200):
+            self.server.push_update(callback_update(update_id, f'confirm_payment_{order.id}'))
+        # Тестовая SQLite в памяти не допускает параллельной записи из потоков
+        UpdatePoller(concurrency=1, timeout=0).run(once=True)
+
+        self.assertEqual(Order.objects.filter(paid=True).count(), 3)
+        self.assertEqual(UpdateOffset.objects.get(name='default').offset, 203)
+        self.assertEqual(len(self.server.calls_to('deleteWebhook')), 1)
+        # Последний запрос подтвердил пачку смещением 203 и вернул пустой ответ
+        self.assertEqual(self.server.calls_to('getUpdates')[-1]['offset'], 203)
+        self.assertTrue(self.server.wait_for('answerCallbackQuery', count=3))
+
+    def test_polling_redelivered_batch_processed_after_crash(self):
+        self.server.push_update(callback_update(210, f'confirm_payment_{self.order.id}'))
+        with mock.patch('telegram_bot.polling.process_update', side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                UpdatePoller(concurrency=1, timeout=0).run(once=True)
+        self.assertFalse(UpdateOffset.objects.filter(offset__gt=0).exists())
+
+        UpdatePoller(concurrency=1, timeout=0).run(once=True)
+        self.order.refresh_from_db()
+        self.assertTrue(self.order.paid)
+        self.assertEqual(UpdateOffset.objects.get(name='default').offset, 211)
+
+    def test_admin_commands_answered_from_snapshot(self):
+        settings = self.settings(TELEGRAM_ADMIN_CHAT_ID='42')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        get_snapshot()
+        with self.assertNumQueries(0):
+            reply = command_reply('stats', ['week'])
+        self.assertIn('📦 Заказов: 1', reply)
+        self.assertIn(f'#{self.order.id} • 100.00 сом', command_reply('pending', []))
+
+        self.post({'update_id': 300, 'message': {'chat': {'id': 42}, 'text': '/stats@fake_bot today'}})
+        self.post({'update_id': 301, 'message': {'chat': {'id': 7}, 'text': '/pending'}})
+        views.dispatcher.join()
+        self.assertTrue(self.server.wait_for('sendMessage'))
+        sent = self.server.calls_to('sendMessage')
+        self.assertEqual([int(params['chat_id']) for params in sent], [42])
+        self.assertIn('Статистика: сегодня', sent[0]['text'])
+
+    def test_start_subscribes_to_broadcasts(self):
+        self.post({'update_id': 310, 'message': {
+            'chat': {'id': 555, 'type': 'private'}, 'from': {'id': 555, 'username': 'buyer'}, 'text': '/start',
+        }})
+        views.dispatcher.join()
+        self.assertTrue(TelegramUser.objects.get(chat_id=555, username='buyer').is_active)
+        self.assertTrue(self.server.wait_for('sendMessage'))
+
+
+class BroadcastTests(TransactionTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeBotAPIServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.reset()
+        scheduler.reset()
+        settings = self.settings(TELEGRAM_BOT_TOKEN='123:fake', TELEGRAM_API_BASE_URL=self.server.base_url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        TelegramUser.objects.bulk_create([TelegramUser(chat_id=1000 + i) for i in range(7)])
+        TelegramUser.objects.create(chat_id=999, is_active=False)
+        self.broadcast = Broadcast.objects.create(text='Скидки до 30%')
+
+    def test_sends_to_active_users_and_records_outcomes(self):
+        self.server.fail_next('sendMessage', status=403, description='Forbidden: bot was blocked by the user')
+        broadcast = BroadcastSender(self.broadcast, concurrency=1, batch_size=3).run()
+
+        self.assertEqual((broadcast.status, broadcast.sent, broadcast.blocked, broadcast.failed), ('done', 6, 1, 0))
+        self.assertEqual(BroadcastDelivery.objects.filter(broadcast=broadcast).count(), 7)
+        blocked = BroadcastDelivery.objects.get(status='blocked').chat_id
+        self.assertFalse(TelegramUser.objects.get(chat_id=blocked).is_active)
+        self.assertNotIn(999, [int(params['chat_id']) for params in self.server.calls_to('sendMessage')])
+
+    def test_resumes_from_checkpoint(self):
+        sender = BroadcastSender(self.broadcast, concurrency=2, batch_size=3)
+        send_batch = sender.send_batch
+
+        def send_and_crash(batch):
+            results = send_batch(batch)
+            sender.stop()
+            return results
+
+        with mock.patch.object(sender, 'send_batch', send_and_crash):
+            broadcast = sender.run()
+        self.assertEqual((broadcast.status, broadcast.sent), ('paused', 3))
+
+        broadcast = BroadcastSender(Broadcast.objects.get(pk=broadcast.pk), batch_size=3).run()
+        self.assertEqual((broadcast.status, broadcast.sent), ('done', 7))
+        chat_ids = sorted(int(params['chat_id']) for params in self.server.calls_to('sendMessage'))
+        self.assertEqual(chat_ids, list(range(1000, 1007)))
+
+    def test_crash_mid_run_leaves_broadcast_paused(self):
+        sender = BroadcastSender(self.broadcast, concurrency=2, batch_size=3)
+        send_batch = sender.send_batch
+        calls = []
+
+        def send_then_crash(batch):
+            calls.append(batch)
+            if len(calls) > 1:
+                raise TimeoutError('Bot API недоступен')
+            return send_batch(batch)
+
+        with mock.patch.object(sender, 'send_batch', send_then_crash), self.assertRaises(TimeoutError):
+            sender.run()
+        broadcast = Broadcast.objects.get(pk=self.broadcast.pk)
+        self.assertEqual((broadcast.status, broadcast.sent, broadcast.finished_at), ('paused', 3, None))
+
+        broadcast = BroadcastSender(broadcast, batch_size=3).run()
+        self.assertEqual((broadcast.status, broadcast.sent), ('done', 7))
+        chat_ids = sorted(int(params['chat_id']) for params in self.server.calls_to('sendMessage'))
+        self.assertEqual(chat_ids, list(range(1000, 1007)))
+
+
+class TelegramBotClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeBotAPIServer().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.reset()
+        scheduler.reset()
+        settings = self.settings(TELEGRAM_BOT_TOKEN='123:fake', TELEGRAM_API_BASE_URL=self.server.base_url)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.bot = TelegramBot()
+        self.addCleanup(self.bot.shutdown)
+
+    def test_messages_share_loop_and_client(self):
+        for future in [self.bot.send_message(chat_id, 'Привет') for chat_id in range(1, 6)]:
+            future.result(5)
+        loop, client = self.bot._loop, self.bot._client
+        self.bot.send_message(6, 'Еще').result(5)
+        self.assertIs(self.bot._loop, loop)
+        self.assertIs(self.bot._client, client)
+        # Клиент инициализируется (getMe) один раз, а не на каждое сообщение
+        self.assertEqual(len(self.server.calls_to('getMe')), 1)
+        self.assertEqual(len(self.server.calls_to('sendMessage')), 6)
+
+    def test_client_rebuilt_when_token_changes(self):
+        self.bot.send_message(1, 'Привет').result(5)
+        with self.settings(TELEGRAM_BOT_TOKEN='456:fake'):
+            self.bot.send_message(2, 'Привет').result(5)
+        self.assertEqual(len(self.server.calls_to('getMe')), 2)
+
+    def test_shutdown_stops_loop_and_next_call_restarts_it(self):
+        self.bot.send_message(1, 'Привет').result(5)
+        thread = self.bot._thread
+        self.bot.shutdown()
+        self.assertFalse(thread.is_alive())
+        self.bot.send_message(2, 'Привет').result(5)
+        self.assertIsNot(self.bot._thread, thread)
+        self.assertEqual(len(self.server.calls_to('sendMessage')), 2)
+
+
+class OrderMessageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('buyer', 'buyer@example.com')
+        category = Category.objects.create(name='Дрели', slug='dreli')
+        cls.orders = {}
+        for size in (1, 12):
+            order = Order.objects.create(
+                user=user, total_price=Decimal('100.00'), first_name='Иван', last_name='Петров',
+                email='buyer@example.com', phone='+996555000000', address='ул. Ленина, 1', city='Бишкек',
+            )
+            for i in range(size):
+                product = Product.objects.create(
+                    name=f'Дрель {size}-{i}', slug=f'drel-{size}-{i}', description='', price=Decimal('10.00'),
+                    category=category,
+                )
+                OrderItem.objects.create(order=order, product=product, price=product.price, quantity=2)
+            cls.orders[size] = order
+
+    def test_all_messages_rendered_in_two_queries(self):
+        Site.objects.get_current()
+        for size, order in self.orders.items():
+            with self.subTest(size=size), self.assertNumQueries(2):
+                loaded = with_message_items(Order.objects.all()).get(id=order.id)
+                text, keyboard = admin_order_message(loaded)
+                customer = customer_payment_message(loaded)
+                simple = simple_payment_message(loaded)
+            self.assertIn(f'Дрель {size}-{size - 1} x2', text)
+            self.assertIn(f'Дрель {size}-0 x2 = 20.00 сом', customer)
+            self.assertIn(f'Дрель {size}-0 2 шт.', simple)
+            self.assertEqual(keyboard['inline_keyboard'][0][0]['callback_data'], f'confirm_payment_{order.id}')
+
+    def test_items_limit(self):
+        text, _ = admin_order_message(self.orders[12], items_limit=3)
+        self.assertIn('Дрель 12-2 x2, и еще 9 шт.', text)
+
+
+class UpdateDeduplicatorTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_same_callback_in_new_update_is_duplicate(self):
+        first = UpdateDeduplicator(size=2)
+        self.assertFalse(first.is_duplicate(callback_update(1, 'x', callback_id='a')))
+        self.assertTrue(first.is_duplicate(callback_update(1, 'x', callback_id='a')))
+        self.assertTrue(first.is_duplicate(callback_update(2, 'x', callback_id='a')))
+        # Другой процесс с пустым LRU видит отметку через общий кэш
+        self.assertTrue(UpdateDeduplicator().is_duplicate(callback_update(1, 'x', callback_id='a')))
@@ -1,38 +1,88 @@
+import hmac
 import json
 import logging
+from asgiref.sync import sync_to_async
 from django.http import JsonResponse
-from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
-from telegram import Update
-from telegram.ext import CallbackContext
+from django.db import transaction
 from shop.models import Order
+from shop.outbox import enqueue
 from .bot import telegram_bot
+from .commands import handle_message
+from .dedup import deduplicator
+from .dispatcher import UpdateDispatcher
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
 
-@csrf_exempt
-@require_http_methods(["POST"])
-def telegram_webhook(request):
-    """Обработка webhook от Telegram бота"""
+SECRET_TOKEN_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Через сколько секунд Telegram стоит повторить доставку, если очередь переполнена
+WEBHOOK_RETRY_AFTER = 5
+
+
+def process_update(update):
+    """Обработка одного обновления Telegram (в потоке диспетчера)"""
+    if 'callback_query' in update:
+        handle_callback_query(update['callback_query'])
+    elif 'message' in update:
+        handle_message(update['message'])
+    else:
+        logger.debug(f"Пропущено обновление Telegram: {list(update.keys())}")
+
+
+dispatcher = UpdateDispatcher(process_update)
+
+
+def _valid_secret(request):
+    secret = getattr(settings, 'TELEGRAM_WEBHOOK_SECRET', '')
+    if not secret:
+        return True
+    return hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ''), secret)
+
+
+async def telegram_webhook(request):
+    """Обработка webhook от Telegram бота
+
+    Только проверяет запрос и ставит обновление в очередь: заказ, письма и ответ
+    на нажатие кнопки обрабатывает пул потоков после того, как Telegram получил 200.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=405)
+    if not _valid_secret(request):
+        logger.warning("Webhook Telegram с неверным секретным токеном")
+        return JsonResponse({'status': 'forbidden'}, status=403)
     try:
-        data = json.loads(request.body)
-        print(f"Получены данные от Telegram: {data}")  # Отладка
-        
-        # Проверяем структуру данных
-        if 'callback_query' in data:
-            callback_query_data = data['callback_query']
-            print(f"Получен callback_query: {callback_query_data}")  # Отладка
-            handle_callback_query(callback_query_data)
-        else:
-            print(f"Получен другой тип данных: {list(data.keys())}")  # Отладка
-        
-        return JsonResponse({'status': 'ok'})
-        
-    except Exception as e:
-        logger.error(f"Ошибка обработки webhook: {e}")
-        print(f"Ошибка webhook: {e}")  # Отладка
-        return JsonResponse({'status': 'error'}, status=500)
+        update = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'status': 'error'}, status=400)
+    if not isinstance(update, dict):
+        return JsonResponse({'status': 'error'}, status=400)
+
+    # Повторная доставка (Telegram не дождался ответа) отбрасывается до работы с БД.
+    # Дедупликатор ходит в кэш (Redis) по сети - не в цикле событий, который обслуживает и потоки SSE
+    if await sync_to_async(deduplicator.is_duplicate, thread_sensitive=False)(update):
+        logger.info(f"Повторное обновление Telegram {update.get('update_id')} отброшено")
+        return JsonResponse({'status': 'duplicate'})
+
+    if not dispatcher.submit(update):
+        # Telegram доставит обновление снова - оно не должно считаться повтором
+        await sync_to_async(deduplicator.forget, thread_sensitive=False)(update)
+        response = JsonResponse({'status': 'busy'}, status=503)
+        response['Retry-After'] = str(WEBHOOK_RETRY_AFTER)
+        return response
+    return JsonResponse({'status': 'ok'})
+
+# Telegram не передает CSRF-токен; подлинность запроса проверяет секретный токен
+telegram_webhook.csrf_exempt = True
+
+
+def answer_callback(callback_query, text, show_alert=False):
+    """Ответ на нажатие кнопки через фоновый клиент бота, без ожидания"""
+    if not telegram_bot.token or not callback_query.get('id'):
+        return None
+    return telegram_bot.submit(
+        'answer_callback_query', callback_query_id=callback_query['id'], text=text, show_alert=show_alert
+    )
+
 
 def handle_callback_query(callback_query):
     """Обработка нажатий на inline кнопки"""
@@ -40,23 +90,17 @@ def handle_callback_query(callback_query):
         data = callback_query.get('data', '')
         message = callback_query.get('message', {})
         chat_id = message.get('chat', {}).get('id')
-        callback_id = callback_query.get('id')
-        
-        print(f"Обработка callback data: {data}, chat_id: {chat_id}, callback_id: {callback_id}")  # Отладка
-        
+
         if data.startswith('confirm_payment_'):
             order_id = data.split('_')[-1]
-            print(f"Подтверждение оплаты заказа #{order_id}")  # Отладка
             confirm_order_payment(order_id, chat_id, callback_query)
-            
+
         elif data.startswith('reject_payment_'):
             order_id = data.split('_')[-1]
-            print(f"Отклонение оплаты заказа #{order_id}")  # Отладка
             reject_order_payment(order_id, chat_id, callback_query)
-            
+
     except Exception as e:
         logger.error(f"Ошибка обработки callback query: {e}")
-        print(f"Ошибка callback: {e}")  # Отладка
 
 # Для совместимости с polling
 async def handle_callback_query_async(update, context):
@@ -66,77 +110,24 @@ async def handle_callback_query_async(update, context):
 def confirm_order_payment(order_id, chat_id, callback_query):
     """Подтверждение оплаты заказа"""
     try:
-        print(f"Начало подтверждения оплаты заказа #{order_id}")  # Отладка
         order = Order.objects.get(id=order_id)
-        print(f"Найден заказ: статус={order.status}, paid={order.paid}")  # Отладка
-        
-        order.paid = True
-        order.status = 'confirmed'
-        order.save()
-        print(f"Заказ обновлен: статус={order.status}, paid={order.paid}")  # Отладка
-        
-        # Отправляем уведомления клиенту
-        try:
-            from shop.notifications import NotificationService
-            NotificationService.send_order_status_notification(order)
-            print("Уведомление клиенту отправлено")  # Отладка
-        except Exception as e:
-            logger.error(f"Ошибка отправки уведомлений клиенту: {e}")
-            print(f"Ошибка уведомлений: {e}")  # Отладка
-        
-        # Обновляем сообщение с кнопками
-        try:
-            # Для webhook используем requests
-            import requests
-            token = getattr(settings, 'TELEGRAM_BOT_TOKEN', None)
-            if token:
-                url = f"https://api.telegram.org/bot{token}/answerCallbackQuery"
-                data = {
-                    'callback_query_id': callback_query.get('id'),
-                    'text': '✅ Оплата подтверждена администратором.',
-                    'show_alert': False
-                }
-                response = requests.post(url, data=data)
-                print(f"Callback answer отправлен: {response.status_code}")  # Отладка
-        except Exception as e:
-            print(f"Ошибка отправки callback answer: {e}")  # Отладка
-        
+
+        # Письмо клиенту пишется в outbox в той же транзакции, что и статус заказа;
+        # отправит его воркер run_outbox, не задерживая ответ Telegram
+        with transaction.atomic():
+            order.paid = True
+            order.status = 'confirmed'
+            order.save()
+            enqueue('email.order_status', {'order_id': order.id})
+
+        answer_callback(callback_query, '✅ Оплата подтверждена администратором.')
         logger.info(f"Администратор подтвердил оплату заказа #{order_id}")
-        print(f"Подтверждение заказа #{order_id} завершено успешно")  # Отладка
-        
+
     except Order.DoesNotExist:
-        print(f"Заказ #{order_id} не найден")  # Отладка
-        # Отправляем ответ об ошибке
-        try:
-            import requests
-            token = getattr(settings, 'TELEGRAM_BOT_TOKEN', None)
-            if token:
-                url = f"https://api.telegram.org/bot{token}/answerCallbackQuery"
-                data = {
-                    'callback_query_id': callback_query.get('id'),
-                    'text': 'Заказ не найден',
-                    'show_alert': True
-                }
-                requests.post(url, data=data)
-        except:
-            pass
+        answer_callback(callback_query, 'Заказ не найден', show_alert=True)
     except Exception as e:
         logger.error(f"Ошибка подтверждения оплаты: {e}")
-        print(f"Ошибка подтверждения: {e}")  # Отладка
-        # Отправляем ответ об ошибке
-        try:
-            import requests
-            token = getattr(settings, 'TELEGRAM_BOT_TOKEN', None)
-            if token:
-                url = f"https://api.telegram.org/bot{token}/answerCallbackQuery"
-                data = {
-                    'callback_query_id': callback_query.get('id'),
-                    'text': 'Ошибка подтверждения оплаты',
-                    'show_alert': True
-                }
-                requests.post(url, data=data)
-        except:
-            pass
+        answer_callback(callback_query, 'Ошибка подтверждения оплаты', show_alert=True)
 
 def reject_order_payment(order_id, chat_id, callback_query):
     """Отклонение оплаты заказа"""
@@ -144,17 +135,12 @@ def reject_order_payment(order_id, chat_id, callback_query):
         order = Order.objects.get(id=order_id)
         order.status = 'cancelled'
         order.save()
-        
-        # Обновляем сообщение с кнопками
-        callback_query.edit_message_text(
-            text=f"❌ Оплата заказа #{order.id} отклонена администратором.",
-            reply_markup=None
-        )
-        
+
+        answer_callback(callback_query, f"❌ Оплата заказа #{order.id} отклонена администратором.")
         logger.info(f"Администратор отклонил оплату заказа #{order_id}")
-        
+
     except Order.DoesNotExist:
-        callback_query.answer("Заказ не найден", show_alert=True)
+        answer_callback(callback_query, "Заказ не найден", show_alert=True)
     except Exception as e:
         logger.error(f"Ошибка отклонения оплаты: {e}")
-        callback_query.answer("Ошибка отклонения оплаты", show_alert=True)
+        answer_callback(callback_query, "Ошибка отклонения оплаты", show_alert=True)
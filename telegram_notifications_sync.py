@@ -1,7 +1,15 @@
 import requests
 import json
+import time
 from django.conf import settings
 
+from telegram_bot.messages import admin_order_message
+
+def build_order_notification(order):
+    """Текст и клавиатура уведомления администратору о новом заказе"""
+    return admin_order_message(order)
+
+
 def send_telegram_notification_sync(order):
     """Отправить уведомление в Telegram (синхронно)"""
     try:
@@ -16,63 +24,10 @@ def send_telegram_notification_sync(order):
             print(f"👤 Клиент: {order.first_name} {order.last_name}")
             return False  # Возвращаем False чтобы показать что уведомление не отправлено
         
-        # Формируем сообщение с полной информацией
-        from datetime import datetime, timedelta
-        
-        # Конвертируем время в Кыргызстан (+6 UTC)
-        kg_time = order.created_at + timedelta(hours=6)
-        
-        # Получаем товары заказа
-        items = []
-        for item in order.items.all():
-            items.append(f"{item.product.name} x{item.quantity}")
-        items_text = ", ".join(items)
-        
-        # Получаем правильный URL админки
-        from django.contrib.sites.shortcuts import get_current_site
-        current_site = get_current_site(None)
-        admin_url = f"https://{current_site.domain}/admin/shop/order/{order.id}/change/"
-        order_url = f"https://{current_site.domain}/order/{order.id}/"
-        
-        message = f"""🤖 Бот KG Style:
-──────────────
-💰 НОВЫЙ ЗАКАЗ
-──────────────
-📦 Заказ: #{order.id}
-💰 Сумма: {order.total_price} сом
-🔖 Код: {order.qr_code}
-──────────────
-👤 Клиент:
-• Имя: {order.first_name} {order.last_name}
-• Email: {order.email}
-• Тел: {order.phone}
-──────────────
-📍 Доставка:
-• Город: {order.city}
-• Адрес: {order.address}
-• Индекс: {order.postal_code or 'Не указан'}
-──────────────
-⏰ Время: {kg_time.strftime('%d.%m.%Y %H:%M')} (KG)
-🛒 Товары: {items_text}
-──────────────
-
-🔗 Админка: {admin_url}
-🛍️ Страница заказа: {order_url}
-⚠️ Вход в админку: https://{current_site.domain}/admin/
-──────────────"""
-        
-        # Создаем кнопки
-        keyboard = {
-            "inline_keyboard": [
-                [
-                    {"text": "✅ Подтвердить", "callback_data": f"confirm_payment_{order.id}"},
-                    {"text": "❌ Отклонить", "callback_data": f"reject_payment_{order.id}"}
-                ]
-            ]
-        }
+        message, keyboard = build_order_notification(order)
         
         # URL для отправки сообщения
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
+        url = f"{settings.TELEGRAM_API_BASE_URL}{token}/sendMessage"
         
         # Данные для запроса
         data = {
@@ -82,8 +37,13 @@ def send_telegram_notification_sync(order):
             'parse_mode': 'HTML'
         }
         
-        # Отправляем запрос
+        # Отправляем запрос с учетом лимитов Bot API
+        from telegram_bot.ratelimit import scheduler
+        time.sleep(scheduler.reserve(chat_id))
         response = requests.post(url, data=data)
+        if response.status_code == 429:
+            retry_after = response.json().get('parameters', {}).get('retry_after', 1)
+            scheduler.backoff(chat_id, retry_after)
         
         if response.status_code == 200:
             result = response.json()
@@ -100,3 +60,26 @@ def send_telegram_notification_sync(order):
     except Exception as e:
         print(f"❌ Ошибка отправки: {e}")
         return False
+
+
+def enqueue_telegram_notification(order):
+    """Поставить уведомление в outbox; отправит его воркер manage.py run_outbox
+
+    Возвращает OutboxMessage или None, если бот не настроен.
+    """
+    from shop.outbox import enqueue_telegram
+
+    chat_id = settings.TELEGRAM_ADMIN_CHAT_ID
+    if not settings.TELEGRAM_BOT_TOKEN or not chat_id:
+        return None
+    message, keyboard = build_order_notification(order)
+    # Краткая форма для дайджеста, если уведомлений больше, чем пропускает лимит чата
+    digest = {
+        'title': '📦 Новые заказы',
+        'line': f"#{order.id} • {order.total_price} сом • {order.first_name} {order.last_name} • {order.phone}",
+        'buttons': [
+            {"text": f"✅ #{order.id}", "callback_data": f"confirm_payment_{order.id}"},
+            {"text": f"❌ #{order.id}", "callback_data": f"reject_payment_{order.id}"},
+        ],
+    }
+    return enqueue_telegram(chat_id, message, keyboard, parse_mode='HTML', digest=digest)
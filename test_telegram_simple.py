@@ -36,17 +36,11 @@ def test_telegram():
         
         print(f"📦 Найден заказ #{order.id}")
         
-        # Отправляем уведомление
-        import asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        try:
-            result = loop.run_until_complete(send_payment_notification(order))
-            print(f"✅ Результат: {result}")
-            return result
-        finally:
-            loop.close()
+        # Отправляем уведомление через фоновый клиент бота
+        future = send_payment_notification(order)
+        result = future.result(timeout=30) if future else None
+        print(f"✅ Результат: {result}")
+        return result
             
     except Exception as e:
         print(f"❌ Ошибка: {e}")